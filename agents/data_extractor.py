@@ -4,17 +4,194 @@ import re
 from typing import Dict, Any, Optional, List, Union
 from uuid import UUID
 import base64
+import hashlib
 import os
+import asyncio
+import io
+import math
+from copy import deepcopy
+
+import numpy as np
+
+from pydantic import BaseModel, ConfigDict, Field, ValidationError, model_validator
 
 from utils.base_agent import BaseAgent, AgentInput, AgentOutput, AgentContext
 from services.llm_factory import LLMFactory
 from storage.s3_handler import S3Handler
 from constants.prompt_mappings import AgentType, get_prompt_for_agent
 from constants.fallback_messages import GENERAL_FALLBACKS
+from constants.llm_configs import Models
+from utils.extraction_cache import extraction_cache, recent_extraction_results, make_cache_key
+from utils.dynamic_batcher import DynamicBatcher, dispatch_grouped
+from utils import json_utils
+from utils.image_utils import detect_image_format, peek_image_info
 
 # Configure logger for this module
 logger = logging.getLogger(__name__)
 
+# PIL is only needed for image formats the header parser does not recognise
+try:
+    from PIL import Image
+    has_pil = True
+except ImportError:
+    Image = None
+    has_pil = False
+
+# Bump when the extraction prompts change so cached results are not reused
+PROMPT_VERSION = "v1"
+
+# Matches JSON wrapped in a markdown code block, e.g. ```json {...} ```
+_JSON_FENCE_RE = re.compile(r'```(?:json)?\s*([\s\S]*?)\s*```')
+
+# Re-prompt the LLM this many times when its response is not valid JSON
+MAX_JSON_RETRIES = 2
+JSON_RETRY_BACKOFF_SECONDS = 1.0
+
+
+async def _extract_text_batch(requests: List[Any]) -> List[str]:
+    """
+    Run a batch of text extraction requests, one LLM call per LLM factory and user.
+    
+    Results of a combined prompt are matched to documents by position only, so
+    documents of different users are never combined; requests without a known
+    user are extracted on their own.
+    
+    Args:
+        requests: List of (llm_factory, user_id, content) tuples, user_id None if unknown
+        
+    Returns:
+        Raw extraction results in the same order as the requests
+    """
+    return await dispatch_grouped(
+        requests,
+        lambda request: None if request[1] is None else (id(request[0]), request[1]),
+        lambda group: group[0][0].extract_invoice_data_batch([content for _, _, content in group]),
+    )
+
+
+def _safe_float(value: Any, default: float = math.nan) -> float:
+    """Convert a value to float, returning `default` if it is missing or not numeric."""
+    # Numbers from the parsed JSON are the common case; avoid the try block for them
+    if isinstance(value, (int, float)):
+        return float(value)
+    if value is None:
+        return default
+    try:
+        return float(value)
+    except (ValueError, TypeError):
+        return default
+
+
+def _normalize_item_prices(items: List[Dict[str, Any]]) -> None:
+    """
+    Coerce line item prices to floats and fill in derivable prices, in place.
+    
+    Prices are converted in one vectorized pass: present but unparseable prices
+    become 0.0, a missing total_price is computed from quantity * unit_price,
+    and a missing unit_price is copied from total_price when quantity is 1.
+    
+    Args:
+        items: Line item dictionaries to update
+    """
+    count = len(items)
+    if not count:
+        return
+    
+    quantities = np.fromiter((_safe_float(item.get("quantity")) for item in items), dtype=np.float64, count=count)
+    unit_prices = np.fromiter((_safe_float(item.get("unit_price")) for item in items), dtype=np.float64, count=count)
+    total_prices = np.fromiter((_safe_float(item.get("total_price")) for item in items), dtype=np.float64, count=count)
+    has_unit = np.fromiter((item.get("unit_price") is not None for item in items), dtype=bool, count=count)
+    has_total = np.fromiter((item.get("total_price") is not None for item in items), dtype=bool, count=count)
+    
+    # Unparseable prices fall back to 0.0
+    unit_prices = np.where(has_unit & np.isnan(unit_prices), 0.0, unit_prices)
+    total_prices = np.where(has_total & np.isnan(total_prices), 0.0, total_prices)
+    computed_totals = quantities * unit_prices
+    
+    for i, item in enumerate(items):
+        if has_unit[i]:
+            item["unit_price"] = float(unit_prices[i])
+        if has_total[i]:
+            item["total_price"] = float(total_prices[i])
+        
+        # Calculate missing price information if possible
+        if ("total_price" not in item and "quantity" in item and "unit_price" in item
+                and not np.isnan(computed_totals[i])):
+            item["total_price"] = float(computed_totals[i])
+        
+        # If we have total_price but not unit_price and quantity is 1, set unit_price
+        if "total_price" in item and "unit_price" not in item and item.get("quantity") == 1:
+            item["unit_price"] = item["total_price"]
+
+
+def _parse_extraction_response(extraction_result: str) -> Any:
+    """
+    Parse a raw extraction response as JSON.
+    
+    Extraction requests JSON mode, so the response is normally bare JSON; markdown
+    code blocks are only searched for as a fallback (e.g. batched or non-OpenAI responses).
+    
+    Raises:
+        json_utils.JSONDecodeError: If no valid JSON could be found
+    """
+    try:
+        return json_utils.loads(extraction_result)
+    except json_utils.JSONDecodeError:
+        json_match = _JSON_FENCE_RE.search(extraction_result)
+        if not json_match:
+            raise
+        return json_utils.loads(json_match.group(1).strip())
+
+
+class ExtractedVendor(BaseModel):
+    """Vendor section of an extraction result."""
+    name: str = Field(min_length=1)
+
+
+class ExtractedTransaction(BaseModel):
+    """Transaction section of an extraction result."""
+    date: Any = None
+    receipt_no: Any = None
+    
+    @model_validator(mode="after")
+    def check_reference(self) -> "ExtractedTransaction":
+        if not self.date and not self.receipt_no:
+            raise ValueError("Missing key transaction details (date and receipt number)")
+        return self
+
+
+class ExtractedItem(BaseModel):
+    """Line item of an extraction result."""
+    description: str = Field(min_length=1)
+    unit_price: Any = None
+    total_price: Any = None
+    
+    @model_validator(mode="after")
+    def check_price(self) -> "ExtractedItem":
+        if self.unit_price is None and self.total_price is None:
+            raise ValueError("Item missing price information")
+        return self
+
+
+class ExtractedFinancial(BaseModel):
+    """Financial section of an extraction result."""
+    total: Union[float, str]
+
+
+class ExtractedInvoice(BaseModel):
+    """Minimum structure a complete extraction result must have."""
+    model_config = ConfigDict(extra="ignore")
+    
+    vendor: ExtractedVendor
+    transaction: ExtractedTransaction
+    items: List[ExtractedItem] = Field(min_length=1)
+    financial: ExtractedFinancial
+
+
+# Coalesces concurrent text extractions into multi-document prompts.
+# Images are not batched since vision requests do not combine well.
+_text_extraction_batcher = DynamicBatcher(_extract_text_batch)
+
 
 class DataExtractorAgent(BaseAgent):
     """
@@ -35,6 +212,8 @@ class DataExtractorAgent(BaseAgent):
         self.s3_handler = S3Handler()
         self.agent_type_text = AgentType.INVOICE_DATA_EXTRACTION
         self.agent_type_image = AgentType.INVOICE_IMAGE_DATA_EXTRACTION
+        self.extraction_cache = extraction_cache
+        self.recent_results = recent_extraction_results
     
     async def process(self, 
                      agent_input: AgentInput, 
@@ -49,6 +228,7 @@ class DataExtractorAgent(BaseAgent):
         Returns:
             AgentOutput with extracted invoice data
         """
+        s3_upload_task = None
         try:
             # Extract file content and metadata from input
             file_content = agent_input.content
@@ -72,139 +252,190 @@ class DataExtractorAgent(BaseAgent):
                     }
                 )
             
+            # Return the previous output directly if this user just uploaded the same file
+            content_bytes = file_content if isinstance(file_content, bytes) else file_content.encode("utf-8")
+            result_key = (user_id, content_type, hashlib.blake2b(content_bytes).hexdigest())
+            recent_output = self.recent_results.get(result_key)
+            if recent_output is not None:
+                logger.info(f"Returning recent extraction result for duplicate upload: {file_path}")
+                return recent_output.model_copy(deep=True)
+            
+            # Only images can be sent to the LLM as binary content; anything else
+            # would reach it as a bare file description it cannot extract from.
+            # Images are recognised by content type or, failing that, by magic bytes.
+            is_image = isinstance(file_content, bytes) and (
+                (bool(content_type) and (
+                    "image" in content_type.lower() or content_type.lower() in ["png", "jpg", "jpeg"]
+                ))
+                or detect_image_format(file_content) is not None
+            )
+            if isinstance(file_content, bytes) and not is_image:
+                logger.warning(f"Unsupported binary content type for extraction: {content_type}")
+                return AgentOutput(
+                    content={},
+                    confidence=0.0,
+                    status="error",
+                    error=f"Unsupported binary content type: {content_type}",
+                    metadata={
+                        "file_path": file_path,
+                        "file_type": file_type
+                    }
+                )
+            
             logger.info(f"Extracting data from invoice file: {file_path} (type: {file_type})")
             
-            # Upload the original file to S3 if user_id is present
-            s3_metadata = None
+            # Upload the original file to S3 if user_id is present. The upload runs in a
+            # worker thread so it overlaps with content preparation and the LLM call.
             if user_id != "unknown" and isinstance(file_content, bytes):
-                try:
-                    s3_result = self.s3_handler.upload_file(
-                        file_content=file_content,
-                        file_name=file_name,
-                        user_id=user_id,
-                        content_type=content_type,
-                        file_type="invoices",
-                        metadata={"original_path": file_path}
-                    )
-                    logger.info(f"Uploaded invoice file to S3: {s3_result['file_key']}")
-                    s3_metadata = s3_result
-                except Exception as e:
-                    logger.error(f"Failed to upload invoice to S3: {str(e)}")
-                    # Continue with extraction even if S3 upload fails
+                s3_upload_task = asyncio.create_task(asyncio.to_thread(
+                    self._upload_to_s3, file_content, file_name, user_id, content_type, file_path
+                ))
             
             # Prepare content for LLM processing
             content_for_llm = None
             
-            # For binary content like images, we need special handling
+            # For images, encode as base64 for vision models
             if isinstance(file_content, bytes):
-                # For images, encode as base64 for vision models
-                if content_type and ("image" in content_type.lower() or content_type.lower() in ["png", "jpg", "jpeg"]):
-                    # Get additional file info
-                    file_size = len(file_content)
-                    
-                    # Try to get image dimensions if possible
-                    dimensions = "unknown"
-                    mime_type = "image/jpeg"  # Default to image/jpeg if unknown
-                    
-                    try:
-                        from PIL import Image
-                        import io
+                # Get additional file info
+                file_size = len(file_content)
+                
+                # Try to get image dimensions if possible
+                dimensions = "unknown"
+                mime_type = "image/jpeg"  # Default to image/jpeg if unknown
+                
+                try:
+                    # Read size and format from the header, decoding with PIL only
+                    # for formats the header parser does not recognise
+                    image_info = peek_image_info(file_content)
+                    if image_info:
+                        width, height, img_format = image_info
+                    elif has_pil:
                         img = Image.open(io.BytesIO(file_content))
-                        dimensions = f"{img.width}x{img.height}"
-                        logger.info(f"Image dimensions: {dimensions}")
-                        
-                        # Get the actual format from PIL and convert to MIME type
+                        width, height = img.width, img.height
                         img_format = img.format.lower() if img.format else "jpeg"
-                        if img_format == "jpeg" or img_format == "jpg":
-                            mime_type = "image/jpeg"
-                        elif img_format == "png":
-                            mime_type = "image/png"
-                        elif img_format == "gif":
-                            mime_type = "image/gif"
-                        elif img_format == "webp":
-                            mime_type = "image/webp"
-                        else:
-                            mime_type = f"image/{img_format}"
-                            
-                        logger.info(f"Detected image format: {img_format}, using MIME type: {mime_type}")
-                    except Exception as e:
-                        logger.warning(f"Could not determine image dimensions or format: {str(e)}")
-                        
-                        # Try to determine MIME type from content_type if possible
-                        if "jpeg" in content_type.lower() or "jpg" in content_type.lower():
-                            mime_type = "image/jpeg"
-                        elif "png" in content_type.lower():
-                            mime_type = "image/png"
-                        elif "gif" in content_type.lower():
-                            mime_type = "image/gif"
-                        elif "webp" in content_type.lower():
-                            mime_type = "image/webp"
+                    else:
+                        raise ValueError("Unrecognised image header and PIL is not installed")
+                    dimensions = f"{width}x{height}"
+                    logger.info(f"Image dimensions: {dimensions}")
+                    
+                    # Convert the detected format to a MIME type
+                    if img_format == "jpeg" or img_format == "jpg":
+                        mime_type = "image/jpeg"
+                    elif img_format == "png":
+                        mime_type = "image/png"
+                    elif img_format == "gif":
+                        mime_type = "image/gif"
+                    elif img_format == "webp":
+                        mime_type = "image/webp"
+                    else:
+                        mime_type = f"image/{img_format}"
                         
-                    # Encode image as base64 for GPT-4o-mini vision processing
-                    base64_image = base64.b64encode(file_content).decode('utf-8')
-                    content_for_llm = {
-                        "type": "image",
-                        "content": base64_image,
-                        "mime_type": mime_type,
-                        "dimensions": dimensions
-                    }
-                    logger.info(f"Prepared image for GPT-4o-mini processing: {file_size} bytes, mime type: {mime_type}")
-                else:
-                    # For other binary files, create a descriptive message
-                    content_for_llm = f"Binary file: {file_path}, type: {content_type}, size: {len(file_content)} bytes"
+                    logger.info(f"Detected image format: {img_format}, using MIME type: {mime_type}")
+                except Exception as e:
+                    logger.warning(f"Could not determine image dimensions or format: {str(e)}")
+                    
+                    # Try to determine MIME type from content_type if possible
+                    if "jpeg" in content_type.lower() or "jpg" in content_type.lower():
+                        mime_type = "image/jpeg"
+                    elif "png" in content_type.lower():
+                        mime_type = "image/png"
+                    elif "gif" in content_type.lower():
+                        mime_type = "image/gif"
+                    elif "webp" in content_type.lower():
+                        mime_type = "image/webp"
+                    
+                # Encode image as base64 for GPT-4o-mini vision processing
+                base64_image = base64.b64encode(memoryview(file_content)).decode('ascii')
+                content_for_llm = {
+                    "type": "image",
+                    "content": base64_image,
+                    "mime_type": mime_type,
+                    "dimensions": dimensions
+                }
+                logger.info(f"Prepared image for GPT-4o-mini processing: {file_size} bytes, mime type: {mime_type}")
             else:
                 # For text content, we can pass it directly
                 content_for_llm = file_content
             
-            # Call LLM to extract data from the file
-            logger.info(f"Calling GPT-4o-mini for invoice data extraction")
-            extraction_result = await self.llm_factory.extract_invoice_data(content_for_llm)
-            
-            # Parse the response - handle triple backtick JSON format
-            try:
-                # Try to extract JSON from markdown code blocks if present
-                json_match = re.search(r'```(?:json)?\s*([\s\S]*?)\s*```', extraction_result)
-                if json_match:
-                    json_str = json_match.group(1).strip()
-                    parsed_result = json.loads(json_str)
+            # Look up a previous extraction of the same content before calling the LLM
+            extraction_agent_type = (
+                self.agent_type_image if isinstance(content_for_llm, dict) else self.agent_type_text
+            )
+            # Vision extraction always runs on GPT-4o-mini, text uses the configured model
+            llm_provider = self.llm_factory.config.get("provider", "")
+            llm_model = (
+                Models.GPT4O_MINI if isinstance(content_for_llm, dict)
+                else self.llm_factory.config.get("model", Models.DEFAULT)
+            )
+            cache_key = make_cache_key(
+                extraction_agent_type, PROMPT_VERSION, file_content, llm_provider, llm_model
+            )
+            parsed_result = self.extraction_cache.get(cache_key)
+            from_cache = False
+            
+            if parsed_result is not None:
+                if self._validate_extracted_data(parsed_result):
+                    logger.info(f"Using cached extraction result for: {file_path}")
+                    from_cache = True
+                else:
+                    # Schema no longer matches what we expect - evict and re-extract
+                    logger.warning("Cached extraction result failed validation, evicting")
+                    self.extraction_cache.delete(cache_key)
+                    parsed_result = None
+            
+            if parsed_result is None:
+                # Call LLM to extract data from the file
+                logger.info(f"Calling GPT-4o-mini for invoice data extraction")
+                if isinstance(content_for_llm, str):
+                    extraction_result = await _text_extraction_batcher.submit(
+                        (self.llm_factory, None if user_id == "unknown" else user_id, content_for_llm)
+                    )
                 else:
-                    parsed_result = json.loads(extraction_result)
+                    extraction_result = await self.llm_factory.extract_invoice_data(content_for_llm)
                 
-                logger.debug(f"Parsed data extraction result: {parsed_result}")
-            except json.JSONDecodeError:
-                logger.warning(f"Failed to parse data extraction result as JSON: {extraction_result}")
-                # Create a fallback result if parsing fails
-                parsed_result = {
-                    "vendor": {},
-                    "transaction": {},
-                    "items": [],
-                    "financial": {},
-                    "additional_info": {},
-                    "confidence_score": 0.0,
-                    "error": "Failed to parse extraction response"
-                }
+                # Parse the response, asking the LLM to fix invalid JSON if needed
+                parsed_result = await self._parse_or_retry(extraction_result, content_for_llm)
+                
+                # Skip building the repr of a potentially large result unless it is logged
+                if logger.isEnabledFor(logging.DEBUG):
+                    logger.debug("Parsed data extraction result: %s", parsed_result)
             
             # Extract confidence score and check for errors
-            confidence = parsed_result.get("confidence_score", 0.0)
+            confidence = _safe_float(parsed_result.get("confidence_score"), 0.0)
             error = parsed_result.get("error", None)
+            if error is not None and not isinstance(error, str):
+                error = str(error)
+            
+            # Detect the result format once for validation and normalization
+            is_test_format = self._is_test_sample_data_format(parsed_result)
             
             # Determine status based on extraction completeness
             status = "success"
             if error:
                 status = "error"
                 logger.error(f"Error in extracted data: {error}")
-            elif not self._validate_extracted_data(parsed_result):
+            elif from_cache:
+                # Cached results were already validated when they were recalled
+                pass
+            elif not self._validate_extracted_data(parsed_result, is_test_format):
                 status = "incomplete_extraction"
                 logger.warning("Extracted data is incomplete or invalid")
+            else:
+                # Only complete, valid extractions are worth replaying
+                self.extraction_cache.put(cache_key, parsed_result, model=llm_model)
             
             # Clean and normalize the extracted data
-            normalized_data = self._normalize_extracted_data(parsed_result)
+            normalized_data = self._normalize_extracted_data(parsed_result, is_test_format)
+            
+            # Wait for the S3 upload started above before reporting its result
+            s3_metadata = await s3_upload_task if s3_upload_task else None
             
             # Add S3 metadata to the output if available
             metadata = {
                 "file_path": file_path,
                 "file_type": file_type,
-                "raw_extraction_result": parsed_result
+                "raw_extraction_result": parsed_result,
+                "from_cache": from_cache
             }
             
             if s3_metadata:
@@ -223,8 +454,9 @@ class DataExtractorAgent(BaseAgent):
             else:
                 logger.warning("No items found in extraction result")
             
-            # Prepare the output
-            return AgentOutput(
+            # Prepare the output. Every field was checked or coerced above, so the
+            # model is built without running pydantic validation again.
+            output = AgentOutput.model_construct(
                 content=normalized_data,
                 confidence=confidence,
                 status=status,
@@ -232,18 +464,107 @@ class DataExtractorAgent(BaseAgent):
                 metadata=metadata
             )
             
+            if status == "success":
+                self.recent_results.put(result_key, output.model_copy(deep=True))
+            
+            return output
+            
         except Exception as e:
             logger.error(f"Error extracting data from file: {str(e)}", exc_info=True)
+            metadata = {
+                "file_path": agent_input.metadata.get('file_path', ''),
+                "file_type": agent_input.metadata.get('file_type', 'unknown')
+            }
+            
+            # Let an in-flight S3 upload finish rather than orphaning it, and still
+            # report where the original file was stored
+            if s3_upload_task:
+                s3_metadata, = await asyncio.gather(s3_upload_task, return_exceptions=True)
+                if isinstance(s3_metadata, dict):
+                    metadata["s3_storage"] = s3_metadata
+            
             return AgentOutput(
                 content={},
                 confidence=0.0,
                 status="error",
                 error=f"Data extraction failed: {str(e)}",
-                metadata={
-                    "file_path": agent_input.metadata.get('file_path', ''),
-                    "file_type": agent_input.metadata.get('file_type', 'unknown')
+                metadata=metadata
+            )
+    
+    async def _parse_or_retry(self,
+                              extraction_result: str,
+                              content_for_llm: Union[str, Dict[str, Any]],
+                              attempt: int = 0) -> Dict[str, Any]:
+        """
+        Parse an extraction response, re-prompting the LLM with the parse error if it is not valid JSON.
+        
+        Args:
+            extraction_result: Raw response from the LLM
+            content_for_llm: The content that was sent to the LLM
+            attempt: Number of retries made so far
+            
+        Returns:
+            The parsed result, or a fallback result with an error if the response
+            is still invalid after MAX_JSON_RETRIES retries
+        """
+        try:
+            return _parse_extraction_response(extraction_result)
+        except json_utils.JSONDecodeError as e:
+            if attempt >= MAX_JSON_RETRIES:
+                logger.warning(f"Failed to parse data extraction result as JSON: {extraction_result}")
+                # Create a fallback result if parsing fails
+                return {
+                    "vendor": {},
+                    "transaction": {},
+                    "items": [],
+                    "financial": {},
+                    "additional_info": {},
+                    "confidence_score": 0.0,
+                    "error": "Failed to parse extraction response"
                 }
+            
+            logger.warning(f"Extraction response is not valid JSON, retrying ({attempt + 1}/{MAX_JSON_RETRIES}): {str(e)}")
+            await asyncio.sleep(JSON_RETRY_BACKOFF_SECONDS * (attempt + 1))
+            retry_result = await self.llm_factory.extract_invoice_data(
+                content_for_llm,
+                feedback=f"Your previous output was not valid JSON: {str(e)}. Return ONLY valid JSON."
             )
+            return await self._parse_or_retry(retry_result, content_for_llm, attempt + 1)
+    
+    def _upload_to_s3(self,
+                      file_content: bytes,
+                      file_name: str,
+                      user_id: str,
+                      content_type: str,
+                      file_path: str) -> Optional[Dict[str, Any]]:
+        """
+        Upload the original invoice file to S3.
+        
+        Args:
+            file_content: Raw file bytes
+            file_name: Original file name
+            user_id: ID of the user who owns the file
+            content_type: MIME type or file type of the content
+            file_path: Original path of the file
+            
+        Returns:
+            S3 upload details, or None if the upload failed
+        """
+        try:
+            s3_result = self.s3_handler.upload_file(
+                file_content=file_content,
+                file_name=file_name,
+                user_id=user_id,
+                content_type=content_type,
+                file_type="invoices",
+                metadata={"original_path": file_path}
+            )
+            logger.info(f"Uploaded invoice file to S3: {s3_result['file_key']}")
+            return s3_result
+        except Exception as e:
+            logger.error(f"Failed to upload invoice to S3: {str(e)}")
+            # Continue with extraction even if S3 upload fails
+            return None
     
     def _is_test_sample_data_format(self, data: Dict[str, Any]) -> bool:
         """
@@ -268,71 +589,47 @@ class DataExtractorAgent(BaseAgent):
             
         return False
     
-    def _validate_extracted_data(self, data: Dict[str, Any]) -> bool:
+    def _validate_extracted_data(self,
+                                 data: Dict[str, Any],
+                                 is_test_format: Optional[bool] = None) -> bool:
         """
         Validate the extracted data for completeness and correctness.
         
         Args:
             data: The extracted data dictionary
+            is_test_format: Precomputed result of _is_test_sample_data_format, if known
             
         Returns:
             True if the data is valid and complete, False otherwise
         """
+        if is_test_format is None:
+            is_test_format = self._is_test_sample_data_format(data)
+        
         # If it's in the test format, use a different validation logic
-        if self._is_test_sample_data_format(data):
+        if is_test_format:
             # For test data format, we just need a vendor and some basic info
             return (
                 isinstance(data.get("vendor"), str) and data.get("vendor") and
                 isinstance(data.get("items", []), list)
             )
             
-        # Check for required top-level sections
-        required_sections = ["vendor", "transaction", "items", "financial"]
-        if not all(section in data for section in required_sections):
-            missing = [s for s in required_sections if s not in data]
-            logger.warning(f"Missing required sections in extracted data: {missing}")
-            return False
-        
-        # Vendor section should have a name at minimum
-        if not data.get("vendor", {}).get("name"):
-            logger.warning("Missing vendor name in extracted data")
-            return False
-        
-        # Transaction section should have some basic info
-        transaction = data.get("transaction", {})
-        if not transaction.get("date") and not transaction.get("receipt_no"):
-            logger.warning("Missing key transaction details (date and receipt number)")
-            return False
-        
-        # Items section should have at least one item
-        items = data.get("items", [])
-        if not items or not isinstance(items, list):
-            logger.warning("Missing or invalid items list in extracted data")
-            return False
-        
-        # Each item should have description and price
-        for i, item in enumerate(items):
-            if not isinstance(item, dict):
-                logger.warning(f"Item {i} is not a dictionary: {item}")
-                return False
-            
-            if not item.get("description"):
-                logger.warning(f"Item {i} missing description")
-                return False
-            
-            # Either unit_price or total_price should be present
-            if not (item.get("unit_price") is not None or item.get("total_price") is not None):
-                logger.warning(f"Item {i} missing price information")
-                return False
-        
-        # Financial section should have a total
-        if data.get("financial", {}).get("total") is None:
-            logger.warning("Missing total amount in extracted data")
+        # Check the required sections, vendor name, transaction reference,
+        # item prices and total in a single schema validation pass
+        try:
+            ExtractedInvoice.model_validate(data)
+        except ValidationError as e:
+            errors = "; ".join(
+                f"{'.'.join(str(loc) for loc in error['loc']) or 'data'}: {error['msg']}"
+                for error in e.errors()
+            )
+            logger.warning(f"Extracted data failed validation: {errors}")
             return False
         
         return True
     
-    def _normalize_extracted_data(self, data: Dict[str, Any]) -> Dict[str, Any]:
+    def _normalize_extracted_data(self,
+                                  data: Dict[str, Any],
+                                  is_test_format: Optional[bool] = None) -> Dict[str, Any]:
         """
         Clean and normalize the extracted data.
         
@@ -341,16 +638,20 @@ class DataExtractorAgent(BaseAgent):
         
         Args:
             data: The raw extracted data dictionary
+            is_test_format: Precomputed result of _is_test_sample_data_format, if known
             
         Returns:
             Normalized data dictionary
         """
+        if is_test_format is None:
+            is_test_format = self._is_test_sample_data_format(data)
+        
         # Handle test format data differently
-        if self._is_test_sample_data_format(data):
+        if is_test_format:
             return data
             
         # Create a deep copy to avoid modifying the original
-        normalized = json.loads(json.dumps(data))
+        normalized = deepcopy(data)
         
         # Handle potential None values in vendor section
         vendor = normalized.get("vendor", {})
@@ -371,37 +672,12 @@ class DataExtractorAgent(BaseAgent):
         if items is None:
             normalized["items"] = []
         else:
-            # Process each item
+            # Replace missing items before coercing prices
             for i, item in enumerate(items):
                 if item is None:
                     items[i] = {"description": "Unknown item"}
-                    continue
-                
-                # Ensure numeric values for prices
-                if "unit_price" in item and item["unit_price"] is not None:
-                    try:
-                        items[i]["unit_price"] = float(item["unit_price"])
-                    except (ValueError, TypeError):
-                        items[i]["unit_price"] = 0.0
-                
-                if "total_price" in item and item["total_price"] is not None:
-                    try:
-                        items[i]["total_price"] = float(item["total_price"])
-                    except (ValueError, TypeError):
-                        items[i]["total_price"] = 0.0
-                
-                # Calculate missing price information if possible
-                if "quantity" in item and "unit_price" in item and "total_price" not in item:
-                    try:
-                        quantity = float(item["quantity"])
-                        unit_price = float(item["unit_price"])
-                        items[i]["total_price"] = quantity * unit_price
-                    except (ValueError, TypeError):
-                        pass
-                
-                # If we have total_price but not unit_price and quantity is 1, set unit_price
-                if "total_price" in item and "unit_price" not in item and item.get("quantity") == 1:
-                    items[i]["unit_price"] = item["total_price"]
+            
+            _normalize_item_prices([item for item in items if isinstance(item, dict)])
         
         # Handle financial section
         financial = normalized.get("financial", {})
@@ -409,30 +685,21 @@ class DataExtractorAgent(BaseAgent):
             normalized["financial"] = {}
         else:
             # Ensure numeric values for financial amounts
-            for key in ["subtotal", "total"]:
-                if key in financial and financial[key] is not None:
-                    try:
-                        financial[key] = float(financial[key])
-                    except (ValueError, TypeError):
-                        financial[key] = 0.0
+            for key in ("subtotal", "total"):
+                if financial.get(key) is not None:
+                    financial[key] = _safe_float(financial[key], 0.0)
             
             # Handle tax details
-            if "tax" in financial:
-                tax = financial["tax"]
-                if isinstance(tax, dict):
-                    if "total" in tax and tax["total"] is not None:
-                        try:
-                            tax["total"] = float(tax["total"])
-                        except (ValueError, TypeError):
-                            tax["total"] = 0.0
-                    
-                    if "details" in tax and isinstance(tax["details"], list):
-                        for j, detail in enumerate(tax["details"]):
-                            if "amount" in detail and detail["amount"] is not None:
-                                try:
-                                    tax["details"][j]["amount"] = float(detail["amount"])
-                                except (ValueError, TypeError):
-                                    tax["details"][j]["amount"] = 0.0
+            tax = financial.get("tax")
+            if isinstance(tax, dict):
+                if tax.get("total") is not None:
+                    tax["total"] = _safe_float(tax["total"], 0.0)
+                
+                details = tax.get("details")
+                if isinstance(details, list):
+                    for detail in details:
+                        if detail.get("amount") is not None:
+                            detail["amount"] = _safe_float(detail["amount"], 0.0)
         
         # Handle additional_info section
         additional_info = normalized.get("additional_info", {})
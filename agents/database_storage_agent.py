@@ -5,13 +5,17 @@ This module implements the agent responsible for storing extracted invoice data
 in the database using appropriate schema mapping and data validation.
 """
 
+import asyncio
 import logging
-import json
+import io
 import uuid
+from functools import cached_property
 from typing import Dict, Any, Optional, List, Union
 from datetime import datetime
 from uuid import UUID
 
+import numpy as np
+from sqlalchemy import insert, text
 from sqlalchemy.orm import Session
 from sqlalchemy.exc import SQLAlchemyError
 
@@ -19,11 +23,106 @@ from utils.base_agent import BaseAgent, AgentInput, AgentOutput, AgentContext
 from services.llm_factory import LLMFactory
 from database.connection import SessionLocal
 from database import schemas
-from utils.vector_utils import get_embedding_generator
+from utils import json_utils
 
 # Configure logger for this module
 logger = logging.getLogger(__name__)
 
+# Item batches at least this large are written with PostgreSQL COPY instead of INSERT
+COPY_ITEMS_THRESHOLD = 100
+
+# JSON payloads larger than this are stream-parsed, keeping only the fields stored below
+STREAM_PARSE_THRESHOLD = 256 * 1024
+
+# Top-level extraction result fields read by process and store_invoice_data
+_STORED_FIELDS = frozenset({
+    "data", "vendor", "transaction", "financial", "additional_info", "items",
+    "metadata", "file_size", "total_amount", "currency"
+})
+
+# Columns written by the COPY path, in buffer order (timestamps use the server defaults)
+_COPY_ITEM_COLUMNS = (
+    "id", "invoice_id", "description", "quantity", "unit_price", "total_price",
+    "item_category", "item_code", "description_embedding"
+)
+
+
+def _copy_value(value: Any) -> str:
+    """Format a value for PostgreSQL's COPY text format."""
+    if value is None:
+        return "\\N"
+    if isinstance(value, (list, tuple)):
+        # pgvector parses vectors from their '[x,y,...]' text form
+        return "[" + ",".join(repr(float(v)) for v in value) + "]"
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return (
+        str(value)
+        .replace("\\", "\\\\")
+        .replace("\t", "\\t")
+        .replace("\n", "\\n")
+        .replace("\r", "\\r")
+    )
+
+
+def _coerce_user_id(user_id: Union[str, int, UUID]) -> int:
+    """
+    Map a user ID onto the integer users.id key.
+    
+    Args:
+        user_id: User ID from the agent context; '0' is the test user
+        
+    Returns:
+        Integer user ID, or 1 when the ID is not numeric (e.g. a UUID)
+    """
+    if isinstance(user_id, int):
+        return user_id
+    if isinstance(user_id, UUID):
+        # A UUID's text form is never all digits, and a surrogate such as
+        # user_id.int would not reference an existing users row
+        return 1
+    if isinstance(user_id, str) and user_id.isdigit():
+        return int(user_id)
+    try:
+        # Handles less common forms such as signs or surrounding whitespace
+        return int(user_id)
+    except (ValueError, TypeError):
+        logger.warning(f"Could not convert user_id to integer: {user_id}, using default: 1")
+        return 1
+
+
+def _parse_invoice_date(value: str) -> datetime:
+    """Parse a YYYY-MM-DD invoice date, trying the C-level ISO parser first."""
+    try:
+        return datetime.fromisoformat(value)
+    except ValueError:
+        # strptime also accepts unpadded dates such as 2024-3-5
+        return datetime.strptime(value, "%Y-%m-%d")
+
+
+def _item_amounts(items: List[Dict[str, Any]]) -> Optional[List[tuple]]:
+    """
+    Convert item quantities and prices to floats one column at a time.
+    
+    Args:
+        items: Item dictionaries from the extraction result
+        
+    Returns:
+        (quantity, unit_price, total_price) per item, or None if any value is
+        missing or not numeric so the caller can convert row by row instead
+    """
+    columns = []
+    for field, default in (("quantity", 1), ("unit_price", 0), ("total_price", 0)):
+        try:
+            column = np.array([item.get(field, default) for item in items], dtype=np.float64)
+        except (TypeError, ValueError):
+            return None
+        # None converts to NaN rather than raising, so treat NaN as unconvertible
+        if np.isnan(column).any():
+            return None
+        columns.append(column.tolist())
+    return list(zip(*columns))
+
 
 class DatabaseStorageAgent(BaseAgent):
     """
@@ -42,8 +141,18 @@ class DatabaseStorageAgent(BaseAgent):
             llm_factory: Optional LLMFactory instance for LLM operations
         """
         super().__init__(llm_factory)
-        # Initialize the embedding generator
-        self.embedding_generator = get_embedding_generator()
+    
+    @cached_property
+    def embedding_generator(self):
+        """
+        Embedding generator, loaded on first use rather than at construction.
+        
+        Returns:
+            The shared EmbeddingGenerator instance
+        """
+        # Import here so the embedding backends only load when items are stored
+        from utils.vector_utils import get_embedding_generator
+        return get_embedding_generator()
         
     async def process(self, agent_input: AgentInput, context: AgentContext) -> AgentOutput:
         """
@@ -68,9 +177,12 @@ class DatabaseStorageAgent(BaseAgent):
                     # Try to parse as JSON
                     logger.info("Content is a string, attempting to parse as JSON")
                     logger.debug(f"JSON string length: {len(content)} bytes")
-                    extraction_result = json.loads(content)
+                    if len(content) > STREAM_PARSE_THRESHOLD:
+                        extraction_result = json_utils.loads_keys(content, _STORED_FIELDS)
+                    else:
+                        extraction_result = json_utils.loads(content)
                     logger.info(f"JSON parse success, keys: {extraction_result.keys() if isinstance(extraction_result, dict) else 'not a dict'}")
-                except json.JSONDecodeError as e:
+                except json_utils.JSONDecodeError as e:
                     error_message = f"Invalid JSON: {str(e)}"
                     logger.error(f"JSON parse error: {error_message}")
                     return AgentOutput(
@@ -130,7 +242,8 @@ class DatabaseStorageAgent(BaseAgent):
             
             # Store the invoice data
             logger.info(f"Calling store_invoice_data with user_id: {user_id}")
-            store_result = self.store_invoice_data(extraction_result, user_id)
+            # The ORM work is blocking, so run it off the event loop
+            store_result = await asyncio.to_thread(self.store_invoice_data, extraction_result, user_id)
             logger.info(f"Store invoice data returned: {store_result}")
             
             # Ensure the store_result has a status field
@@ -193,31 +306,8 @@ class DatabaseStorageAgent(BaseAgent):
             # Log the invoice_data keys for debugging
             logger.info(f"invoice_data keys: {invoice_data.keys() if isinstance(invoice_data, dict) else 'not a dict'}")
             
-            # Parse user_id to UUID if it's a string
-            # Handle special case for test user with ID '0'
-            if user_id == '0' or user_id == 0:
-                # For test user with ID 0, use integer
-                user_id_value = 0
-                logger.info("Using integer ID 0 for test user")
-            else:
-                # For non-test users, convert UUID to string and then to integer if possible
-                try:
-                    if isinstance(user_id, UUID):
-                        # Try to extract numeric part from UUID if needed
-                        user_id_str = str(user_id)
-                        # If it's a valid integer string, convert to int
-                        if user_id_str.isdigit():
-                            user_id_value = int(user_id_str)
-                        else:
-                            # Use a fallback ID for UUIDs that can't be converted
-                            user_id_value = 1  # Default to user ID 1 for non-test users
-                    else:
-                        # Try to convert to int
-                        user_id_value = int(user_id)
-                except (ValueError, TypeError):
-                    # If conversion fails, use a default user ID
-                    user_id_value = 1
-                    logger.warning(f"Could not convert user_id to integer: {user_id}, using default: 1")
+            # Map the user ID onto the integer users.id key
+            user_id_value = _coerce_user_id(user_id)
             
             # Extract vendor information
             vendor_data = invoice_data.get("vendor", {})
@@ -235,8 +325,8 @@ class DatabaseStorageAgent(BaseAgent):
                 invoice_date = None
                 if invoice_date_str:
                     try:
-                        invoice_date = datetime.strptime(invoice_date_str, "%Y-%m-%d")
-                    except ValueError:
+                        invoice_date = _parse_invoice_date(invoice_date_str)
+                    except (TypeError, ValueError):
                         logger.warning(f"Could not parse invoice date: {invoice_date_str}")
             else:
                 invoice_number = None
@@ -259,63 +349,59 @@ class DatabaseStorageAgent(BaseAgent):
             additional_info = invoice_data.get("additional_info", {})
             notes = additional_info.get("notes", "") if isinstance(additional_info, dict) else ""
             
-            # Get S3 file URL if available
-            file_url = None
-            file_content_type = None
-            if "metadata" in extraction_result and "s3_storage" in extraction_result["metadata"]:
-                s3_storage = extraction_result["metadata"]["s3_storage"]
-                file_url = s3_storage.get("url", "")
-                file_content_type = s3_storage.get("content_type", "")
+            # Get S3 storage info if available
+            s3_storage = (extraction_result.get("metadata") or {}).get("s3_storage")
             
-            # Create an invoice record directly using SQLAlchemy model
-            invoice = schemas.Invoice(
-                user_id=user_id_value,
-                invoice_number=invoice_number,
-                invoice_date=invoice_date,
-                vendor=vendor_name,
-                total_amount=float(total_amount),
-                currency=currency,
-                notes=notes,
-                created_at=datetime.utcnow(),
-                updated_at=datetime.utcnow()
-            )
-            
-            # Add and commit the invoice
-            db.add(invoice)
-            db.flush()  # Flush to get the invoice.id without committing yet
+            # Insert the invoice and get its ID back from the same statement
+            invoice_id = db.execute(
+                insert(schemas.Invoice).values(
+                    user_id=user_id_value,
+                    invoice_number=invoice_number,
+                    invoice_date=invoice_date,
+                    vendor=vendor_name,
+                    total_amount=float(total_amount),
+                    currency=currency,
+                    notes=notes
+                ).returning(schemas.Invoice.id)
+            ).scalar_one()
             
             # Extract items
             item_ids = []
-            # Try to get items directly from the invoice_data
-            items = invoice_data.get("items", [])
-            logger.info(f"Found {len(items) if items else 0} items in invoice data")
-            
-            if not items and "items" in extraction_result:
-                # If items not in invoice_data but in extraction_result, use that
-                items = extraction_result.get("items", [])
-                logger.info(f"Using items directly from extraction_result: {len(items) if items else 0} items")
+            # Take items from the invoice data, falling back to the root of extraction_result
+            items = invoice_data.get("items") or extraction_result.get("items") or []
+            logger.info(f"Found {len(items)} items in invoice data")
             
             if items and isinstance(items, list):
-                # Pre-generate embeddings for all item descriptions in batch for efficiency
-                item_descriptions = [item.get("description", "Item") for item in items if isinstance(item, dict)]
-                logger.info(f"Generating embeddings for {len(item_descriptions)} items")
+                # Pre-generate embeddings in one batch, once per distinct non-blank description
+                unique_descriptions = list(dict.fromkeys(
+                    description for description in
+                    (item.get("description", "Item") for item in items if isinstance(item, dict))
+                    if isinstance(description, str) and description.strip()
+                ))
+                logger.info(f"Generating embeddings for {len(unique_descriptions)} distinct item descriptions")
                 
-                batch_embeddings = None
-                try:
-                    # Generate embeddings for all descriptions in a single batch operation
-                    batch_embeddings = self.embedding_generator.generate_batch_embeddings(item_descriptions)
-                    logger.info(f"Successfully generated {len(batch_embeddings) if batch_embeddings else 0} embeddings")
-                except Exception as e:
-                    logger.exception(f"Error generating batch embeddings: {str(e)}")
-                    # Continue with item creation even if embeddings fail
+                embeddings_by_description = {}
+                if unique_descriptions:
+                    try:
+                        # Generate embeddings for all descriptions in a single batch operation
+                        batch_embeddings = self.embedding_generator.generate_batch_embeddings(unique_descriptions)
+                        embeddings_by_description = dict(zip(unique_descriptions, batch_embeddings or []))
+                        logger.info(f"Successfully generated {len(embeddings_by_description)} embeddings")
+                    except Exception as e:
+                        logger.exception(f"Error generating batch embeddings: {str(e)}")
+                        # Continue with item creation even if embeddings fail
                 
-                # Process each item
+                # Convert the numeric columns up front rather than per item
+                amounts = _item_amounts([item for item in items if isinstance(item, dict)])
+                
+                # Build one row per item, then insert them all in a single statement
+                item_rows = []
+                debug_enabled = logger.isEnabledFor(logging.DEBUG)
                 for i, item in enumerate(items):
                     if not isinstance(item, dict):
                         logger.warning(f"Skipping item {i}: not a dictionary, type: {type(item)}")
                         continue
                         
-                    logger.info(f"Processing item {i+1}: {item}")
                     description = item.get("description", "Item")
                     quantity = item.get("quantity", 1)
                     unit_price = item.get("unit_price", 0)
@@ -323,75 +409,75 @@ class DatabaseStorageAgent(BaseAgent):
                     item_category = item.get("item_category")  # Get item_category
                     item_code = item.get("item_code")  # Get item_code
                     
-                    # Log item values for debugging
-                    logger.info(f"Item details - description: {description}, quantity: {quantity}, " 
-                               f"unit_price: {unit_price}, total_price: {total_price}, "
-                               f"item_category: {item_category}, item_code: {item_code}")
+                    # Log item values for debugging; skip the formatting when DEBUG is off
+                    if debug_enabled:
+                        logger.debug(f"Processing item {i+1}: {item}")
                     
                     # Get the embedding for this item
-                    embedding = None
-                    if batch_embeddings and i < len(batch_embeddings):
-                        embedding = batch_embeddings[i]
-                        logger.info(f"Using pre-generated embedding for item {i+1}")
+                    embedding = embeddings_by_description.get(description) if isinstance(description, str) else None
                     
                     try:
-                        # Create an item record directly using SQLAlchemy model
-                        item_record = schemas.Item(
-                            invoice_id=invoice.id,
-                            description=description,
-                            quantity=float(quantity),
-                            unit_price=float(unit_price),
-                            total_price=float(total_price),
-                            item_category=item_category,  # Set item_category
-                            item_code=item_code,  # Set item_code
-                            description_embedding=embedding,  # Set the embedding
-                            created_at=datetime.utcnow(),
-                            updated_at=datetime.utcnow()
-                        )
-                        
-                        # Add the item
-                        db.add(item_record)
-                        db.flush()  # Flush to get the item.id
-                        logger.info(f"Item record created with ID: {item_record.id} {'with embedding' if embedding else 'without embedding'}")
-                        item_ids.append(str(item_record.id))
+                        if amounts is not None:
+                            quantity, unit_price, total_price = amounts[len(item_rows)]
+                        else:
+                            quantity, unit_price, total_price = float(quantity), float(unit_price), float(total_price)
+                        item_rows.append({
+                            "invoice_id": invoice_id,
+                            "description": description,
+                            "quantity": quantity,
+                            "unit_price": unit_price,
+                            "total_price": total_price,
+                            "item_category": item_category,
+                            "item_code": item_code,
+                            "description_embedding": embedding
+                        })
                     except Exception as e:
                         logger.exception(f"Error creating item record: {str(e)}")
+                
+                if item_rows:
+                    try:
+                        bind = db.get_bind()
+                        if (len(item_rows) >= COPY_ITEMS_THRESHOLD
+                                and bind.dialect.name == "postgresql" and bind.dialect.driver == "psycopg2"):
+                            item_ids = self._copy_items(db, item_rows)
+                        else:
+                            # executemany with RETURNING; rows come back in parameter order
+                            result = db.execute(
+                                insert(schemas.Item).returning(schemas.Item.id, sort_by_parameter_order=True),
+                                item_rows
+                            )
+                            item_ids = [str(item_id) for item_id in result.scalars()]
+                        logger.info(f"Created {len(item_ids)} item records for invoice {invoice_id}")
+                    except Exception as e:
+                        logger.exception(f"Error creating item records: {str(e)}")
             else:
                 logger.warning(f"No items found in invoice data or items not a list. Items data: {items}")
             
             # If S3 storage info is available, store it as media
             media_id = None
-            if "metadata" in extraction_result and "s3_storage" in extraction_result["metadata"]:
-                s3_storage = extraction_result["metadata"]["s3_storage"]
-                
-                # Create a media record with the correct column names
-                media_record = schemas.Media(
-                    user_id=user_id_value,
-                    invoice_id=invoice.id,
-                    filename=s3_storage.get("original_filename", "invoice"),
-                    original_filename=s3_storage.get("original_filename", "invoice"),
-                    file_path=s3_storage.get("file_key", ""),
-                    file_url=s3_storage.get("url", ""),
-                    content_type=s3_storage.get("content_type", "image"),
-                    file_size=extraction_result.get("file_size", 0),
-                    created_at=datetime.utcnow(),
-                    updated_at=datetime.utcnow()
-                )
-                
-                # Add the media record
-                db.add(media_record)
-                db.flush()  # Flush to get the media.id
-                media_id = media_record.id
+            if s3_storage:
+                media_id = db.execute(
+                    insert(schemas.Media).values(
+                        user_id=user_id_value,
+                        invoice_id=invoice_id,
+                        filename=s3_storage.get("original_filename", "invoice"),
+                        original_filename=s3_storage.get("original_filename", "invoice"),
+                        file_path=s3_storage.get("file_key", ""),
+                        file_url=s3_storage.get("url", ""),
+                        content_type=s3_storage.get("content_type", "image"),
+                        file_size=extraction_result.get("file_size", 0)
+                    ).returning(schemas.Media.id)
+                ).scalar_one()
             
             # Commit all changes
             db.commit()
             
-            logger.info(f"Invoice stored in database with ID: {invoice.id}")
+            logger.info(f"Invoice stored in database with ID: {invoice_id}")
             
             # Return success information
             return {
                 "status": "success",
-                "invoice_id": str(invoice.id),
+                "invoice_id": str(invoice_id),
                 "item_ids": item_ids,
                 "media_id": str(media_id) if media_id else None,
                 "invoice_number": invoice_number,
@@ -409,4 +495,43 @@ class DatabaseStorageAgent(BaseAgent):
             }
         finally:
             # Always close the session
-            db.close() 
\ No newline at end of file
+            db.close()
+    
+    def _copy_items(self, db: Session, rows: List[Dict[str, Any]]) -> List[str]:
+        """
+        Write item rows with PostgreSQL COPY, for invoices with many line items.
+        
+        IDs are reserved from the items sequence up front so they can be returned
+        without querying the rows back.
+        
+        Args:
+            db: Database session (must use the psycopg2 driver)
+            rows: Item rows keyed by column name
+            
+        Returns:
+            IDs of the created items, in row order
+        """
+        item_ids = db.execute(
+            text("SELECT nextval(pg_get_serial_sequence('items', 'id')) FROM generate_series(1, :count)"),
+            {"count": len(rows)}
+        ).scalars().all()
+        
+        buffer = io.StringIO()
+        for item_id, row in zip(item_ids, rows):
+            values = [item_id] + [row.get(column) for column in _COPY_ITEM_COLUMNS[1:]]
+            buffer.write("\t".join(_copy_value(value) for value in values))
+            buffer.write("\n")
+        buffer.seek(0)
+        
+        # COPY runs on the session's own connection so it joins the invoice transaction
+        cursor = db.connection().connection.cursor()
+        try:
+            cursor.copy_expert(
+                f"COPY items ({', '.join(_COPY_ITEM_COLUMNS)}) FROM STDIN WITH (FORMAT text)",
+                buffer
+            )
+        finally:
+            cursor.close()
+        
+        logger.info(f"Copied {len(rows)} item records with COPY")
+        return [str(item_id) for item_id in item_ids]
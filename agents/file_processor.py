@@ -1,10 +1,59 @@
+import asyncio
+import hashlib
+import logging
 import time
 import re
-from typing import Union, Dict, Any, Optional
-from log import logger
-from agents.agent_output import AgentOutput
-from agents.agent_input import AgentInput
-from agents.agent_context import AgentContext
+from collections import OrderedDict
+from typing import Union, Dict, Any, List, Optional, Tuple
+
+from utils.base_agent import AgentInput, AgentOutput, AgentContext
+
+# Configure logger for this module
+logger = logging.getLogger(__name__)
+
+# Patterns used to score extracted content; IGNORECASE avoids lowercasing the content
+_INVOICE_KEYWORD_RE = re.compile(r'\b(?:total|amount|invoice|date|customer|client|bill)\b', re.IGNORECASE)
+_CURRENCY_VALUE_RE = re.compile(r'\$?\d+\.\d{2}\b')
+
+# Lowercased file types scored as documents and as tabular data files
+_DOCUMENT_TYPES = frozenset({'pdf', 'application/pdf', 'doc', 'docx'})
+_DATA_FILE_TYPES = frozenset({'xls', 'xlsx', 'csv'})
+
+# Recent text scores keyed by (SHA-256 of the text, file type), so the memo
+# holds digests rather than whole documents
+_TEXT_SCORE_CACHE_SIZE = 128
+_text_scores: "OrderedDict[Tuple[bytes, str], float]" = OrderedDict()
+
+# Lowercased file type -> (label, handler method, stats key, result key, stats default)
+_FILE_TYPE_HANDLERS = {
+    file_type: handler
+    for file_types, handler in (
+        (('pdf', 'application/pdf'),
+         ("PDF", "_process_pdf", "page_count", "page_count", 0)),
+        (('image', 'jpg', 'jpeg', 'png', 'image/jpeg', 'image/png'),
+         ("Image", "_process_image", "image_dimensions", "dimensions", "unknown")),
+        (('doc', 'docx', 'application/msword',
+          'application/vnd.openxmlformats-officedocument.wordprocessingml.document'),
+         ("Word document", "_process_document", None, None, None)),
+        (('xls', 'xlsx', 'application/vnd.ms-excel',
+          'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'),
+         ("Excel spreadsheet", "_process_spreadsheet", "sheet_count", "sheet_count", 0)),
+        (('csv', 'text/csv'),
+         ("CSV", "_process_csv", "row_count", "row_count", 0)),
+        (('txt', 'text/plain'),
+         ("Text", "_process_text", None, None, None)),
+    )
+    for file_type in file_types
+}
+
+
+def _content_size(content: Any) -> int:
+    """Size of the file content, or -1 when it has no length."""
+    try:
+        return len(content)
+    except TypeError:
+        return -1
+
 
 class FileProcessor:
     async def process(self, 
@@ -22,45 +71,37 @@ class FileProcessor:
         """
         logger.info("=== FILE PROCESSOR STARTED ===")
         start_time = time.time()
+        file_size = -1
         
         try:
-            # Get the file content and metadata
+            # Get the file content and metadata from either input form
             if isinstance(agent_input, dict):
-                # If input is a dict, extract content and metadata
                 file_content = agent_input.get("content")
-                metadata = agent_input.get("metadata", {})
-                user_id = metadata.get("user_id")
-                file_path = metadata.get("file_path")
-                file_type = metadata.get("file_type")
-                file_name = metadata.get("file_name")
-                
-                logger.debug(f"Using dictionary input with metadata keys: {list(metadata.keys())}")
-                logger.info(f"Processing file: {file_name} | Type: {file_type} | User: {user_id}")
-                
-                if file_content is None:
-                    if file_path:
-                        logger.debug(f"No content provided, loading from file_path: {file_path}")
-                        file_content = self._load_file_content(file_path)
-                    else:
-                        logger.error("No file content or path provided")
-                        return AgentOutput(
-                            content="Error: No file content or path provided",
-                            confidence=0.0,
-                            status="error",
-                            error="Missing file content",
-                            metadata=metadata
-                        )
+                metadata = agent_input.get("metadata") or {}
             else:
-                # Extract from AgentInput
                 file_content = agent_input.content
                 metadata = agent_input.metadata
-                user_id = metadata.get("user_id")
-                file_path = metadata.get("file_path")
-                file_type = metadata.get("file_type")
-                file_name = metadata.get("file_name")
-                
-                logger.debug(f"Using AgentInput object with metadata keys: {list(metadata.keys())}")
-                logger.info(f"Processing file: {file_name} | Type: {file_type} | User: {user_id}")
+            user_id, file_path, file_type, file_name = (
+                metadata.get(key) for key in ("user_id", "file_path", "file_type", "file_name")
+            )
+            
+            logger.debug("Using %s input with metadata keys: %s", type(agent_input).__name__, metadata.keys())
+            logger.info(f"Processing file: {file_name} | Type: {file_type} | User: {user_id}")
+            
+            if file_content is None:
+                if file_path:
+                    logger.debug("No content provided, loading from file_path: %s", file_path)
+                    # Read off the event loop so other uploads keep being served
+                    file_content = await asyncio.to_thread(self._load_file_content, file_path)
+                else:
+                    logger.error("No file content or path provided")
+                    return AgentOutput(
+                        content="Error: No file content or path provided",
+                        confidence=0.0,
+                        status="error",
+                        error="Missing file content",
+                        metadata=metadata
+                    )
             
             # Detect file type if not provided
             if not file_type:
@@ -73,44 +114,19 @@ class FileProcessor:
             logger.info(f"Starting processing for file type: {file_type}")
             
             # Track processing stats
+            file_size = _content_size(file_content)
             processing_stats = {
                 "file_type": file_type,
-                "file_size": len(file_content) if isinstance(file_content, bytes) else "unknown",
+                "file_size": file_size,
                 "processing_time": 0
             }
             
+            # Normalize the file type once for the lookups below
+            file_type_key = file_type.lower()
+            
             # Process the file based on its type
-            if file_type.lower() in ['pdf', 'application/pdf']:
-                logger.info("Processing PDF file")
-                result = await self._process_pdf(file_content, metadata)
-                processing_stats["page_count"] = result.get("page_count", 0)
-                
-            elif file_type.lower() in ['image', 'jpg', 'jpeg', 'png', 'image/jpeg', 'image/png']:
-                logger.info("Processing Image file")
-                result = await self._process_image(file_content, metadata)
-                processing_stats["image_dimensions"] = result.get("dimensions", "unknown")
-                
-            elif file_type.lower() in ['doc', 'docx', 'application/msword', 
-                                      'application/vnd.openxmlformats-officedocument.wordprocessingml.document']:
-                logger.info("Processing Word document file")
-                result = await self._process_document(file_content, metadata)
-                
-            elif file_type.lower() in ['xls', 'xlsx', 'application/vnd.ms-excel', 
-                                      'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet']:
-                logger.info("Processing Excel spreadsheet file")
-                result = await self._process_spreadsheet(file_content, metadata)
-                processing_stats["sheet_count"] = result.get("sheet_count", 0)
-                
-            elif file_type.lower() in ['csv', 'text/csv']:
-                logger.info("Processing CSV file")
-                result = await self._process_csv(file_content, metadata)
-                processing_stats["row_count"] = result.get("row_count", 0)
-                
-            elif file_type.lower() in ['txt', 'text/plain']:
-                logger.info("Processing Text file")
-                result = await self._process_text(file_content, metadata)
-                
-            else:
+            handler = _FILE_TYPE_HANDLERS.get(file_type_key)
+            if handler is None:
                 logger.warning(f"Unsupported file type: {file_type}")
                 return AgentOutput(
                     content=f"Unsupported file type: {file_type}. Please provide a PDF, image, Word, Excel, CSV, or text file.",
@@ -120,6 +136,14 @@ class FileProcessor:
                     metadata=metadata
                 )
             
+            label, method_name, stats_key, result_key, stats_default = handler
+            logger.info(f"Processing {label} file")
+            result = await getattr(self, method_name)(file_content, metadata)
+            if stats_key:
+                # Fall back to values an earlier stage (e.g. the validator's header-read
+                # image dimensions) already put in the metadata
+                processing_stats[stats_key] = result.get(result_key, metadata.get(result_key, stats_default))
+            
             # Get processing time
             end_time = time.time()
             processing_time = end_time - start_time
@@ -145,14 +169,15 @@ class FileProcessor:
                 logger.info(f"File stored with reference: {storage_ref}")
                 metadata["storage_ref"] = storage_ref
             
-            # Log content length
-            content_length = len(content) if isinstance(content, str) else "non-string content"
-            logger.debug(f"Extracted content length: {content_length}")
-            if isinstance(content, str) and len(content) > 100:
-                logger.debug(f"Content preview: {content[:100]}...")
+            # Log content length and a preview; skip building them when DEBUG is off
+            if logger.isEnabledFor(logging.DEBUG):
+                content_length = len(content) if isinstance(content, str) else "non-string content"
+                logger.debug("Extracted content length: %s", content_length)
+                if isinstance(content, str) and len(content) > 100:
+                    logger.debug("Content preview: %s...", content[:100])
             
             # Calculate confidence based on extracted content
-            confidence = self._calculate_confidence(content, file_type)
+            confidence = self._calculate_confidence(content, file_type_key)
             logger.info(f"Processing confidence: {confidence:.2f}")
             
             logger.info("=== FILE PROCESSOR COMPLETED ===")
@@ -177,6 +202,7 @@ class FileProcessor:
             metadata["error_details"] = {
                 "error_message": str(e),
                 "error_type": type(e).__name__,
+                "file_size": file_size,
                 "processing_time": processing_time
             }
             
@@ -188,66 +214,124 @@ class FileProcessor:
                 metadata=metadata
             )
 
+    async def process_batch(self,
+                            inputs: List[Union[AgentInput, Dict[str, Any]]],
+                            context: Optional[AgentContext] = None,
+                            max_concurrency: int = 8) -> List[Union[AgentOutput, BaseException]]:
+        """
+        Process several files concurrently, e.g. all attachments of one message.
+        
+        Args:
+            inputs: Files to process, each either as AgentInput or Dict
+            context: Optional context shared by all files
+            max_concurrency: Maximum number of files processed at once
+            
+        Returns:
+            One AgentOutput (or the raised exception) per input, in input order
+        """
+        semaphore = asyncio.Semaphore(max_concurrency)
+        
+        async def process_one(agent_input: Union[AgentInput, Dict[str, Any]]) -> AgentOutput:
+            async with semaphore:
+                return await self.process(agent_input, context)
+        
+        return list(await asyncio.gather(
+            *(process_one(agent_input) for agent_input in inputs),
+            return_exceptions=True
+        ))
+
     def _calculate_confidence(self, content: str, file_type: str) -> float:
         """
         Calculate confidence score based on content quality.
         
+        Scores for text content are memoized on a digest of the content and
+        the file type, so re-processing the same file skips the length and
+        pattern checks.
+        
         Args:
             content: Extracted content
-            file_type: Type of the file processed
+            file_type: Lowercased type of the file processed
             
         Returns:
             Confidence score between 0.0 and 1.0
         """
-        logger.debug(f"Calculating confidence for {file_type} file")
+        if not isinstance(content, str):
+            # Nothing to inspect beyond whether anything was extracted
+            return 0.5 if content else 0.1
+        
+        key = (hashlib.sha256(content.encode("utf-8", "surrogatepass")).digest(), file_type)
+        score = _text_scores.get(key)
+        if score is not None:
+            _text_scores.move_to_end(key)
+            return score
+        
+        score = self._score_text(content, file_type)
+        _text_scores[key] = score
+        if len(_text_scores) > _TEXT_SCORE_CACHE_SIZE:
+            _text_scores.popitem(last=False)
+        return score
+    
+    @staticmethod
+    def _score_text(content: str, file_type: str) -> float:
+        """
+        Score extracted text by length and by structure expected for the file type.
+        
+        Args:
+            content: Extracted text
+            file_type: Lowercased type of the file processed
+            
+        Returns:
+            Confidence score between 0.0 and 1.0
+        """
+        logger.debug("Calculating confidence for %s file", file_type)
         
         # Base confidence
         confidence = 0.5
         
         # If no content extracted, low confidence
-        if not content or (isinstance(content, str) and not content.strip()):
+        if not content.strip():
             logger.debug("Empty content, setting low confidence")
             return 0.1
             
         # Length-based confidence boost
-        if isinstance(content, str):
-            # More content generally means better extraction
-            length = len(content)
-            
-            if length > 5000:
-                confidence += 0.3
-                logger.debug(f"Long content length ({length} chars): +0.3 confidence")
-            elif length > 1000:
-                confidence += 0.2
-                logger.debug(f"Medium content length ({length} chars): +0.2 confidence")
-            elif length > 100:
+        # More content generally means better extraction
+        length = len(content)
+        
+        if length > 5000:
+            confidence += 0.3
+            logger.debug("Long content length (%d chars): +0.3 confidence", length)
+        elif length > 1000:
+            confidence += 0.2
+            logger.debug("Medium content length (%d chars): +0.2 confidence", length)
+        elif length > 100:
+            confidence += 0.1
+            logger.debug("Short content length (%d chars): +0.1 confidence", length)
+            
+        # Check for key structural elements based on file type
+        if file_type in _DOCUMENT_TYPES:
+            # For documents, check for paragraphs, headings
+            if '\n\n' in content:
+                confidence += 0.1
+                logger.debug("Document has paragraph structure: +0.1 confidence")
+                
+            if _INVOICE_KEYWORD_RE.search(content):
                 confidence += 0.1
-                logger.debug(f"Short content length ({length} chars): +0.1 confidence")
+                logger.debug("Document contains invoice-related keywords: +0.1 confidence")
                 
-            # Check for key structural elements based on file type
-            if file_type.lower() in ['pdf', 'application/pdf', 'doc', 'docx']:
-                # For documents, check for paragraphs, headings
-                if '\n\n' in content:
-                    confidence += 0.1
-                    logger.debug("Document has paragraph structure: +0.1 confidence")
-                    
-                if re.search(r'\b(total|amount|invoice|date|customer|client|bill)\b', content.lower()):
-                    confidence += 0.1
-                    logger.debug("Document contains invoice-related keywords: +0.1 confidence")
-                    
-            elif file_type.lower() in ['xls', 'xlsx', 'csv']:
-                # For data files, check for tabular structure
-                if ',' in content or '\t' in content:
-                    confidence += 0.1
-                    logger.debug("Data file has delimiter structure: +0.1 confidence")
-                    
-                # Look for numbers which may indicate financial data
-                if re.search(r'\$?\d+\.\d{2}\b', content):
-                    confidence += 0.1
-                    logger.debug("Data file contains currency values: +0.1 confidence")
+        elif file_type in _DATA_FILE_TYPES:
+            # For data files, check for tabular structure
+            if ',' in content or '\t' in content:
+                confidence += 0.1
+                logger.debug("Data file has delimiter structure: +0.1 confidence")
+                
+            # Look for numbers which may indicate financial data; every match
+            # needs a decimal point, so skip the regex when there is none
+            if '.' in content and _CURRENCY_VALUE_RE.search(content):
+                confidence += 0.1
+                logger.debug("Data file contains currency values: +0.1 confidence")
         
         # Cap at 1.0
         confidence = min(confidence, 1.0)
-        logger.debug(f"Final calculated confidence: {confidence:.2f}")
+        logger.debug("Final calculated confidence: %.2f", confidence)
         
-        return confidence 
\ No newline at end of file
+        return confidence
\ No newline at end of file
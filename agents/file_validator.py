@@ -1,8 +1,14 @@
+import asyncio
 import logging
 import json
 import base64
+import copy
+import hashlib
+import io
 import os
 import re
+import threading
+from functools import lru_cache
 from pathlib import Path
 from typing import Dict, Any, Optional, List, Union, Tuple
 
@@ -10,10 +16,99 @@ from utils.base_agent import BaseAgent, AgentInput, AgentOutput, AgentContext
 from services.llm_factory import LLMFactory
 from constants.fallback_messages import FILE_VALIDATION_PROMPTS, FILE_VALIDATION_MESSAGES
 from constants.prompt_mappings import AgentType, get_prompt_for_agent
+from utils.image_utils import IMAGE_MIME_TYPES, peek_image_info
+from utils.extraction_cache import RecentResultCache
 
 # Configure logger for this module
 logger = logging.getLogger(__name__)
 
+# Markdown code block (```json ... ```) wrapping an LLM response
+_CODE_BLOCK_RE = re.compile(r'^```(?:json)?\s*([\s\S]*?)```$', re.DOTALL)
+
+# Lowercased content types validated as images besides "image/..." ones
+_IMAGE_FILE_TYPES = frozenset({"png", "jpg", "jpeg"})
+
+# Largest image the vision model accepts; bigger uploads are rejected without a call
+MAX_IMAGE_BYTES = 20 * 1024 * 1024
+
+# Validation results for recently seen files, keyed by content digest
+validation_results = RecentResultCache(maxsize=256)
+
+
+def _content_digest(content: Union[str, bytes]) -> Optional[str]:
+    """SHA-256 of file content, used to recognise re-submitted files."""
+    if isinstance(content, str):
+        content = content.encode("utf-8")
+    if not isinstance(content, bytes):
+        return None
+    return hashlib.sha256(content).hexdigest()
+
+
+def _strip_code_blocks(text: str) -> str:
+    """
+    Strip markdown code block formatting from the text.
+    
+    Args:
+        text: Text that may contain markdown code block formatting
+        
+    Returns:
+        Clean text with code block formatting removed
+    """
+    # Remove leading/trailing whitespace
+    text = text.strip()
+    
+    # Remove markdown code block backticks (```json and ```)
+    match = _CODE_BLOCK_RE.match(text)
+    
+    if match:
+        # Extract the content inside the code block
+        return match.group(1).strip()
+    
+    return text
+
+
+@lru_cache(maxsize=64)
+def _parse_validation(text: str) -> Dict[str, Any]:
+    """
+    Parse an LLM validation response, memoized for repeated identical responses.
+    
+    The returned dict is shared between callers and must not be modified.
+    
+    Args:
+        text: Raw LLM response, optionally wrapped in a code block
+        
+    Returns:
+        Parsed validation result
+        
+    Raises:
+        json.JSONDecodeError: If the response is not valid JSON
+    """
+    return json.loads(_strip_code_blocks(text))
+
+
+# PIL and the OpenAI client are only needed for images, so load them on first use
+_pil_image = None
+_openai_client = None
+_openai_client_lock = threading.Lock()  # Image validations call the client from worker threads
+
+def _get_pil_image():
+    """Get the PIL Image module, importing it on first use."""
+    global _pil_image
+    if _pil_image is None:
+        from PIL import Image
+        _pil_image = Image
+    return _pil_image
+
+def _get_openai():
+    """Get or create the OpenAI client singleton used for image validation."""
+    global _openai_client
+    if _openai_client is None:
+        with _openai_client_lock:
+            if _openai_client is None:
+                from openai import OpenAI
+                _openai_client = OpenAI()
+    return _openai_client
+
 
 class FileValidatorAgent(BaseAgent):
     """
@@ -23,6 +118,9 @@ class FileValidatorAgent(BaseAgent):
     to determine if it contains valid invoice data.
     """
     
+    # Image validation prompt, loaded once by _load_image_prompt
+    _image_prompt_cache: Optional[str] = None
+    
     def __init__(self, llm_factory: LLMFactory):
         """
         Initialize the FileValidatorAgent.
@@ -31,6 +129,7 @@ class FileValidatorAgent(BaseAgent):
             llm_factory: LLMFactory instance for LLM operations
         """
         super().__init__(llm_factory)
+        self.validation_cache = validation_results
     
     async def process(self, 
                      agent_input: AgentInput, 
@@ -54,117 +153,65 @@ class FileValidatorAgent(BaseAgent):
             
             logger.info(f"Validating file: {file_path} (type: {file_type})")
             
+            # Reject what is never an invoice before paying for an LLM call
+            if file_type == "text":
+                return self._rejected_file_output(
+                    file_path, file_type, "not a file", FILE_VALIDATION_MESSAGES["plain_text_invalid"]
+                )
+            if not file_content or (isinstance(file_content, str) and not file_content.strip()):
+                return self._rejected_file_output(
+                    file_path, file_type, "file content", FILE_VALIDATION_MESSAGES["empty_file"]
+                )
+            
             # For binary content like images, we need special handling
             if isinstance(file_content, bytes):
                 # For image types, we'll use GPT-4o-mini to validate if it's an invoice
-                if file_type and ("image" in file_type.lower() or file_type.lower() in ["png", "jpg", "jpeg"]):
+                file_type_key = file_type.lower()
+                if "image" in file_type_key or file_type_key in _IMAGE_FILE_TYPES:
                     # Get additional file info
                     file_size = len(file_content)
+                    if file_size > MAX_IMAGE_BYTES:
+                        logger.warning(f"Image of {file_size} bytes exceeds the {MAX_IMAGE_BYTES} byte limit")
+                        return self._rejected_file_output(
+                            file_path, file_type, "image within size limit", FILE_VALIDATION_MESSAGES["image_too_large"]
+                        )
                     
-                    # Try to get image dimensions if possible
+                    # Get the image dimensions and MIME type from the magic bytes and header
                     dimensions = "unknown"
-                    try:
-                        from PIL import Image
-                        import io
-                        img = Image.open(io.BytesIO(file_content))
-                        dimensions = f"{img.width}x{img.height}"
-                    except Exception as e:
-                        logger.warning(f"Could not determine image dimensions: {str(e)}")
-                    
-                    # Prepare for image analysis using GPT-4o-mini
-                    try:
-                        # Convert image to base64 for analysis
-                        base64_image = base64.b64encode(file_content).decode('utf-8')
-                        
-                        # Use GPT-4o-mini to analyze if the image is an invoice
-                        from openai import OpenAI
-                        client = OpenAI()
-                        
-                        # Define a prompt for invoice validation
-                        try:
-                            # Try to load prompt using LLMFactory
-                            agent_type = AgentType.FILE_VALIDATION
-                            image_prompt_name = "file_validator_image_prompt"
-                            
-                            # First try to load through the factory
-                            try:
-                                prompt = self.llm_factory.load_prompt_template(image_prompt_name)
-                                logger.debug(f"Loaded {image_prompt_name} via LLMFactory")
-                            except Exception as e:
-                                logger.warning(f"Could not load {image_prompt_name} via LLMFactory: {str(e)}")
-                                
-                                # Fall back to direct file loading
-                                prompt_path = Path(__file__).parent.parent / "prompts" / "file_validator_image_prompt.txt"
-                                
-                                if prompt_path.exists():
-                                    with open(prompt_path, "r") as f:
-                                        prompt = f.read()
-                                    logger.debug("Loaded image validation prompt from file")
-                                else:
-                                    logger.warning("file_validator_image_prompt.txt not found, using fallback prompt")
-                                    # Use fallback prompt from constants
-                                    prompt = FILE_VALIDATION_PROMPTS["image_validation"]
-                        except Exception as e:
-                            logger.error(f"Error loading image validation prompt: {str(e)}")
-                            logger.warning("Using fallback image validation prompt")
-                            # Use fallback prompt from constants
-                            prompt = FILE_VALIDATION_PROMPTS["image_validation"]
-                        
-                        # Detect proper MIME type for the image
-                        mime_type = "image/jpeg"  # default
+                    mime_type = "image/jpeg"  # default
+                    image_info = peek_image_info(file_content)
+                    if image_info:
+                        width, height, img_format = image_info
+                        dimensions = f"{width}x{height}"
+                        mime_type = IMAGE_MIME_TYPES[img_format]
+                        logger.info(f"Detected image format: {img_format}, using MIME type: {mime_type}")
+                    else:
+                        # Formats the header parser doesn't recognise go through PIL,
+                        # which only parses the header here, the pixels are not decoded
                         try:
-                            from PIL import Image
-                            import io
-                            img = Image.open(io.BytesIO(file_content))
+                            img = _get_pil_image().open(io.BytesIO(file_content))
+                            dimensions = f"{img.width}x{img.height}"
                             img_format = img.format.lower() if img.format else "jpeg"
-                            if img_format == "jpeg" or img_format == "jpg":
-                                mime_type = "image/jpeg"
-                            elif img_format == "png":
-                                mime_type = "image/png"
-                            elif img_format == "gif":
-                                mime_type = "image/gif"
-                            elif img_format == "webp":
-                                mime_type = "image/webp"
-                            else:
-                                mime_type = f"image/{img_format}"
+                            mime_type = IMAGE_MIME_TYPES.get(img_format, f"image/{img_format}")
                             logger.info(f"Detected image format: {img_format}, using MIME type: {mime_type}")
                         except Exception as e:
-                            logger.warning(f"Could not determine image format: {str(e)}. Using default: {mime_type}")
-                        
-                        # Call OpenAI with the image
-                        response = client.chat.completions.create(
-                            model="gpt-4o-mini",
-                            messages=[
-                                {
-                                    "role": "system",
-                                    "content": prompt
-                                },
-                                {
-                                    "role": "user",
-                                    "content": [
-                                        {
-                                            "type": "text",
-                                            "text": "Is this a valid invoice?"
-                                        },
-                                        {
-                                            "type": "image_url",
-                                            "image_url": {
-                                                "url": f"data:{mime_type};base64,{base64_image}"
-                                            }
-                                        }
-                                    ]
-                                }
-                            ],
-                            max_tokens=500
-                        )
-                        
-                        # Extract the validation result
-                        validation_text = response.choices[0].message.content
-                        logger.debug(f"Image validation response: {validation_text}")
-                        
-                        # Parse the JSON response
-                        clean_result = self._strip_code_blocks(validation_text)
-                        parsed_result = json.loads(clean_result)
+                            logger.warning(f"Could not read image header: {str(e)}. Using default MIME type: {mime_type}")
+                    
+                    # Prepare for image analysis using GPT-4o-mini
+                    try:
+                        # Reuse the result for a re-submitted image instead of calling the model again
+                        cache_key = ("image", _content_digest(file_content))
+                        parsed_result = self.validation_cache.get(cache_key)
+                        if parsed_result is not None:
+                            logger.info("Using cached image validation result")
+                            parsed_result = copy.deepcopy(parsed_result)
+                        else:
+                            # The OpenAI client call blocks, so keep it off the event loop
+                            parsed_result = await asyncio.to_thread(
+                                self._validate_image_with_llm, file_content, mime_type
+                            )
+                            # Cached results are never handed out, only copies of them
+                            self.validation_cache.put(cache_key, copy.deepcopy(parsed_result))
                         
                         # Extract validation status and confidence
                         is_valid = parsed_result.get("is_valid_invoice", False)
@@ -183,6 +230,7 @@ class FileValidatorAgent(BaseAgent):
                                 "file_type": file_type,
                                 "file_size": file_size,
                                 "dimensions": dimensions,
+                                "mime_type": mime_type,
                                 "missing_elements": missing_elements,
                                 "reasons": reasons
                             }
@@ -203,6 +251,7 @@ class FileValidatorAgent(BaseAgent):
                                 "file_type": file_type,
                                 "file_size": file_size,
                                 "dimensions": dimensions,
+                                "mime_type": mime_type,
                                 "missing_elements": ["validation failed"],
                                 "reasons": f"{FILE_VALIDATION_MESSAGES['image_validation_failed']}: {str(e)}"
                             }
@@ -214,18 +263,22 @@ class FileValidatorAgent(BaseAgent):
                 # For text content, we can pass it directly
                 content_for_validation = file_content
             
-            # Call LLM to validate the file
-            validation_result = await self.llm_factory.validate_invoice_file(content_for_validation)
+            # Reuse the result for re-submitted content instead of calling the LLM again
+            content_digest = _content_digest(content_for_validation)
+            cache_key = ("text", content_digest) if content_digest else None
+            parsed_result = self.validation_cache.get(cache_key) if cache_key else None
+            if parsed_result is not None:
+                logger.info("Using cached file validation result")
+                parsed_result = copy.deepcopy(parsed_result)
+            else:
+                # Call LLM to validate the file
+                validation_result = await self.llm_factory.validate_invoice_file(content_for_validation)
+                parsed_result = self._parse_validation_result(validation_result)
+                # Fallback results from unparseable responses are not cached
+                if parsed_result is not None and cache_key:
+                    self.validation_cache.put(cache_key, copy.deepcopy(parsed_result))
             
-            # Parse the response - handle possible code blocks in the response
-            try:
-                # Strip any markdown code block formatting if present
-                clean_result = self._strip_code_blocks(validation_result)
-                parsed_result = json.loads(clean_result)
-                logger.debug(f"Parsed validation result: {parsed_result}")
-            except json.JSONDecodeError as e:
-                logger.warning(f"Failed to parse validation result as JSON: {validation_result}")
-                logger.error(f"JSON parsing error: {str(e)}")
+            if parsed_result is None:
                 # Create a fallback result if parsing fails
                 parsed_result = {
                     "is_valid_invoice": False,
@@ -240,11 +293,6 @@ class FileValidatorAgent(BaseAgent):
             missing_elements = parsed_result.get("missing_elements", [])
             reasons = parsed_result.get("reasons", "")
             
-            # If it's not a file type we support, provide a specific reason
-            if file_type == "text":
-                reasons = FILE_VALIDATION_MESSAGES["plain_text_invalid"]
-                confidence = 0.99  # High confidence that plain text is not an invoice
-            
             # Prepare the output
             status = "invalid_invoice" if not is_valid else "success"
             
@@ -274,25 +322,174 @@ class FileValidatorAgent(BaseAgent):
                 }
             )
     
-    def _strip_code_blocks(self, text: str) -> str:
+    def _rejected_file_output(self, file_path: str, file_type: str,
+                              missing_element: str, reasons: str) -> AgentOutput:
+        """
+        Build the output for a file rejected before validation.
+        
+        Args:
+            file_path: Path of the rejected file
+            file_type: Type of the rejected file
+            missing_element: What the file lacks to be an invoice
+            reasons: Human-readable reason for the rejection
+            
+        Returns:
+            AgentOutput marking the file as an invalid invoice
+        """
+        logger.info(f"Rejected file without LLM validation: {reasons}")
+        return AgentOutput(
+            content=False,
+            confidence=0.99,  # High confidence, these files are never invoices
+            status="invalid_invoice",
+            metadata={
+                "file_path": file_path,
+                "file_type": file_type,
+                "missing_elements": [missing_element],
+                "reasons": reasons
+            }
+        )
+    
+    async def process_batch(self,
+                            inputs: List[AgentInput],
+                            context: Optional[AgentContext] = None,
+                            max_concurrency: int = 8) -> List[Union[AgentOutput, BaseException]]:
         """
-        Strip markdown code block formatting from the text.
+        Validate several files concurrently, e.g. all attachments of one message.
         
         Args:
-            text: Text that may contain markdown code block formatting
+            inputs: Inputs to validate
+            context: Optional context information shared by all inputs
+            max_concurrency: Maximum number of validations running at once
             
         Returns:
-            Clean text with code block formatting removed
+            One AgentOutput (or the raised exception) per input, in input order
+        """
+        semaphore = asyncio.Semaphore(max_concurrency)
+        
+        async def validate_one(agent_input: AgentInput) -> AgentOutput:
+            async with semaphore:
+                return await self.process(agent_input, context)
+        
+        return list(await asyncio.gather(
+            *(validate_one(agent_input) for agent_input in inputs),
+            return_exceptions=True
+        ))
+    
+    def _validate_image_with_llm(self, file_content: bytes, mime_type: str) -> Dict[str, Any]:
+        """
+        Ask GPT-4o-mini whether an image is an invoice.
+        
+        Args:
+            file_content: Raw image bytes
+            mime_type: MIME type of the image
+            
+        Returns:
+            Parsed validation result from the model
+        """
+        # Build the base64 data URL as bytes and decode it once, so the
+        # encoded image isn't held as separate bytes and str copies
+        image_data_url = (
+            b"data:" + mime_type.encode("ascii") + b";base64," + base64.b64encode(file_content)
+        ).decode("ascii")
+        
+        prompt = self._load_image_prompt()
+        
+        # Call OpenAI with the image, reusing the client's connection pool
+        response = _get_openai().chat.completions.create(
+            model="gpt-4o-mini",
+            messages=[
+                {
+                    "role": "system",
+                    "content": prompt
+                },
+                {
+                    "role": "user",
+                    "content": [
+                        {
+                            "type": "text",
+                            "text": "Is this a valid invoice?"
+                        },
+                        {
+                            "type": "image_url",
+                            "image_url": {
+                                "url": image_data_url
+                            }
+                        }
+                    ]
+                }
+            ],
+            max_tokens=500
+        )
+        
+        # Extract the validation result
+        validation_text = response.choices[0].message.content
+        logger.debug(f"Image validation response: {validation_text}")
+        
+        # Parse the JSON response; the memoized dict is shared, so hand out a copy
+        return copy.deepcopy(_parse_validation(validation_text))
+    
+    def _load_image_prompt(self) -> str:
+        """
+        Get the image validation prompt, loading it on first use.
+        
+        The prompt is static for the lifetime of the process, so the result
+        of the first load is kept on the class and shared by all instances.
+        
+        Returns:
+            System prompt for image validation
         """
-        # Remove leading/trailing whitespace
-        text = text.strip()
+        if FileValidatorAgent._image_prompt_cache is not None:
+            return FileValidatorAgent._image_prompt_cache
         
-        # Remove markdown code block backticks (```json and ```)
-        code_block_pattern = r'^```(?:json)?\s*([\s\S]*?)```$'
-        match = re.match(code_block_pattern, text, re.DOTALL)
+        try:
+            # Try to load prompt using LLMFactory
+            agent_type = AgentType.FILE_VALIDATION
+            image_prompt_name = "file_validator_image_prompt"
+            
+            # First try to load through the factory
+            try:
+                prompt = self.llm_factory.load_prompt_template(image_prompt_name)
+                logger.debug(f"Loaded {image_prompt_name} via LLMFactory")
+            except Exception as e:
+                logger.warning(f"Could not load {image_prompt_name} via LLMFactory: {str(e)}")
+                
+                # Fall back to direct file loading
+                prompt_path = Path(__file__).parent.parent / "prompts" / "file_validator_image_prompt.txt"
+                
+                if prompt_path.exists():
+                    with open(prompt_path, "r") as f:
+                        prompt = f.read()
+                    logger.debug("Loaded image validation prompt from file")
+                else:
+                    logger.warning("file_validator_image_prompt.txt not found, using fallback prompt")
+                    # Use fallback prompt from constants
+                    prompt = FILE_VALIDATION_PROMPTS["image_validation"]
+        except Exception as e:
+            logger.error(f"Error loading image validation prompt: {str(e)}")
+            logger.warning("Using fallback image validation prompt")
+            # Use fallback prompt from constants
+            prompt = FILE_VALIDATION_PROMPTS["image_validation"]
         
-        if match:
-            # Extract the content inside the code block
-            return match.group(1).strip()
+        FileValidatorAgent._image_prompt_cache = prompt
+        return prompt
+    
+    def _parse_validation_result(self, validation_result: str) -> Optional[Dict[str, Any]]:
+        """
+        Parse the LLM's validation response, handling code block formatting.
         
-        return text 
\ No newline at end of file
+        Args:
+            validation_result: Raw LLM response
+            
+        Returns:
+            Parsed validation result, or None if the response is not valid JSON
+        """
+        try:
+            # Strip any markdown code block formatting if present and parse;
+            # the memoized dict is shared, so hand out a copy
+            parsed_result = copy.deepcopy(_parse_validation(validation_result))
+            logger.debug(f"Parsed validation result: {parsed_result}")
+            return parsed_result
+        except json.JSONDecodeError as e:
+            logger.warning(f"Failed to parse validation result as JSON: {validation_result}")
+            logger.error(f"JSON parsing error: {str(e)}")
+            return None
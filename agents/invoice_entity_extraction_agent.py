@@ -1,16 +1,78 @@
 import logging
-import json
-import re
 from typing import Dict, Any, Optional, List, Union
 
 from utils.base_agent import BaseAgent, AgentInput, AgentOutput, AgentContext
 from services.llm_factory import LLMFactory
 from constants.prompt_mappings import AgentType, get_prompt_for_agent
+from constants.llm_configs import BatchSettings
+from utils.dynamic_batcher import DynamicBatcher, batch_scope, dispatch_grouped
+from utils import json_utils
 
 # Configure logger for this module
 logger = logging.getLogger(__name__)
 
 
+def _strip_json_fence(text: str) -> Optional[str]:
+    """
+    Get the payload of a markdown code block, e.g. ```json {...} ```.
+    
+    Uses plain substring searches, so malformed LLM output can't make it backtrack.
+    
+    Args:
+        text: LLM response that may wrap its JSON in a code block
+        
+    Returns:
+        The stripped code block content, or None if there is no complete code block
+    """
+    start = text.find("```")
+    if start < 0:
+        return None
+    payload_start = start + 3
+    if text.startswith("json", payload_start):
+        payload_start += 4
+    end = text.find("```", payload_start)
+    if end < 0:
+        return None
+    return text[payload_start:end].strip()
+
+
+async def _extract_entities_batch(requests: List[Any]) -> List[str]:
+    """
+    Run a batch of entity extraction requests, one LLM call per LLM factory and user.
+    
+    Args:
+        requests: List of (llm_factory, scope, text) tuples, where scope comes from
+            batch_scope and requests with no scope are extracted on their own
+        
+    Returns:
+        Raw extraction results in the same order as the requests
+    """
+    return await dispatch_grouped(
+        requests,
+        lambda request: None if request[1] is None else (id(request[0]), request[1]),
+        lambda group: group[0][0].extract_invoice_entities_batch([text for _, _, text in group]),
+    )
+
+
+# Scoring weights for the entity types expected in an extraction
+_ENTITY_WEIGHTS = (
+    ("vendor", 0.3),
+    ("total_amount", 0.3),
+    ("currency", 0.1),
+    ("invoice_date", 0.1),
+    ("due_date", 0.1),
+    ("items", 0.4),
+    ("invoice_number", 0.1),
+    ("status", 0.1),
+)
+_MAX_ENTITY_SCORE = sum(weight for _, weight in _ENTITY_WEIGHTS)
+
+# Coalesces entity extractions for concurrent messages into multi-message prompts
+_entity_extraction_batcher = DynamicBatcher(
+    _extract_entities_batch, max_wait_ms=BatchSettings.INTERACTIVE_MAX_WAIT_MS
+)
+
+
 class InvoiceEntityExtractionAgent(BaseAgent):
     """
     Agent for extracting invoice-related entities from text inputs.
@@ -64,20 +126,21 @@ class InvoiceEntityExtractionAgent(BaseAgent):
             logger.info(f"Extracting invoice entities from text (length: {len(combined_text)})")
             
             # Call LLM to extract entities
-            extraction_result = await self.llm_factory.extract_invoice_entities(combined_text)
+            extraction_result = await _entity_extraction_batcher.submit(
+                (self.llm_factory, batch_scope(context), combined_text)
+            )
             
             # Parse the response
             try:
                 # Extract JSON from triple backticks if present
-                json_match = re.search(r'```(?:json)?\s*([\s\S]*?)\s*```', extraction_result)
-                if json_match:
-                    json_str = json_match.group(1)
-                    logger.debug(f"Extracted JSON from backticks: {json_str}")
+                json_str = _strip_json_fence(extraction_result)
+                if json_str is not None:
+                    logger.debug("Extracted JSON from backticks: %s", json_str)
                 else:
                     json_str = extraction_result
                 
-                parsed_result = json.loads(json_str)
-                logger.debug(f"Parsed entity extraction result: {parsed_result}")
+                parsed_result = json_utils.loads(json_str)
+                logger.debug("Parsed entity extraction result: %r", parsed_result)
                 
                 # If parsed_result is already in the expected format, use it directly
                 # (LLMFactory may already return a properly structured response)
@@ -88,7 +151,7 @@ class InvoiceEntityExtractionAgent(BaseAgent):
                     entities = {}
                     confidence = 0.0
                 
-            except json.JSONDecodeError as e:
+            except json_utils.JSONDecodeError as e:
                 logger.warning(f"Failed to parse entity extraction result as JSON: {extraction_result}")
                 entities = {}
                 confidence = 0.0
@@ -156,18 +219,13 @@ class InvoiceEntityExtractionAgent(BaseAgent):
         if not conversation_history:
             return current_text
         
-        # Start with the current text
-        combined_text = f"Current message: {current_text}\n\n"
-        
-        # Add relevant history
-        combined_text += "Previous conversation:\n"
-        
-        for i, message in enumerate(conversation_history):
-            role = message.get("role", "user")
-            content = message.get("content", "")
-            combined_text += f"{role}: {content}\n"
-        
-        return combined_text
+        # Current text followed by the relevant history, joined in one allocation
+        parts = [f"Current message: {current_text}\n\nPrevious conversation:\n"]
+        parts.extend(
+            f"{message.get('role', 'user')}: {message.get('content', '')}\n"
+            for message in conversation_history
+        )
+        return "".join(parts)
     
     def _validate_extraction(self, entities: Dict[str, Any], has_context: bool = False) -> tuple[bool, float]:
         """
@@ -186,24 +244,11 @@ class InvoiceEntityExtractionAgent(BaseAgent):
         
         # Score the extraction result based on the entities present
         score = 0.0
-        max_score = 0.0
-        
-        # Define scoring weights for different entity types
-        entity_weights = {
-            "vendor": 0.3,
-            "total_amount": 0.3,
-            "currency": 0.1,
-            "invoice_date": 0.1,
-            "due_date": 0.1,
-            "items": 0.4,
-            "invoice_number": 0.1,
-            "status": 0.1
-        }
+        max_score = _MAX_ENTITY_SCORE
         
         # Calculate the score based on present entities
-        for key, weight in entity_weights.items():
-            max_score += weight
-            if key in entities and entities[key]:
+        for key, weight in _ENTITY_WEIGHTS:
+            if entities.get(key):
                 score += weight
                 
                 # Extra points for detailed items
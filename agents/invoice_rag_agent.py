@@ -158,7 +158,7 @@ class InvoiceRAGAgent:
                     it.quantity,
                     it.unit_price,
                     it.total_price,
-                    l2_distance(it.description_embedding::vector, '{embedding_str}'::vector) AS similarity_score
+                    l2_distance(it.description_embedding, '{embedding_str}'::halfvec) AS similarity_score
                 FROM 
                     items it
                 JOIN
@@ -166,9 +166,9 @@ class InvoiceRAGAgent:
                 WHERE 
                     i.user_id = :user_id
                     AND it.description_embedding IS NOT NULL
-                    AND l2_distance(it.description_embedding::vector, '{embedding_str}'::vector) < {VECTOR_SIMILARITY_THRESHOLD}
+                    AND l2_distance(it.description_embedding, '{embedding_str}'::halfvec) < {VECTOR_SIMILARITY_THRESHOLD}
                 ORDER BY 
-                    l2_distance(it.description_embedding::vector, '{embedding_str}'::vector)
+                    l2_distance(it.description_embedding, '{embedding_str}'::halfvec)
                 LIMIT 5
             """
             
@@ -216,7 +216,7 @@ class InvoiceRAGAgent:
                     it.quantity,
                     it.unit_price,
                     it.total_price,
-                    l2_distance(it.description_embedding::vector, '{embedding_str}'::vector) AS similarity_score
+                    l2_distance(it.description_embedding, '{embedding_str}'::halfvec) AS similarity_score
                 FROM 
                     items it
                 JOIN
@@ -225,7 +225,7 @@ class InvoiceRAGAgent:
                     i.user_id = :user_id
                     AND it.description_embedding IS NOT NULL
                 ORDER BY 
-                    l2_distance(it.description_embedding::vector, '{embedding_str}'::vector)
+                    l2_distance(it.description_embedding, '{embedding_str}'::halfvec)
                 LIMIT 5
                 """
                 
@@ -1,17 +1,178 @@
 import logging
-import json
 import re
-from typing import Dict, Any, Optional, List, Union
+from typing import Dict, Any, Optional, List, Tuple, Union
 from datetime import datetime
 from decimal import Decimal
 
 from utils.base_agent import BaseAgent, AgentInput, AgentOutput, AgentContext
 from services.llm_factory import LLMFactory
 from constants.fallback_messages import GENERAL_FALLBACKS, QUERY_FALLBACKS
+from constants.llm_configs import BatchSettings
+from utils.dynamic_batcher import DynamicBatcher, batch_scope, dispatch_grouped
+from utils import json_utils
 
 # Configure logger for this module
 logger = logging.getLogger(__name__)
 
+# Characters outside the Basic Multilingual Plane (mostly emojis), spaced out for WhatsApp
+_EMOJI_SPACING_RE = re.compile(r'[\U00010000-\U0010ffff]')
+
+
+def _space_after(match: re.Match) -> str:
+    """Append a space to a matched character; cheaper than expanding a group template."""
+    return match[0] + " "
+
+# Code point ranges counted as emojis in formatted responses
+_EMOJI_RANGES = (
+    (0x1F600, 0x1F64F),  # emoticons
+    (0x1F300, 0x1F5FF),  # symbols & pictographs
+    (0x1F680, 0x1F6FF),  # transport & map symbols
+    (0x1F700, 0x1F77F),  # alchemical symbols
+    (0x1F780, 0x1F7FF),  # geometric shapes
+    (0x1F800, 0x1F8FF),  # supplemental arrows
+    (0x1F900, 0x1F9FF),  # supplemental symbols
+    (0x1FA00, 0x1FA6F),  # extended symbols
+    (0x1FA70, 0x1FAFF),  # extended symbols
+    (0x02702, 0x027B0),  # misc symbols
+    (0x024C2, 0x1F251),
+)
+
+
+def _merge_ranges(ranges: Tuple[Tuple[int, int], ...]) -> List[Tuple[int, int]]:
+    """Sort code point ranges and merge overlapping or adjacent ones."""
+    merged: List[Tuple[int, int]] = []
+    for low, high in sorted(ranges):
+        if merged and low <= merged[-1][1] + 1:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], high))
+        else:
+            merged.append((low, high))
+    return merged
+
+
+# Runs of emoji characters; the ranges are merged so the character class tests
+# three disjoint ranges instead of eleven overlapping ones
+_EMOJI_RE = re.compile(
+    "[" + "".join(f"{chr(low)}-{chr(high)}" for low, high in _merge_ranges(_EMOJI_RANGES)) + "]+"
+)
+
+
+# Values _to_json_compatible passes through unchanged
+_JSON_SCALAR_TYPES = frozenset({str, int, float, bool, type(None)})
+
+
+def _to_json_compatible(obj: Any) -> Any:
+    """
+    Convert an object to a JSON-serializable format, handling special cases like datetime.
+    
+    Walks nested dicts and lists with an explicit stack rather than recursion,
+    so deeply nested query results don't grow the call stack. A container
+    reached more than once is converted once and shared, which also stops cycles.
+    
+    Args:
+        obj: The object to serialize
+        
+    Returns:
+        JSON-serializable version of the object
+    """
+    converted: Dict[int, Any] = {}
+    pending: List[Tuple[Any, Any]] = []
+    
+    def convert(value: Any) -> Any:
+        # Exact type checks first; they skip the MRO walk and cover nearly
+        # everything a query result holds
+        value_type = type(value)
+        if value_type in _JSON_SCALAR_TYPES:
+            return value
+        if value_type is datetime:
+            return value.isoformat()
+        # Handle Decimal objects (commonly returned by database queries)
+        if value_type is Decimal:
+            return float(value)
+        
+        # Subclasses of the types above and other objects
+        if value_type is not dict and value_type is not list:
+            if isinstance(value, datetime):
+                return value.isoformat()
+            if isinstance(value, Decimal):
+                return float(value)
+            if not isinstance(value, (dict, list)):
+                if not hasattr(value, '__dict__'):
+                    return value
+                value = value.__dict__
+                if not isinstance(value, dict):
+                    return value
+        
+        # Containers are created empty here and filled from the pending stack
+        key = id(value)
+        if key in converted:
+            return converted[key]
+        target = {} if isinstance(value, dict) else []
+        converted[key] = target
+        pending.append((value, target))
+        return target
+    
+    result = convert(obj)
+    while pending:
+        source, target = pending.pop()
+        if type(target) is dict:
+            for k, v in source.items():
+                target[k] = convert(v)
+        else:
+            for item in source:
+                target.append(convert(item))
+    return result
+
+
+def _json_default(obj: Any) -> Any:
+    """
+    Convert values the JSON encoder does not handle natively.
+    
+    Args:
+        obj: Value the encoder could not serialize
+        
+    Returns:
+        JSON-serializable replacement for the value
+        
+    Raises:
+        TypeError: If the value has no JSON representation
+    """
+    if isinstance(obj, datetime):
+        return obj.isoformat()
+    if isinstance(obj, Decimal):
+        return float(obj)
+    if hasattr(obj, '__dict__'):
+        return obj.__dict__
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+
+async def _format_response_batch(requests: List[Any]) -> List[str]:
+    """
+    Run a batch of formatting requests, one LLM call per LLM factory, user and format type.
+    
+    Replies are matched to requests by position only, so one user's data must
+    never share a prompt with another user's.
+    
+    Args:
+        requests: List of (llm_factory, scope, format_type, content) tuples, where
+            scope comes from batch_scope and requests with no scope run on their own
+        
+    Returns:
+        Formatted responses in the same order as the requests
+    """
+    return await dispatch_grouped(
+        requests,
+        lambda request: None if request[1] is None else (id(request[0]), request[1], request[2]),
+        lambda group: group[0][0].format_response_batch(
+            [content for _, _, _, content in group], format_type=group[0][2]
+        ),
+    )
+
+
+# Coalesces formatting of concurrent replies of the same type into one prompt
+_response_format_batcher = DynamicBatcher(
+    _format_response_batch, max_wait_ms=BatchSettings.INTERACTIVE_MAX_WAIT_MS
+)
+
 
 class ResponseFormatterAgent(BaseAgent):
     """
@@ -22,6 +183,14 @@ class ResponseFormatterAgent(BaseAgent):
     proper formatting, emojis, and length constraints.
     """
     
+    # Fallback replies, resolved once so a missing message key fails at import
+    # rather than inside an error handler
+    _QUERY_ERROR_FALLBACK = QUERY_FALLBACKS["query_error"]
+    _NO_RESULTS_FALLBACK = QUERY_FALLBACKS["no_results"]
+    _AMBIGUOUS_QUERY_FALLBACK = QUERY_FALLBACKS["ambiguous_query"]
+    _NO_RESPONSE_FALLBACK = GENERAL_FALLBACKS["no_response"]
+    _ERROR_FALLBACK = GENERAL_FALLBACKS["error"]
+    
     def __init__(self, llm_factory: LLMFactory):
         """
         Initialize the ResponseFormatterAgent.
@@ -41,23 +210,79 @@ class ResponseFormatterAgent(BaseAgent):
         Returns:
             JSON-serializable version of the object
         """
-        if isinstance(obj, datetime):
-            return obj.isoformat()
+        return _to_json_compatible(obj)
+    
+    def _prepare_query_result(self, content: Union[Dict[str, Any], List[Any]]) -> Any:
+        """
+        Keep query results structured for the LLM formatter.
         
-        # Handle Decimal objects (commonly returned by database queries)
-        if hasattr(obj, '__class__') and obj.__class__.__name__ == 'Decimal':
-            return float(obj)
+        Args:
+            content: Query result as a dict or list
+            
+        Returns:
+            JSON-compatible copy of the query result
+        """
+        logger.debug("Using structured content for query_result formatting")
+        return _to_json_compatible(content)
+    
+    def _prepare_json_text(self, content: Union[Dict[str, Any], List[Any]]) -> str:
+        """
+        Convert structured content to an indented JSON string for the LLM formatter.
         
-        if isinstance(obj, dict):
-            return {k: self._serialize_for_json(v) for k, v in obj.items()}
+        Args:
+            content: Content as a dict or list
+            
+        Returns:
+            JSON string, or the string representation if serialization fails
+        """
+        # A single encoder pass, converting datetime, Decimal and plain objects on the way
+        try:
+            content_for_llm = json_utils.dumps(content, indent=True, default=_json_default)
+            logger.debug("JSON content length: %d", len(content_for_llm))
+            return content_for_llm
+        except TypeError as e:
+            logger.warning(f"Error serializing content to JSON: {str(e)}")
+            # Fallback to string representation if JSON serialization fails
+            return str(content)
+    
+    def _query_result_fallback(self, content: Any) -> str:
+        """
+        Pick a fallback reply for a query result that could not be formatted.
+        
+        Args:
+            content: The query result that was being formatted
+            
+        Returns:
+            Fallback message for the user
+        """
+        if not isinstance(content, dict):
+            return self._NO_RESPONSE_FALLBACK
         
-        if isinstance(obj, list):
-            return [self._serialize_for_json(item) for item in obj]
+        if content.get('error', None):
+            fallback_response = self._QUERY_ERROR_FALLBACK
+        elif content.get('count', 0) == 0:
+            fallback_response = self._NO_RESULTS_FALLBACK
+        else:
+            fallback_response = self._AMBIGUOUS_QUERY_FALLBACK
         
-        if hasattr(obj, '__dict__'):
-            return self._serialize_for_json(obj.__dict__)
+        logger.debug("Created fallback response for query_result: %s", fallback_response)
+        return fallback_response
+    
+    def _general_fallback(self, content: Any) -> str:
+        """
+        Pick a fallback reply for content that could not be formatted.
         
-        return obj
+        Args:
+            content: The content that was being formatted
+            
+        Returns:
+            Fallback message for the user
+        """
+        return self._ERROR_FALLBACK
+    
+    # Per-format handlers, looked up once per call; the None entry is the default
+    _CONTENT_PREPARERS = {"query_result": _prepare_query_result, None: _prepare_json_text}
+    _FALLBACK_BUILDERS = {"query_result": _query_result_fallback, None: _general_fallback}
     
     async def process(self, 
                      agent_input: Union[AgentInput, Dict[str, Any]], 
@@ -83,78 +308,56 @@ class ResponseFormatterAgent(BaseAgent):
                 
                 format_type = agent_input.get('type', 'default')
                 if "type" in agent_input:
-                    logger.debug(f"Extracted format type '{format_type}' from input")
+                    logger.debug("Extracted format type '%s' from input", format_type)
                 
-                logger.debug(f"Using dictionary input with keys: {list(agent_input.keys())}")
+                debug_enabled = logger.isEnabledFor(logging.DEBUG)
+                if debug_enabled:
+                    logger.debug("Using dictionary input with keys: %s", list(agent_input.keys()))
                 if "metadata" not in agent_input:
                     # Add remaining dict items as metadata if not already there
                     for key, value in agent_input.items():
                         if key != "content" and key != "type":
                             metadata[key] = value
-                    logger.debug(f"Added additional keys to metadata: {[k for k in agent_input.keys() if k != 'content' and k != 'type']}")
+                    if debug_enabled:
+                        logger.debug("Added additional keys to metadata: %s",
+                                     [k for k in agent_input.keys() if k != 'content' and k != 'type'])
             else:
                 # Extract content and metadata from AgentInput
                 content = agent_input.content
                 metadata = agent_input.metadata
                 format_type = metadata.get('format_type', 'default')
-                logger.debug(f"Using AgentInput object with metadata keys: {list(metadata.keys())}")
+                logger.debug("Using AgentInput object with metadata keys: %s", metadata.keys())
             
             logger.info(f"Formatting response of type '{format_type}'")
             
-            # If content is a dict or list, convert to JSON string
+            # If content is a dict or list, prepare it the way this format type expects
             if isinstance(content, (dict, list)):
-                import json
-                logger.debug(f"Converting complex content to JSON string (type: {type(content).__name__})")
-                
-                # If format_type is query_result, keep the content as is for the LLM formatter
-                if format_type == 'query_result':
-                    # Serialize content for JSON compatibility
-                    content_for_llm = self._serialize_for_json(content)
-                    logger.debug(f"Using structured content for query_result formatting")
-                else:
-                    # For other types, convert to JSON string
-                    # Use custom serialization for datetime objects
-                    try:
-                        # First make sure all objects are serializable
-                        serialized_content = self._serialize_for_json(content)
-                        
-                        class DateTimeEncoder(json.JSONEncoder):
-                            def default(self, obj):
-                                if isinstance(obj, datetime):
-                                    return obj.isoformat()
-                                return super().default(obj)
-                        
-                        content_for_llm = json.dumps(serialized_content, ensure_ascii=False, indent=2, cls=DateTimeEncoder)
-                        logger.debug(f"JSON content length: {len(content_for_llm)}")
-                    except TypeError as e:
-                        logger.warning(f"Error serializing content to JSON: {str(e)}")
-                        # Fallback to string representation if JSON serialization fails
-                        content_for_llm = str(content)
+                logger.debug("Converting complex content to JSON string (type: %s)", type(content).__name__)
+                preparers = self._CONTENT_PREPARERS
+                content_for_llm = (preparers.get(format_type) or preparers[None])(self, content)
             else:
                 content_for_llm = str(content)
-                logger.debug(f"String content length: {len(content_for_llm)}")
+                logger.debug("String content length: %d", len(content_for_llm))
             
             # Call LLM to format the response
             logger.info(f"Calling LLM for response formatting")
             try:
-                formatted_response = await self.llm_factory.format_response(
-                    content=content_for_llm,
-                    format_type=format_type
+                formatted_response = await _response_format_batcher.submit(
+                    (self.llm_factory, batch_scope(context), format_type, content_for_llm)
                 )
                 
-                logger.debug(f"Raw formatted response length: {len(formatted_response)}")
+                logger.debug("Raw formatted response length: %d", len(formatted_response))
                 
                 # Apply additional WhatsApp-specific formatting if needed
                 logger.info("Applying WhatsApp-specific formatting")
                 whatsapp_formatted = self._apply_whatsapp_formatting(formatted_response)
                 
                 logger.info(f"Final formatted response length: {len(whatsapp_formatted)}")
-                logger.debug(f"Formatted response preview: {whatsapp_formatted[:100]}...")
+                logger.debug("Formatted response preview: %.100s...", whatsapp_formatted)
                 
                 # Check for emojis and formatting markers
-                emoji_count = self._count_emojis(whatsapp_formatted)
-                formatting_markers = self._detect_formatting_markers(whatsapp_formatted)
-                logger.debug(f"Response contains {emoji_count} emojis and formatting markers: {formatting_markers}")
+                emoji_count, formatting_markers = self._analyze_formatting(whatsapp_formatted)
+                logger.debug("Response contains %d emojis and formatting markers: %s", emoji_count, formatting_markers)
                 
                 logger.info("=== RESPONSE FORMATTER COMPLETED ===")
                 
@@ -173,25 +376,9 @@ class ResponseFormatterAgent(BaseAgent):
             except Exception as e:
                 logger.error(f"Error formatting response: {str(e)}", exc_info=True)
                 
-                # Create a readable fallback for query results
-                if format_type == 'query_result':
-                    if isinstance(content, dict):
-                        query = content.get('query', 'your query')
-                        count = content.get('count', 0)
-                        error = content.get('error', None)
-                        
-                        if error:
-                            fallback_response = QUERY_FALLBACKS["query_error"]
-                        elif count == 0:
-                            fallback_response = QUERY_FALLBACKS["no_results"]
-                        else:
-                            fallback_response = QUERY_FALLBACKS["ambiguous_query"]
-                        
-                        logger.debug(f"Created fallback response for query_result: {fallback_response}")
-                    else:
-                        fallback_response = GENERAL_FALLBACKS["no_response"]
-                else:
-                    fallback_response = GENERAL_FALLBACKS["error"]
+                # Create a readable fallback, specific to query results
+                fallbacks = self._FALLBACK_BUILDERS
+                fallback_response = (fallbacks.get(format_type) or fallbacks[None])(self, content)
                 
                 logger.info("=== RESPONSE FORMATTER COMPLETED WITH FALLBACK ===")
                 
@@ -216,11 +403,7 @@ class ResponseFormatterAgent(BaseAgent):
             else:
                 original_content = agent_input.content
             
-            if isinstance(original_content, (dict, list)):
-                import json
-                fallback_response = GENERAL_FALLBACKS["error"]
-            else:
-                fallback_response = GENERAL_FALLBACKS["error"]
+            fallback_response = self._ERROR_FALLBACK
             
             return AgentOutput(
                 content=fallback_response,
@@ -260,56 +443,35 @@ class ResponseFormatterAgent(BaseAgent):
             text = text[:MAX_WHATSAPP_LENGTH - 100] + "\n\n[Message truncated due to length limits]"
             logger.debug("Message truncated to fit WhatsApp length limit")
         
+        # Most replies have no characters outside the BMP; isascii() is a flag
+        # check, and a UTF-16 encoding is two bytes per character exactly when
+        # there are no surrogate pairs, so skip the regex for those
+        if text.isascii() or len(text.encode('utf-16-le', 'surrogatepass')) == 2 * len(text):
+            return text
+        
         # Example: Ensure proper spacing after emojis
         # This regex would be more sophisticated in a real implementation
-        import re
         original_length = len(text)
-        text = re.sub(r'([\U00010000-\U0010ffff])', r'\1 ', text)
+        text = _EMOJI_SPACING_RE.sub(_space_after, text)
         
         if len(text) != original_length:
-            logger.debug(f"Adjusted emoji spacing (original: {original_length}, new: {len(text)})")
+            logger.debug("Adjusted emoji spacing (original: %d, new: %d)", original_length, len(text))
         
         return text
     
-    def _count_emojis(self, text: str) -> int:
+    def _analyze_formatting(self, text: str) -> Tuple[int, List[str]]:
         """
-        Count the number of emojis in the text.
+        Count emojis and detect WhatsApp formatting markers in the text.
         
         Args:
             text: The text to analyze
             
         Returns:
-            Number of emojis found
+            A tuple of (number of emojis found, list of formatting markers found)
         """
-        import re
-        emoji_pattern = re.compile(
-            "["
-            "\U0001F600-\U0001F64F"  # emoticons
-            "\U0001F300-\U0001F5FF"  # symbols & pictographs
-            "\U0001F680-\U0001F6FF"  # transport & map symbols
-            "\U0001F700-\U0001F77F"  # alchemical symbols
-            "\U0001F780-\U0001F7FF"  # geometric shapes
-            "\U0001F800-\U0001F8FF"  # supplemental arrows
-            "\U0001F900-\U0001F9FF"  # supplemental symbols
-            "\U0001FA00-\U0001FA6F"  # extended symbols
-            "\U0001FA70-\U0001FAFF"  # extended symbols
-            "\U00002702-\U000027B0"  # misc symbols
-            "\U000024C2-\U0001F251" 
-            "]+"
-        )
-        emojis = emoji_pattern.findall(text)
-        return len(emojis)
-    
-    def _detect_formatting_markers(self, text: str) -> List[str]:
-        """
-        Detect WhatsApp formatting markers in the text.
+        # Emojis are never ASCII, so plain replies skip the regex scan
+        emoji_count = 0 if text.isascii() else len(_EMOJI_RE.findall(text))
         
-        Args:
-            text: The text to analyze
-            
-        Returns:
-            List of formatting markers found
-        """
         markers = []
         if "*" in text:
             markers.append("bold")
@@ -317,10 +479,9 @@ class ResponseFormatterAgent(BaseAgent):
             markers.append("italic")
         if "~" in text:
             markers.append("strikethrough")
-        if "```" in text:
-            markers.append("code_block")
-        if "`" in text and "```" not in text:
-            markers.append("inline_code")
+        if "`" in text:
+            # Only look for a code block fence when there is a backtick at all
+            markers.append("code_block" if "```" in text else "inline_code")
         if "•" in text or "·" in text or "⁃" in text or "◦" in text:
             markers.append("bullet_list")
-        return markers 
\ No newline at end of file
+        return emoji_count, markers
@@ -1,16 +1,121 @@
+import hashlib
 import logging
-import json
+import re
 from typing import Dict, Any, Optional, List, Tuple
 
 from utils.base_agent import BaseAgent, AgentInput, AgentOutput, AgentContext
 from langchain_app.state import IntentType
-from constants.intent_types import INTENT_CONFIDENCE_THRESHOLDS
+from constants.intent_types import (
+    INTENT_CONFIDENCE_THRESHOLDS,
+    INTENT_HISTORY_MAX_MESSAGES,
+    INTENT_HISTORY_MAX_CONTENT_CHARS
+)
 from constants.prompt_mappings import AgentType, get_prompt_for_agent
 from services.llm_factory import LLMFactory
+from constants.llm_configs import BatchSettings
+from utils.dynamic_batcher import DynamicBatcher, batch_scope, dispatch_grouped
+from utils.extraction_cache import RecentResultCache
+from utils import json_utils
 
 # Configure logger for this module
 logger = logging.getLogger(__name__)
 
+# Punctuation ignored when comparing utterances for the intent cache
+_PUNCTUATION_RE = re.compile(r"[^\w\s]+")
+
+# Keyword rules for messages that need no LLM: (pattern, intent, confidence).
+# They match whole messages or leading imperatives only, so anything mixed or
+# ambiguous, such as "hi, what did I spend last month?", still goes to the LLM.
+_FAST_PATH_RULES = (
+    (re.compile(r"^\s*(hi|hello|hey|hiya|good (morning|afternoon|evening))( there)?\s*[!.]*\s*$", re.IGNORECASE),
+     IntentType.GREETING, 0.95),
+    (re.compile(r"^\s*(please\s+)?((create|generate)\b|(add|make)\s+(an?|another|new)\b).{0,30}\binvoice\b",
+                re.IGNORECASE),
+     IntentType.INVOICE_CREATOR, 0.9),
+    (re.compile(r"^\s*(please\s+)?(show|list|find)\b(?!\s+(me\s+)?how\b).{0,40}\binvoices\b"
+                r"|^\s*how (many|much)\b.{0,40}\b(invoices?|spend|spent)\b", re.IGNORECASE),
+     IntentType.INVOICE_QUERY, 0.9),
+)
+
+# Intents the LLM may answer with in plain text, keyed by normalized name
+_PLAIN_TEXT_INTENTS = {
+    "greeting": IntentType.GREETING,
+    "general": IntentType.GENERAL,
+    "invoicequery": IntentType.INVOICE_QUERY,
+    "invoicecreator": IntentType.INVOICE_CREATOR
+}
+
+# Characters dropped when normalizing an intent name, e.g. "Invoice Query" or "invoice_query"
+_INTENT_NAME_SEPARATORS = str.maketrans("", "", " \t\r\n-_")
+
+
+def _normalize_intent_name(text: str) -> str:
+    """Lowercase an intent name and drop whitespace and separators in one pass each."""
+    return text.translate(_INTENT_NAME_SEPARATORS).lower()
+
+
+# Classified intents for recently seen utterances, keyed by canonical form and history
+intent_results = RecentResultCache(maxsize=1024)
+
+
+def _canonical_utterance(text: str) -> str:
+    """Lowercase text, drop punctuation and collapse whitespace, so "Hi!" and "hi" share a cache key."""
+    return " ".join(_PUNCTUATION_RE.sub("", text.casefold()).split())
+
+
+def _fast_classify(text: str) -> Optional[Tuple[IntentType, float]]:
+    """
+    Classify a message with the keyword rules.
+    
+    Args:
+        text: The user's message
+        
+    Returns:
+        A tuple of (intent, confidence), or None if no rule matches
+    """
+    for pattern, intent, confidence in _FAST_PATH_RULES:
+        if pattern.search(text):
+            return intent, confidence
+    return None
+
+
+def _shorten_history_content(content: Any) -> Any:
+    """Cut a history message down to INTENT_HISTORY_MAX_CONTENT_CHARS, marking the cut with an ellipsis."""
+    if isinstance(content, str) and len(content) > INTENT_HISTORY_MAX_CONTENT_CHARS:
+        return content[:INTENT_HISTORY_MAX_CONTENT_CHARS] + "..."
+    return content
+
+
+def _history_digest(history: List[Dict[str, Any]]) -> Optional[str]:
+    """SHA-256 of the conversation history, since the same utterance can mean different things in context."""
+    if not history:
+        return None
+    return hashlib.sha256(json_utils.dumps(history, default=str).encode("utf-8")).hexdigest()
+
+
+async def _classify_intents_batch(requests: List[Any]) -> List[str]:
+    """
+    Run a batch of intent classification requests, one LLM call per LLM factory and user.
+    
+    Args:
+        requests: List of (llm_factory, scope, input_text) tuples, where scope comes
+            from batch_scope and requests with no scope are classified on their own
+        
+    Returns:
+        Raw classification results in the same order as the requests
+    """
+    return await dispatch_grouped(
+        requests,
+        lambda request: None if request[1] is None else (id(request[0]), request[1]),
+        lambda group: group[0][0].classify_text_intent_batch([text for _, _, text in group]),
+    )
+
+
+# Coalesces concurrent classifications into one prompt
+_intent_classification_batcher = DynamicBatcher(
+    _classify_intents_batch, max_wait_ms=BatchSettings.INTERACTIVE_MAX_WAIT_MS
+)
+
 
 class TextIntentClassifierAgent(BaseAgent):
     """
@@ -20,15 +125,17 @@ class TextIntentClassifierAgent(BaseAgent):
     to enable proper routing to specialized agents.
     """
     
-    def __init__(self, llm_factory: LLMFactory):
+    def __init__(self, llm_factory: LLMFactory, intent_cache: Optional[RecentResultCache] = None):
         """
         Initialize the TextIntentClassifierAgent.
         
         Args:
             llm_factory: LLMFactory instance for LLM operations
+            intent_cache: Cache of classified intents; defaults to the shared module cache
         """
         super().__init__(llm_factory)
         self.agent_type = AgentType.TEXT_INTENT_CLASSIFIER
+        self.intent_cache = intent_results if intent_cache is None else intent_cache
         
     async def process(self, 
                      agent_input: AgentInput, 
@@ -49,54 +156,121 @@ class TextIntentClassifierAgent(BaseAgent):
         if isinstance(agent_input, dict):
             user_input = agent_input.get("content", "")
             conversation_history = agent_input.get("conversation_history", [])
-            logger.debug(f"Using dictionary input with content: '{user_input[:50]}...'")
-            logger.debug(f"Dictionary input includes {len(conversation_history)} history items")
+            logger.debug("Using dictionary input with content: '%.50s...'", user_input)
+            logger.debug("Dictionary input includes %d history items", len(conversation_history))
         else:
             user_input = agent_input.content
-            logger.debug(f"Using AgentInput object with content: '{user_input[:50]}...'")
+            logger.debug("Using AgentInput object with content: '%.50s...'", user_input)
             # Extract conversation history if available
             conversation_history = []
             if context and hasattr(context, 'conversation_history') and context.conversation_history:
                 # Make sure to get the whole conversation history for proper context
                 conversation_history = context.conversation_history
-                logger.debug(f"Extracted {len(conversation_history)} history items from context")
+                logger.debug("Extracted %d history items from context", len(conversation_history))
         
-        # Format conversation history in the expected format for the LLM
+        # Empty messages (e.g. a sticker or an empty caption) have no intent, and
+        # neither does a single character with no conversation to follow up on
+        if isinstance(user_input, str):
+            stripped_input = user_input.strip()
+            if not stripped_input or (len(stripped_input) < 2 and not conversation_history):
+                reason = "empty_input" if not stripped_input else "too_short"
+                logger.info(f"Skipping intent classification: {reason}")
+                logger.info("=== TEXT INTENT CLASSIFIER COMPLETED ===")
+                return AgentOutput(
+                    content=IntentType.UNKNOWN,
+                    confidence=0.0,
+                    metadata={
+                        "confidence_level": self._determine_confidence_level(0.0),
+                        "alternative_intents": [],
+                        "explanation": "Message has no classifiable content",
+                        "reason": reason
+                    },
+                    status="success"
+                )
+        
+        # Unambiguous messages are classified by keyword rules without the LLM
+        fast_result = _fast_classify(user_input) if isinstance(user_input, str) else None
+        if fast_result is not None:
+            intent, confidence = fast_result
+            logger.info(f"Intent classified by keyword rule: {intent} with confidence {confidence}")
+            logger.info("=== TEXT INTENT CLASSIFIER COMPLETED ===")
+            return AgentOutput(
+                content=intent,
+                confidence=confidence,
+                metadata={
+                    "confidence_level": self._determine_confidence_level(confidence),
+                    "alternative_intents": [],
+                    "explanation": "Matched a keyword rule",
+                    "fast_path": True
+                },
+                status="success"
+            )
+        
+        # Format the most recent conversation history in the expected format for
+        # the LLM; only role and content are sent, since other keys cost tokens
         formatted_history = []
-        for message in conversation_history:
+        for message in conversation_history[-INTENT_HISTORY_MAX_MESSAGES:]:
             if isinstance(message, dict):
-                # If already in the right format, use it directly
-                formatted_history.append(message)
+                formatted_history.append({
+                    "role": message.get("role"),
+                    "content": _shorten_history_content(message.get("content"))
+                })
             elif hasattr(message, 'role') and hasattr(message, 'content'):
                 # Convert from object to dict if needed
                 formatted_history.append({
                     "role": message.role,
-                    "content": message.content
+                    "content": _shorten_history_content(message.content)
                 })
             
-        # Prepare the input for intent classification
+        # Repeated utterances in the same context skip the LLM
+        cache_key = None
+        if isinstance(user_input, str):
+            cache_key = (_canonical_utterance(user_input), _history_digest(formatted_history))
+            cached_result = self.intent_cache.get(cache_key)
+            if cached_result is not None:
+                logger.info(f"Using cached intent classification: {cached_result['intent']}")
+                logger.info("=== TEXT INTENT CLASSIFIER COMPLETED ===")
+                return AgentOutput(
+                    content=cached_result["intent"],
+                    confidence=cached_result["confidence"],
+                    metadata={
+                        "confidence_level": self._determine_confidence_level(cached_result["confidence"]),
+                        "alternative_intents": cached_result.get("alternative_intents", []),
+                        "explanation": cached_result.get("explanation", ""),
+                        "cache_hit": True
+                    },
+                    status="success"
+                )
+        
+        # Prepare the input for intent classification; it is serialized compactly
+        # with non-ASCII text kept as is, so emojis aren't sent as escape sequences
         classification_input = {
             "user_input": user_input,
             "conversation_history": formatted_history
         }
         
         logger.info(f"Classifying intent for text: '{user_input}'")
-        logger.debug(f"Using {len(formatted_history)} conversation history items for context")
-        logger.debug(f"Conversation history: {formatted_history}")
+        logger.debug("Using %d conversation history items for context", len(formatted_history))
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("Conversation history: %s", formatted_history)
         
         # Call LLM to classify intent
         try:
             # Render the prompt with the input
             logger.info("Calling LLM to classify text intent")
-            classification_result = await self.llm_factory.classify_text_intent(
-                input_text=json.dumps(classification_input)
+            classification_result = await _intent_classification_batcher.submit(
+                (self.llm_factory, batch_scope(context), json_utils.dumps(classification_input))
             )
             
             # Parse the response
-            logger.debug(f"LLM classification raw result: {classification_result}")
+            logger.debug("LLM classification raw result: %s", classification_result)
             logger.info("Parsing LLM classification result")
             parsed_result = self._parse_classification_result(classification_result)
             
+            # Unparseable responses come back as UNKNOWN; don't let them stick
+            if cache_key is not None and parsed_result["intent"] != IntentType.UNKNOWN:
+                self.intent_cache.put(cache_key, parsed_result)
+            
             # Determine confidence level
             confidence_level = self._determine_confidence_level(parsed_result["confidence"])
             logger.info(f"Intent classification result: {parsed_result['intent']} with confidence {parsed_result['confidence']} ({confidence_level})")
@@ -108,7 +282,8 @@ class TextIntentClassifierAgent(BaseAgent):
                 "explanation": parsed_result.get("explanation", "")
             }
             
-            logger.debug(f"Intent metadata: {metadata}")
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug("Intent metadata: %s", metadata)
             logger.info("=== TEXT INTENT CLASSIFIER COMPLETED ===")
             
             return AgentOutput(
@@ -140,109 +315,104 @@ class TextIntentClassifierAgent(BaseAgent):
         """
         logger.info("Parsing classification result")
         
-        try:
-            # Try to parse as JSON
-            logger.debug("Attempting to parse result as JSON")
-            parsed = json.loads(result)
-            
-            # Validate required fields
-            if "intent" not in parsed or "confidence" not in parsed:
-                logger.warning("Missing required fields in classification result")
-                raise ValueError("Missing required fields in classification result")
-            
-            # Convert string intent to enum value if it's not already
-            if isinstance(parsed["intent"], str):
-                logger.debug(f"Converting string intent '{parsed['intent']}' to enum")
-                try:
-                    parsed["intent"] = IntentType(parsed["intent"].lower())
-                    logger.debug(f"Successfully converted to enum: {parsed['intent']}")
-                except ValueError:
-                    logger.warning(f"Unknown intent type: {parsed['intent']}, defaulting to UNKNOWN")
-                    parsed["intent"] = IntentType.UNKNOWN
-            
-            logger.info(f"Successfully parsed JSON result: {parsed['intent']} with confidence {parsed['confidence']}")
-            return parsed
-            
-        except json.JSONDecodeError:
-            # If not JSON, try to extract intent and confidence from text
-            logger.warning("Failed to parse classification result as JSON, attempting text extraction")
-            
-            # First, try to handle simple responses like "Greeting", "General", etc.
-            intent_str = result.strip().lower()
-            logger.debug(f"Attempting to match plain text intent: '{intent_str}'")
-            
-            # Map the plain text response to the correct IntentType
-            intent_map = {
-                "greeting": IntentType.GREETING,
-                "general": IntentType.GENERAL,
-                "invoicequery": IntentType.INVOICE_QUERY,
-                "invoice query": IntentType.INVOICE_QUERY,
-                "invoicecreator": IntentType.INVOICE_CREATOR,
-                "invoice creator": IntentType.INVOICE_CREATOR
+        # Only attempt a JSON parse when the response looks like JSON, so plain
+        # text replies like "Greeting" don't raise and catch a decode error
+        if result.lstrip().startswith(("{", "[")):
+            try:
+                # Try to parse as JSON
+                logger.debug("Attempting to parse result as JSON")
+                parsed = json_utils.loads(result)
+                
+                # Validate required fields
+                if "intent" not in parsed or "confidence" not in parsed:
+                    logger.warning("Missing required fields in classification result")
+                    raise ValueError("Missing required fields in classification result")
+                
+                # Convert string intent to enum value if it's not already
+                if isinstance(parsed["intent"], str):
+                    logger.debug("Converting string intent '%s' to enum", parsed["intent"])
+                    try:
+                        parsed["intent"] = IntentType(parsed["intent"].lower())
+                        logger.debug("Successfully converted to enum: %s", parsed["intent"])
+                    except ValueError:
+                        logger.warning(f"Unknown intent type: {parsed['intent']}, defaulting to UNKNOWN")
+                        parsed["intent"] = IntentType.UNKNOWN
+                
+                logger.info(f"Successfully parsed JSON result: {parsed['intent']} with confidence {parsed['confidence']}")
+                return parsed
+                
+            except json_utils.JSONDecodeError:
+                logger.debug("Classification result looked like JSON but did not parse")
+        
+        # If not JSON, try to extract intent and confidence from text
+        logger.warning("Failed to parse classification result as JSON, attempting text extraction")
+        
+        # First, try to handle simple responses like "Greeting", "General", etc.
+        intent_str = result.strip().lower()
+        logger.debug("Attempting to match plain text intent: '%s'", intent_str)
+        
+        # Remove whitespace and separators; intent_str is already lowercase
+        normalized_intent = intent_str.translate(_INTENT_NAME_SEPARATORS)
+        logger.debug("Normalized intent string: '%s'", normalized_intent)
+        
+        if normalized_intent in _PLAIN_TEXT_INTENTS:
+            # If we have a direct match, use it with high confidence
+            logger.info(f"Found direct match for normalized intent: {normalized_intent}")
+            return {
+                "intent": _PLAIN_TEXT_INTENTS[normalized_intent],
+                "confidence": 0.9,
+                "explanation": f"Extracted from text response: {intent_str}"
             }
+        
+        # If no direct match, try more complex extraction
+        logger.debug("No direct match found, attempting to extract intent:confidence pattern")
+        if "intent:" in result.lower() and "confidence:" in result.lower():
+            logger.info("Detected intent:confidence pattern in text")
+            lines = result.split("\n")
+            intent_line = next((l for l in lines if "intent:" in l.lower()), "")
+            confidence_line = next((l for l in lines if "confidence:" in l.lower()), "")
             
-            # Remove spaces and convert to lowercase
-            normalized_intent = intent_str.replace(" ", "").lower()
-            logger.debug(f"Normalized intent string: '{normalized_intent}'")
+            logger.debug("Intent line: '%s'", intent_line)
+            logger.debug("Confidence line: '%s'", confidence_line)
             
-            if normalized_intent in intent_map:
-                # If we have a direct match, use it with high confidence
-                logger.info(f"Found direct match for normalized intent: {normalized_intent}")
-                return {
-                    "intent": intent_map[normalized_intent],
-                    "confidence": 0.9,
-                    "explanation": f"Extracted from text response: {intent_str}"
-                }
+            intent_str = intent_line.split(":", 1)[1].strip() if ":" in intent_line else ""
+            confidence_str = confidence_line.split(":", 1)[1].strip() if ":" in confidence_line else ""
             
-            # If no direct match, try more complex extraction
-            logger.debug("No direct match found, attempting to extract intent:confidence pattern")
-            if "intent:" in result.lower() and "confidence:" in result.lower():
-                logger.info("Detected intent:confidence pattern in text")
-                lines = result.split("\n")
-                intent_line = next((l for l in lines if "intent:" in l.lower()), "")
-                confidence_line = next((l for l in lines if "confidence:" in l.lower()), "")
-                
-                logger.debug(f"Intent line: '{intent_line}'")
-                logger.debug(f"Confidence line: '{confidence_line}'")
-                
-                intent_str = intent_line.split(":", 1)[1].strip() if ":" in intent_line else ""
-                confidence_str = confidence_line.split(":", 1)[1].strip() if ":" in confidence_line else ""
-                
-                logger.debug(f"Extracted intent string: '{intent_str}'")
-                logger.debug(f"Extracted confidence string: '{confidence_str}'")
+            logger.debug("Extracted intent string: '%s'", intent_str)
+            logger.debug("Extracted confidence string: '%s'", confidence_str)
+            
+            normalized_intent = _normalize_intent_name(intent_str)
+            if normalized_intent in _PLAIN_TEXT_INTENTS:
+                intent = _PLAIN_TEXT_INTENTS[normalized_intent]
+                logger.info(f"Matched extracted intent to: {intent}")
+            else:
+                intent = IntentType.UNKNOWN
+                logger.warning(f"Could not match extracted intent '{intent_str}', using UNKNOWN")
                 
-                normalized_intent = intent_str.replace(" ", "").lower()
-                if normalized_intent in intent_map:
-                    intent = intent_map[normalized_intent]
-                    logger.info(f"Matched extracted intent to: {intent}")
+            try:
+                confidence = float(confidence_str)
+                if not 0 <= confidence <= 1:
+                    logger.warning(f"Confidence value {confidence} out of range, defaulting to 0.5")
+                    confidence = 0.5  # Default if out of range
                 else:
-                    intent = IntentType.UNKNOWN
-                    logger.warning(f"Could not match extracted intent '{intent_str}', using UNKNOWN")
-                    
-                try:
-                    confidence = float(confidence_str)
-                    if not 0 <= confidence <= 1:
-                        logger.warning(f"Confidence value {confidence} out of range, defaulting to 0.5")
-                        confidence = 0.5  # Default if out of range
-                    else:
-                        logger.info(f"Parsed confidence: {confidence}")
-                except (ValueError, TypeError):
-                    logger.warning(f"Could not parse confidence '{confidence_str}', defaulting to 0.5")
-                    confidence = 0.5  # Default if not parseable
-                    
-                return {
-                    "intent": intent,
-                    "confidence": confidence,
-                    "explanation": "Extracted from text response"
-                }
-            
-            # If all else fails, return UNKNOWN with low confidence
-            logger.warning("Could not parse classification result in any format, using UNKNOWN intent")
+                    logger.info(f"Parsed confidence: {confidence}")
+            except (ValueError, TypeError):
+                logger.warning(f"Could not parse confidence '{confidence_str}', defaulting to 0.5")
+                confidence = 0.5  # Default if not parseable
+                
             return {
-                "intent": IntentType.UNKNOWN,
-                "confidence": 0.1,
-                "explanation": f"Could not parse classification result: {result}"
+                "intent": intent,
+                "confidence": confidence,
+                "explanation": "Extracted from text response"
             }
+        
+        # If all else fails, return UNKNOWN with low confidence
+        logger.warning("Could not parse classification result in any format, using UNKNOWN intent")
+        return {
+            "intent": IntentType.UNKNOWN,
+            "confidence": 0.1,
+            "explanation": f"Could not parse classification result: {result}"
+        }
     
     def _determine_confidence_level(self, confidence: float) -> str:
         """
@@ -254,7 +424,7 @@ class TextIntentClassifierAgent(BaseAgent):
         Returns:
             String representing the confidence level (high, medium, low)
         """
-        logger.debug(f"Determining confidence level for score: {confidence}")
+        logger.debug("Determining confidence level for score: %s", confidence)
         
         if confidence >= INTENT_CONFIDENCE_THRESHOLDS["high"]:
             level = "high"
@@ -263,5 +433,5 @@ class TextIntentClassifierAgent(BaseAgent):
         else:
             level = "low"
         
-        logger.debug(f"Confidence level: {level}")
+        logger.debug("Confidence level: %s", level)
         return level
\ No newline at end of file
@@ -687,7 +687,7 @@ Use the following PostgreSQL database schema information to craft your queries:
 {self.db_schema_info}
 
 Important vector search information:
-- The items table has a column 'description_embedding' of type vector(1536) for semantic search
+- The items table has a column 'description_embedding' of type halfvec(1536) for semantic search
 - When doing vector similarity search, use the l2_distance function with proper syntax:
   l2_distance(description_embedding::vector, '[:query_embedding]'::vector)
 - DO NOT use to_vector() function as it does not exist in PostgreSQL
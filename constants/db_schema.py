@@ -41,7 +41,7 @@ items:
 - total_price (FLOAT): The total price for this item (quantity * unit_price)
 - item_category (TEXT): Category of the item (nullable)
 - item_code (TEXT): Code or SKU for the item (nullable)
-- description_embedding (VECTOR): Vector embedding of the item description
+- description_embedding (HALFVEC): Half-precision vector embedding of the item description
 - created_at (TIMESTAMP): When the item was created
 - updated_at (TIMESTAMP): When the item was last updated
 
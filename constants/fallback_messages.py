@@ -78,6 +78,8 @@ Respond with a JSON object with the following structure:
 # File validation messages
 FILE_VALIDATION_MESSAGES = {
     "plain_text_invalid": "Plain text is not a valid invoice file format",
+    "empty_file": "The file is empty",
+    "image_too_large": "The image is too large to validate",
     "parse_validation_failed": "Failed to parse validation response",
     "validation_failed": "Could not properly validate the file",
     "image_validation_failed": "Could not properly validate image"
@@ -60,4 +60,10 @@ INTENT_CONFIDENCE_THRESHOLDS = {
     "high": 0.85,      # High confidence, proceed with the detected intent
     "medium": 0.70,    # Medium confidence, may require confirmation
     "low": 0.50        # Low confidence, may need clarification
-}
\ No newline at end of file
+}
+
+
+# Conversation history sent with each intent classification; the most recent
+# messages decide follow-ups, so older ones are dropped and long ones shortened
+INTENT_HISTORY_MAX_MESSAGES = 4
+INTENT_HISTORY_MAX_CONTENT_CHARS = 200
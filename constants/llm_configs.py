@@ -53,6 +53,17 @@ class TokenLimits:
     MAX_OUTPUT_TOKENS_MEDIUM = 1500  # For medium-length responses like SQL or data extraction
     MAX_OUTPUT_TOKENS_LONG = 4000   # For long responses like comprehensive summaries
 
+# Request Batching
+class BatchSettings:
+    """Settings for coalescing concurrent LLM requests into one call."""
+    MAX_BATCH_SIZE = 5  # Maximum number of documents combined into one prompt
+    MAX_WAIT_MS = 50    # How long to wait for more requests before dispatching
+    INTERACTIVE_MAX_WAIT_MS = 10  # Shorter wait for calls made while the user waits on a reply
+    WORKER_IDLE_MS = 30000  # How long an idle batcher keeps its collector task alive
+
+# Structured output: makes OpenAI models return a single valid JSON object
+JSON_RESPONSE_FORMAT = {"type": "json_object"}
+
 # LLM Provider enum (backward compatibility)
 class LLMProvider(str, Enum):
     """Enum for supported LLM providers."""
@@ -71,6 +71,12 @@ engine = create_engine(
     pool_size=settings.get("pool_size", 10),
     max_overflow=settings.get("max_overflow", 20),
     echo=settings.get("echo", False),
+    # Validate pooled connections on checkout and replace them before the
+    # server or a proxy drops them, so a stale connection doesn't fail a request
+    pool_pre_ping=settings.get("pool_pre_ping", True),
+    pool_recycle=settings.get("pool_recycle", 1800),
+    # Rows per statement when an executemany INSERT ... RETURNING is batched
+    insertmanyvalues_page_size=settings.get("insertmanyvalues_page_size", 1000),
 )
 
 def check_pgvector_extension() -> bool:
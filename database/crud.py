@@ -346,4 +346,4 @@ conversation = CRUDConversation(schemas.Conversation)
 message = CRUDMessage(schemas.Message)
 whatsapp_message = CRUDWhatsAppMessage(schemas.WhatsAppMessage)
 media = CRUDMedia(schemas.Media)
-usage = CRUDUsage(schemas.Usage) 
\ No newline at end of file
+usage = CRUDUsage(schemas.Usage)
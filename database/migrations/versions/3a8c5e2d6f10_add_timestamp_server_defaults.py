@@ -0,0 +1,34 @@
+"""Add server defaults for invoice, item and media timestamps
+
+Revision ID: 3a8c5e2d6f10
+Revises: 6c0dda5c0543
+Create Date: 2026-10-16 11:04:27.331590
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '3a8c5e2d6f10'
+down_revision = '6c0dda5c0543'
+branch_labels = None
+depends_on = None
+
+TABLES = ('invoices', 'items', 'media')
+
+
+def upgrade() -> None:
+    for table in TABLES:
+        for column in ('created_at', 'updated_at'):
+            op.alter_column(table, column,
+                       existing_type=sa.DateTime(),
+                       server_default=sa.text("TIMEZONE('utc', CURRENT_TIMESTAMP)"))
+
+
+def downgrade() -> None:
+    for table in TABLES:
+        for column in ('created_at', 'updated_at'):
+            op.alter_column(table, column,
+                       existing_type=sa.DateTime(),
+                       server_default=None)
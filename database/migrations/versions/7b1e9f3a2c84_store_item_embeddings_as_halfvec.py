@@ -0,0 +1,52 @@
+"""Store item description embeddings as halfvec
+
+Revision ID: 7b1e9f3a2c84
+Revises: 3a8c5e2d6f10
+Create Date: 2026-10-16 11:42:09.184736
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '7b1e9f3a2c84'
+down_revision = '3a8c5e2d6f10'
+branch_labels = None
+depends_on = None
+
+INDEX_NAME = 'items_description_embedding_idx'
+
+
+def _has_embedding_index() -> bool:
+    """Check whether the ivfflat index on item embeddings exists."""
+    result = op.get_bind().execute(
+        sa.text("SELECT 1 FROM pg_indexes WHERE tablename = 'items' AND indexname = :name"),
+        {"name": INDEX_NAME}
+    )
+    return result.first() is not None
+
+
+def _convert(column_type: str, opclass: str) -> None:
+    """Change the embedding column type, rebuilding its index if present."""
+    has_index = _has_embedding_index()
+    if has_index:
+        op.execute(f'DROP INDEX {INDEX_NAME}')
+    op.execute(
+        f'ALTER TABLE items ALTER COLUMN description_embedding '
+        f'TYPE {column_type} USING description_embedding::{column_type}'
+    )
+    if has_index:
+        op.execute(
+            f'CREATE INDEX {INDEX_NAME} ON items USING ivfflat '
+            f'(description_embedding {opclass}) WITH (lists = 100)'
+        )
+
+
+def upgrade() -> None:
+    # halfvec requires pgvector 0.7.0 or later on the server
+    _convert('halfvec(1536)', 'halfvec_cosine_ops')
+
+
+def downgrade() -> None:
+    _convert('vector(1536)', 'vector_cosine_ops')
@@ -256,4 +256,4 @@ class UsageResponse(UsageBase):
     """Usage response model."""
     id: uuid.UUID
     user_id: uuid.UUID
-    created_at: datetime 
\ No newline at end of file
+    created_at: datetime
@@ -12,13 +12,15 @@ from sqlalchemy import (
     Boolean, Column, DateTime, ForeignKey, Integer, 
     Numeric, String, Text, Enum, Float, UUID, JSON, UniqueConstraint
 )
+from sqlalchemy.ext.compiler import compiles
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import relationship
+from sqlalchemy.sql.expression import FunctionElement
 import enum
 
 # Try to import pgvector, fallback to a placeholder if not installed
 try:
-    from pgvector.sqlalchemy import Vector
+    from pgvector.sqlalchemy import HALFVEC, Vector
     has_pgvector = True
     logging.info("pgvector extension available, using Vector type")
 except ImportError:
@@ -45,11 +47,31 @@ except ImportError:
                     return None
                 return value
             return process
+    
+    class HALFVEC(Vector):
+        """Placeholder for half-precision vectors, also stored as TEXT."""
     has_pgvector = False
 
 Base = declarative_base()
 
 
+class utcnow(FunctionElement):
+    """Current UTC timestamp evaluated by the database, for server-side defaults."""
+    type = DateTime()
+    inherit_cache = True
+
+
+@compiles(utcnow, "postgresql")
+def _pg_utcnow(element, compiler, **kw):
+    return "TIMEZONE('utc', CURRENT_TIMESTAMP)"
+
+
+@compiles(utcnow)
+def _default_utcnow(element, compiler, **kw):
+    # SQLite's CURRENT_TIMESTAMP is already in UTC
+    return "CURRENT_TIMESTAMP"
+
+
 class MessageRole(enum.Enum):
     """Enumeration for message roles."""
     USER = "user"
@@ -101,8 +123,8 @@ class Invoice(Base):
     file_content_type = Column(String(50), nullable=True)
     raw_data = Column(JSON, nullable=True)
     notes = Column(Text, nullable=True)
-    created_at = Column(DateTime, default=datetime.utcnow)
-    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    created_at = Column(DateTime, server_default=utcnow())
+    updated_at = Column(DateTime, server_default=utcnow(), onupdate=utcnow())
     
     # Relationships
     user = relationship("User", back_populates="invoices")
@@ -153,9 +175,10 @@ class Item(Base):
     total_price = Column(Float, nullable=False)
     item_category = Column(String(50), nullable=True, index=True)
     item_code = Column(String(50), nullable=True)
-    description_embedding = Column(Vector(1536), nullable=True)
-    created_at = Column(DateTime, default=datetime.utcnow)
-    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    # Half precision halves the storage per embedding; queries cast to vector as needed
+    description_embedding = Column(HALFVEC(1536), nullable=True)
+    created_at = Column(DateTime, server_default=utcnow())
+    updated_at = Column(DateTime, server_default=utcnow(), onupdate=utcnow())
     
     # Relationships
     invoice = relationship("Invoice", back_populates="items")
@@ -225,8 +248,8 @@ class Media(Base):
     status = Column(Enum('uploaded', 'processed', 'error', name='filestatus'), nullable=True)
     ocr_text = Column(Text, nullable=True)
     processing_metadata = Column(JSON, nullable=True)
-    created_at = Column(DateTime, default=datetime.utcnow)
-    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    created_at = Column(DateTime, server_default=utcnow())
+    updated_at = Column(DateTime, server_default=utcnow(), onupdate=utcnow())
     
     # Relationships
     user = relationship("User", back_populates="media_files")
@@ -245,4 +268,5 @@ class Usage(Base):
     created_at = Column(DateTime, default=datetime.utcnow)
     
     # Relationships
-    user = relationship("User", back_populates="usage") 
\ No newline at end of file
+    user = relationship("User", back_populates="usage")
+
@@ -25,6 +25,7 @@ from constants.llm_configs import (
     Models, 
     TemperatureSettings,
     TokenLimits,
+    JSON_RESPONSE_FORMAT,
     DEFAULT_LLM_CONFIG,
     TASK_LLM_CONFIGS,
     LLMProvider, 
@@ -36,6 +37,21 @@ from constants.invoice_processing_messages import get_invoice_processing_message
 
 logger = logging.getLogger(__name__)
 
+# Matches JSON wrapped in a markdown code block, e.g. ```json [...] ```
+_JSON_FENCE_RE = re.compile(r'```(?:json)?\s*([\s\S]*?)\s*```')
+
+
+class _ResponseEncoder(json.JSONEncoder):
+    """JSON encoder for response formatting input, handling datetime and Decimal values."""
+    
+    def default(self, obj):
+        if isinstance(obj, datetime):
+            return obj.isoformat()
+        if isinstance(obj, Decimal):
+            return float(obj)
+        return super().default(obj)
+
+
 class LLMFactory:
     """
     Factory class for creating and managing LLM instances.
@@ -321,7 +337,9 @@ class LLMFactory:
         temperature: float = None,
         max_tokens: int = None,
         task_name: Optional[str] = None,
-        config_override: Optional[Dict[str, Any]] = None
+        config_override: Optional[Dict[str, Any]] = None,
+        response_format: Optional[Dict[str, Any]] = None,
+        system_prompt: Optional[str] = None
     ) -> str:
         """
         Generate a completion for a prompt using the appropriate LLM asynchronously.
@@ -332,6 +350,11 @@ class LLMFactory:
             max_tokens: Optional max tokens override
             task_name: Optional name of the task
             config_override: Optional configuration override
+            response_format: Optional OpenAI response format, e.g. JSON_RESPONSE_FORMAT.
+                Ignored by other providers.
+            system_prompt: Optional static instructions sent ahead of the prompt.
+                Keeping them identical across calls lets OpenAI reuse its cached
+                prefix; for Anthropic the block is marked for prompt caching.
             
         Returns:
             The generated completion text
@@ -364,22 +387,35 @@ class LLMFactory:
                 from openai import OpenAI as AsyncOpenAI
                 
             client = AsyncOpenAI(api_key=self.api_keys[ModelProvider.OPENAI])
+            request_kwargs = {"response_format": response_format} if response_format else {}
+            messages = [{"role": "user", "content": prompt}]
+            if system_prompt:
+                messages.insert(0, {"role": "system", "content": system_prompt})
             response = await client.chat.completions.create(
                 model=model_name,
-                messages=[{"role": "user", "content": prompt}],
+                messages=messages,
                 temperature=temperature,
-                max_tokens=max_tokens
+                max_tokens=max_tokens,
+                **request_kwargs
             )
             return response.choices[0].message.content
             
         elif provider == ModelProvider.ANTHROPIC:
             # For now, use sync client for Anthropic as their async API might differ
             client = self._create_anthropic_instance(config)
+            request_kwargs = {}
+            if system_prompt:
+                request_kwargs["system"] = [{
+                    "type": "text",
+                    "text": system_prompt,
+                    "cache_control": {"type": "ephemeral"}
+                }]
             response = client.messages.create(
                 model=model_name,
                 max_tokens=max_tokens,
                 temperature=temperature,
-                messages=[{"role": "user", "content": prompt}]
+                messages=[{"role": "user", "content": prompt}],
+                **request_kwargs
             )
             return response.content[0].text
             
@@ -388,7 +424,7 @@ class LLMFactory:
             client = self._create_cohere_instance(config)
             response = client.generate(
                 model=model_name,
-                prompt=prompt,
+                prompt=f"{system_prompt}\n\n{prompt}" if system_prompt else prompt,
                 max_tokens=max_tokens,
                 temperature=temperature
             )
@@ -556,12 +592,14 @@ class LLMFactory:
                 get_prompt_for_agent(AgentType.TEXT_INTENT_CLASSIFIER)
             )
             
-            # Combine the prompt with the input
-            full_prompt = f"{prompt_template}\n\nINPUT:\n{input_text}\n\nOUTPUT:"
+            # The template is the same for every message, so send it as the
+            # system prompt where providers can cache it
+            full_prompt = f"INPUT:\n{input_text}\n\nOUTPUT:"
             
             # Call the LLM with a low temperature for more deterministic results
             response = await self.generate_completion(
                 prompt=full_prompt,
+                system_prompt=prompt_template,
                 temperature=TemperatureSettings.CLASSIFICATION,
                 max_tokens=TokenLimits.MAX_OUTPUT_TOKENS_SHORT
             )
@@ -578,6 +616,47 @@ class LLMFactory:
                 "explanation": f"Error: {str(e)}"
             })
     
+    async def classify_text_intent_batch(self, input_texts: List[str]) -> List[str]:
+        """
+        Classify the intent of several text inputs with a single LLM call.
+
+        If the batched response cannot be mapped back to the inputs, each one
+        is classified individually.
+
+        Args:
+            input_texts: The text inputs to classify
+
+        Returns:
+            A list of JSON strings, one per input text, in the same order
+        """
+        if len(input_texts) == 1:
+            return [await self.classify_text_intent(input_text=input_texts[0])]
+
+        try:
+            prompt_template = self.load_prompt_template(
+                get_prompt_for_agent(AgentType.TEXT_INTENT_CLASSIFIER)
+            )
+
+            parsed = await self._generate_batched_json(
+                prompt_template,
+                input_texts,
+                "objects, one per document and in the same order, each following the output format above",
+                temperature=TemperatureSettings.CLASSIFICATION,
+                max_tokens=TokenLimits.MAX_OUTPUT_TOKENS_SHORT * len(input_texts)
+            )
+
+            if parsed is not None:
+                logger.info(f"Classified {len(input_texts)} messages with a single batched LLM call")
+                return [json.dumps(result) for result in parsed]
+
+            logger.warning("Batched intent classification response did not match the number of messages")
+        except Exception as e:
+            logger.warning(f"Batched intent classification failed, falling back to single calls: {str(e)}")
+
+        return list(await asyncio.gather(
+            *(self.classify_text_intent(input_text=input_text) for input_text in input_texts)
+        ))
+    
     async def convert_text_to_sql(self, query_text: str, schema_info: str) -> str:
         """
         Convert natural language query to SQL.
@@ -661,6 +740,47 @@ class LLMFactory:
                 "status": "error"
             })
     
+    async def extract_invoice_entities_batch(self, texts: List[str]) -> List[str]:
+        """
+        Extract invoice-related entities from several messages with a single LLM call.
+
+        If the batched response cannot be mapped back to the messages, entities
+        are extracted from each one individually.
+
+        Args:
+            texts: The texts to extract entities from
+
+        Returns:
+            A list of JSON strings, one per input text, in the same order
+        """
+        if len(texts) == 1:
+            return [await self.extract_invoice_entities(texts[0])]
+
+        try:
+            prompt_template = self.load_prompt_template(
+                get_prompt_for_agent(AgentType.INVOICE_ENTITY_EXTRACTION)
+            )
+
+            parsed = await self._generate_batched_json(
+                prompt_template,
+                texts,
+                "objects, one per document and in the same order, each following the output format above",
+                temperature=TemperatureSettings.ENTITY_EXTRACTION,
+                max_tokens=TokenLimits.MAX_OUTPUT_TOKENS_MEDIUM * len(texts)
+            )
+
+            if parsed is not None:
+                logger.info(f"Extracted entities from {len(texts)} messages with a single batched LLM call")
+                return [json.dumps(result) for result in parsed]
+
+            logger.warning("Batched entity extraction response did not match the number of messages")
+        except Exception as e:
+            logger.warning(f"Batched entity extraction failed, falling back to single calls: {str(e)}")
+
+        return list(await asyncio.gather(
+            *(self.extract_invoice_entities(text) for text in texts)
+        ))
+    
     async def validate_invoice_file(self, file_content: str) -> str:
         """
         Validate if a file contains a valid invoice.
@@ -700,13 +820,17 @@ class LLMFactory:
                 "reasons": f"Error during validation: {str(e)}"
             })
     
-    async def extract_invoice_data(self, content: Union[str, Dict[str, Any]]) -> str:
+    async def extract_invoice_data(self,
+                                   content: Union[str, Dict[str, Any]],
+                                   feedback: Optional[str] = None) -> str:
         """
         Extract structured data from invoice file content. Supports both text and image content.
         
         Args:
             content: The content of the invoice file. Can be text or a dictionary with image data
                 If a dictionary, it should contain 'type': 'image' and 'content': <base64_encoded_image>
+            feedback: Optional correction appended to the request, e.g. why a previous
+                response could not be parsed
             
         Returns:
             A JSON string containing the extracted invoice data
@@ -752,6 +876,7 @@ class LLMFactory:
                                 {
                                     "type": "text",
                                     "text": "Extract all invoice information from this image."
+                                    + (f"\n\n{feedback}" if feedback else "")
                                 },
                                 {
                                     "type": "image_url",
@@ -768,7 +893,8 @@ class LLMFactory:
                         model="gpt-4o-mini",  # Use GPT-4o-mini for vision
                         messages=messages,
                         temperature=TemperatureSettings.DATA_EXTRACTION,
-                        max_tokens=TokenLimits.MAX_OUTPUT_TOKENS_MEDIUM
+                        max_tokens=TokenLimits.MAX_OUTPUT_TOKENS_MEDIUM,
+                        response_format=JSON_RESPONSE_FORMAT
                     )
                     
                     # Extract the response content
@@ -810,12 +936,15 @@ class LLMFactory:
                     
                 # Combine the prompt with the input
                 full_prompt = f"{prompt_template}\n\nINPUT:\n{content}\n\nOUTPUT:"
+                if feedback:
+                    full_prompt = f"{prompt_template}\n\nINPUT:\n{content}\n\n{feedback}\n\nOUTPUT:"
                 
                 # Call the LLM for data extraction
                 response = await self.generate_completion(
                     prompt=full_prompt,
                     temperature=TemperatureSettings.DATA_EXTRACTION,
-                    max_tokens=TokenLimits.MAX_OUTPUT_TOKENS_MEDIUM
+                    max_tokens=TokenLimits.MAX_OUTPUT_TOKENS_MEDIUM,
+                    response_format=JSON_RESPONSE_FORMAT
                 )
                 
                 logger.debug(f"Invoice data extraction response: {response}")
@@ -833,7 +962,90 @@ class LLMFactory:
                 "confidence_score": 0.0,
                 "error": f"Error during data extraction: {str(e)}"
             })
-    
+
+    async def _generate_batched_json(self,
+                                     prompt_template: str,
+                                     documents: List[str],
+                                     array_description: str,
+                                     **completion_kwargs) -> Optional[List[Any]]:
+        """
+        Run several documents through one prompt and split the JSON array response.
+
+        The task prompt is sent as the system prompt, so it forms a stable
+        prefix the provider can cache across batches of different sizes.
+
+        Args:
+            prompt_template: Prompt describing the task for a single document
+            documents: Inputs combined into one numbered prompt
+            array_description: What the returned array holds, after "exactly N"
+            **completion_kwargs: Passed on to generate_completion
+
+        Returns:
+            One parsed array element per document, or None if the response
+            does not hold exactly one element per document
+        """
+        numbered_documents = "\n\n".join(
+            f"Document {i}:\n{document}" for i, document in enumerate(documents, start=1)
+        )
+        batch_prompt = (
+            f"The input contains {len(documents)} separate documents. Return a JSON array "
+            f"with exactly {len(documents)} {array_description}.\n\n"
+            f"INPUT:\n{numbered_documents}\n\nOUTPUT:"
+        )
+
+        response = await self.generate_completion(
+            prompt=batch_prompt, system_prompt=prompt_template, **completion_kwargs
+        )
+
+        json_match = _JSON_FENCE_RE.search(response)
+        parsed = json.loads(json_match.group(1) if json_match else response)
+
+        if isinstance(parsed, list) and len(parsed) == len(documents):
+            return parsed
+        return None
+
+    async def extract_invoice_data_batch(self, contents: List[str]) -> List[str]:
+        """
+        Extract structured data from several text invoices with a single LLM call.
+
+        The documents are combined into one numbered prompt and the model is asked
+        for a JSON array with one extraction per document. If the batched response
+        cannot be mapped back to the documents, each one is extracted individually.
+
+        Args:
+            contents: Text contents of the invoice files
+
+        Returns:
+            A list of JSON strings, one per input document, in the same order
+        """
+        if len(contents) == 1:
+            return [await self.extract_invoice_data(contents[0])]
+
+        try:
+            prompt_template = self.load_prompt_template(
+                get_prompt_for_agent(AgentType.INVOICE_DATA_EXTRACTION)
+            )
+
+            parsed = await self._generate_batched_json(
+                prompt_template,
+                contents,
+                "objects, one per document and in the same order, each following the output format above",
+                temperature=TemperatureSettings.DATA_EXTRACTION,
+                max_tokens=TokenLimits.MAX_OUTPUT_TOKENS_MEDIUM * len(contents)
+            )
+
+            if parsed is not None:
+                logger.info(f"Extracted {len(contents)} invoices with a single batched LLM call")
+                return [json.dumps(result) for result in parsed]
+
+            logger.warning("Batched extraction response did not match the number of documents")
+        except Exception as e:
+            logger.warning(f"Batched invoice extraction failed, falling back to single calls: {str(e)}")
+
+        return list(await asyncio.gather(
+            *(self.extract_invoice_data(content) for content in contents)
+        ))
+
     async def format_invoice_data(self, invoice_data: Union[str, Dict[str, Any]]) -> str:
         """
         Format invoice data into a readable response.
@@ -1052,26 +1264,8 @@ class LLMFactory:
         prompt_template = self.load_prompt_template("response_formatting_prompt")
         
         try:
-            # Use custom encoder for handling datetime and Decimal objects
-            class CustomEncoder(json.JSONEncoder):
-                def default(self, obj):
-                    if isinstance(obj, datetime):
-                        return obj.isoformat()
-                    if isinstance(obj, Decimal):
-                        return float(obj)
-                    return super().default(obj)
-            
-            # Create input data structure if not already in correct format
-            if not isinstance(content, dict) or "type" not in content:
-                input_data = {
-                    "type": format_type,
-                    "content": content
-                }
-            else:
-                input_data = content
-            
             # Format the prompt with the content
-            prompt = f"{prompt_template}\n\nInput:\n{json.dumps(input_data, indent=2, cls=CustomEncoder)}\n\nOutput:"
+            prompt = f"{prompt_template}\n\nInput:\n{self._format_input_json(content, format_type)}\n\nOutput:"
             
             # Generate the completion
             logger.debug("Sending format prompt to LLM")
@@ -1110,6 +1304,67 @@ class LLMFactory:
                 logger.error(f"Error in fallback formatting: {str(e2)}", exc_info=True)
                 return "I found some information related to your request, but encountered an issue with the formatting."
     
+    def _format_input_json(self, content: Any, format_type: str) -> str:
+        """
+        Serialize content for the response formatting prompt.
+        
+        Args:
+            content: The content to format
+            format_type: The type of format to use
+            
+        Returns:
+            JSON input for the prompt, with datetime and Decimal values converted
+        """
+        # Create input data structure if not already in correct format
+        if not isinstance(content, dict) or "type" not in content:
+            input_data = {
+                "type": format_type,
+                "content": content
+            }
+        else:
+            input_data = content
+        return json.dumps(input_data, indent=2, cls=_ResponseEncoder)
+    
+    async def format_response_batch(self, contents: List[Any], format_type: str = "default") -> List[str]:
+        """
+        Format several responses of the same type with a single LLM call.
+        
+        If the batched response cannot be mapped back to the inputs, each
+        response is formatted individually.
+        
+        Args:
+            contents: The contents to format
+            format_type: The type of format to use for all of them
+            
+        Returns:
+            The formatted responses, one per content, in the same order
+        """
+        if len(contents) == 1:
+            return [await self.format_response(content=contents[0], format_type=format_type)]
+        
+        try:
+            prompt_template = self.load_prompt_template("response_formatting_prompt")
+            
+            parsed = await self._generate_batched_json(
+                prompt_template,
+                [self._format_input_json(content, format_type) for content in contents],
+                "strings, one per document and in the same order, each holding the formatted response for that document",
+                task_name="response_formatting",
+                max_tokens=TokenLimits.MAX_OUTPUT_TOKENS_MEDIUM * len(contents)
+            )
+            
+            if parsed is not None and all(isinstance(response, str) for response in parsed):
+                logger.info(f"Formatted {len(contents)} responses with a single batched LLM call")
+                return parsed
+            
+            logger.warning("Batched formatting response did not match the number of inputs")
+        except Exception as e:
+            logger.warning(f"Batched response formatting failed, falling back to single calls: {str(e)}")
+        
+        return list(await asyncio.gather(
+            *(self.format_response(content=content, format_type=format_type) for content in contents)
+        ))
+    
     async def generate_sql_from_query(
         self, 
         query: str, 
@@ -3,14 +3,17 @@ Tests for the DataExtractorAgent.
 """
 
 import pytest
+import asyncio
 import json
 import logging
 import os
 from pathlib import Path
 
+from agents import data_extractor
 from agents.data_extractor import DataExtractorAgent
 from services.llm_factory import LLMFactory
 from utils.base_agent import AgentInput, AgentOutput, AgentContext
+from utils.extraction_cache import ExtractionCache, RecentResultCache
 from tests.fixtures.test_data import (
     VALID_INVOICE_PATH,
     INVALID_INVOICE_PATH,
@@ -25,9 +28,13 @@ def llm_factory():
     return LLMFactory()
 
 @pytest.fixture
-def data_extractor_agent(llm_factory):
-    """Create a data extractor agent."""
-    return DataExtractorAgent(llm_factory=llm_factory)
+def data_extractor_agent(llm_factory, tmp_path, monkeypatch):
+    """Create a data extractor agent with isolated extraction caches and no retry backoff."""
+    monkeypatch.setattr(data_extractor, "JSON_RETRY_BACKOFF_SECONDS", 0)
+    agent = DataExtractorAgent(llm_factory=llm_factory)
+    agent.extraction_cache = ExtractionCache(cache_dir=tmp_path / "extraction_cache", enabled=True)
+    agent.recent_results = RecentResultCache()
+    return agent
 
 @pytest.mark.asyncio
 async def test_init_data_extractor(llm_factory):
@@ -327,4 +334,224 @@ async def test_extract_specific_fields(data_extractor_agent, monkeypatch):
     assert result.status == "success"
     assert result.confidence == 0.9
     
-    logger.info(f"Specific fields extraction result: {result.content}") 
\ No newline at end of file
+    logger.info(f"Specific fields extraction result: {result.content}") 
+
+@pytest.mark.asyncio
+async def test_cached_extraction_skips_llm(data_extractor_agent, monkeypatch):
+    """Test that re-processing the same file is served from the extraction cache."""
+    calls = []
+    
+    async def mock_extract_invoice_data(*args, **kwargs):
+        calls.append(args)
+        return json.dumps(SAMPLE_INVOICE_DATA)
+    
+    monkeypatch.setattr(data_extractor_agent.llm_factory, "extract_invoice_data", mock_extract_invoice_data)
+    
+    with open(VALID_INVOICE_PATH, 'rb') as f:
+        file_content = f.read()
+    
+    agent_input = AgentInput(
+        content=file_content,
+        content_type="image/png",
+        metadata={'file_path': str(VALID_INVOICE_PATH)}
+    )
+    
+    first = await data_extractor_agent.process(agent_input)
+    # Forget the in-process result so the second call goes to the extraction cache
+    data_extractor_agent.recent_results.clear()
+    second = await data_extractor_agent.process(agent_input)
+    
+    assert len(calls) == 1
+    assert first.status == "success"
+    assert second.status == "success"
+    assert second.content == first.content
+    assert second.metadata["from_cache"] is True
+
+@pytest.mark.asyncio
+async def test_concurrent_text_extractions_are_batched(data_extractor_agent, monkeypatch):
+    """Test that concurrent text extractions share a single batched LLM call."""
+    batches = []
+    
+    async def mock_extract_batch(contents):
+        batches.append(contents)
+        return [json.dumps(dict(SAMPLE_INVOICE_DATA, invoice_number=content)) for content in contents]
+    
+    monkeypatch.setattr(data_extractor_agent.llm_factory, "extract_invoice_data_batch", mock_extract_batch)
+    
+    contents = [f"INV-{i}" for i in range(3)]
+    results = await asyncio.gather(*(
+        data_extractor_agent.process(AgentInput(content=content), AgentContext(user_id="42"))
+        for content in contents
+    ))
+    
+    assert len(batches) == 1
+    assert sorted(batches[0]) == contents
+    for content, result in zip(contents, results):
+        assert result.status == "success"
+        assert result.content["invoice_number"] == content
+
+@pytest.mark.asyncio
+async def test_text_extractions_of_different_users_are_not_batched(data_extractor_agent, monkeypatch):
+    """Test that documents of different or unknown users never share a prompt."""
+    batches = []
+    
+    async def mock_extract_batch(contents):
+        batches.append(contents)
+        return [json.dumps(dict(SAMPLE_INVOICE_DATA, invoice_number=content)) for content in contents]
+    
+    monkeypatch.setattr(data_extractor_agent.llm_factory, "extract_invoice_data_batch", mock_extract_batch)
+    
+    requests = [("INV-a", "1"), ("INV-b", "2"), ("INV-c", None), ("INV-d", None)]
+    results = await asyncio.gather(*(
+        data_extractor_agent.process(AgentInput(content=content), AgentContext(user_id=user_id))
+        for content, user_id in requests
+    ))
+    
+    assert sorted(len(batch) for batch in batches) == [1, 1, 1, 1]
+    for (content, _), result in zip(requests, results):
+        assert result.content["invoice_number"] == content
+
+@pytest.mark.asyncio
+async def test_s3_upload_metadata_included(data_extractor_agent, monkeypatch):
+    """Test that the S3 upload result is attached to the extraction metadata."""
+    
+    async def mock_extract_invoice_data(*args, **kwargs):
+        return json.dumps(SAMPLE_INVOICE_DATA)
+    
+    def mock_upload_file(**kwargs):
+        return {"file_key": f"{kwargs['user_id']}/invoices/image.png", "url": "https://example.com/image.png"}
+    
+    monkeypatch.setattr(data_extractor_agent.llm_factory, "extract_invoice_data", mock_extract_invoice_data)
+    monkeypatch.setattr(data_extractor_agent.s3_handler, "upload_file", mock_upload_file)
+    
+    with open(VALID_INVOICE_PATH, 'rb') as f:
+        file_content = f.read()
+    
+    agent_input = AgentInput(
+        content=file_content,
+        file_path=str(VALID_INVOICE_PATH),
+        content_type="image/png"
+    )
+    
+    result = await data_extractor_agent.process(agent_input, AgentContext(user_id="user-1"))
+    
+    assert result.status == "success"
+    assert result.metadata["s3_storage"]["file_key"] == "user-1/invoices/image.png"
+
+@pytest.mark.asyncio
+async def test_s3_upload_completes_when_extraction_fails(data_extractor_agent, monkeypatch):
+    """Test that a failed extraction still waits for and reports the S3 upload."""
+    
+    async def mock_extract_error(*args, **kwargs):
+        raise Exception("Test extraction error")
+    
+    def mock_upload_file(**kwargs):
+        return {"file_key": "user-1/invoices/image.png"}
+    
+    monkeypatch.setattr(data_extractor_agent.llm_factory, "extract_invoice_data", mock_extract_error)
+    monkeypatch.setattr(data_extractor_agent.s3_handler, "upload_file", mock_upload_file)
+    
+    with open(VALID_INVOICE_PATH, 'rb') as f:
+        file_content = f.read()
+    
+    result = await data_extractor_agent.process(
+        AgentInput(content=file_content, content_type="image/png"),
+        AgentContext(user_id="user-1")
+    )
+    
+    assert result.status == "error"
+    assert "Test extraction error" in result.error
+    assert result.metadata["s3_storage"]["file_key"] == "user-1/invoices/image.png"
+
+@pytest.mark.asyncio
+async def test_duplicate_upload_skips_s3_and_llm(data_extractor_agent, monkeypatch):
+    """Test that a repeated upload by the same user reuses the previous output."""
+    uploads = []
+    calls = []
+    
+    async def mock_extract_invoice_data(*args, **kwargs):
+        calls.append(args)
+        return json.dumps(SAMPLE_INVOICE_DATA)
+    
+    def mock_upload_file(**kwargs):
+        uploads.append(kwargs["user_id"])
+        return {"file_key": f"{kwargs['user_id']}/invoices/image.png"}
+    
+    monkeypatch.setattr(data_extractor_agent.llm_factory, "extract_invoice_data", mock_extract_invoice_data)
+    monkeypatch.setattr(data_extractor_agent.s3_handler, "upload_file", mock_upload_file)
+    
+    with open(VALID_INVOICE_PATH, 'rb') as f:
+        file_content = f.read()
+    
+    agent_input = AgentInput(content=file_content, content_type="image/png")
+    
+    first = await data_extractor_agent.process(agent_input, AgentContext(user_id="user-1"))
+    second = await data_extractor_agent.process(agent_input, AgentContext(user_id="user-1"))
+    other_user = await data_extractor_agent.process(agent_input, AgentContext(user_id="user-2"))
+    
+    assert len(calls) == 1
+    assert uploads == ["user-1", "user-2"]
+    assert second.content == first.content
+    assert second.metadata["s3_storage"] == first.metadata["s3_storage"]
+    assert other_user.metadata["s3_storage"]["file_key"] == "user-2/invoices/image.png"
+
+@pytest.mark.asyncio
+async def test_unsupported_binary_content_skips_llm(data_extractor_agent, monkeypatch):
+    """Test that non-image binary content is rejected without calling the LLM."""
+    calls = []
+    
+    async def mock_extract_invoice_data(*args, **kwargs):
+        calls.append(args)
+        return json.dumps(SAMPLE_INVOICE_DATA)
+    
+    monkeypatch.setattr(data_extractor_agent.llm_factory, "extract_invoice_data", mock_extract_invoice_data)
+    
+    agent_input = AgentInput(
+        content=b"%PDF-1.7 binary invoice",
+        content_type="application/pdf",
+        metadata={'file_type': 'pdf'}
+    )
+    
+    result = await data_extractor_agent.process(agent_input)
+    
+    assert calls == []
+    assert result.status == "error"
+    assert "Unsupported binary content type" in result.error
+
+@pytest.mark.asyncio
+async def test_code_fenced_response_is_parsed(data_extractor_agent, monkeypatch):
+    """Test that JSON wrapped in a markdown code block is still parsed."""
+    async def mock_extract_invoice_data(*args, **kwargs):
+        return f"```json\n{json.dumps(SAMPLE_INVOICE_DATA)}\n```"
+    
+    monkeypatch.setattr(data_extractor_agent.llm_factory, "extract_invoice_data", mock_extract_invoice_data)
+    
+    with open(VALID_INVOICE_PATH, 'rb') as f:
+        file_content = f.read()
+    
+    result = await data_extractor_agent.process(AgentInput(content=file_content, metadata={}))
+    
+    assert result.status == "success"
+    assert result.metadata["raw_extraction_result"] == SAMPLE_INVOICE_DATA
+
+@pytest.mark.asyncio
+async def test_invalid_json_is_retried_with_feedback(data_extractor_agent, monkeypatch):
+    """Test that an invalid JSON response is retried with the parse error as feedback."""
+    feedback_calls = []
+    
+    async def mock_extract_invoice_data(content, feedback=None):
+        if feedback is None:
+            return "Not a valid JSON"
+        feedback_calls.append(feedback)
+        return json.dumps(SAMPLE_INVOICE_DATA)
+    
+    monkeypatch.setattr(data_extractor_agent.llm_factory, "extract_invoice_data", mock_extract_invoice_data)
+    
+    with open(VALID_INVOICE_PATH, 'rb') as f:
+        file_content = f.read()
+    
+    result = await data_extractor_agent.process(AgentInput(content=file_content, metadata={}))
+    
+    assert result.status == "success"
+    assert len(feedback_calls) == 1
+    assert "not valid JSON" in feedback_calls[0]
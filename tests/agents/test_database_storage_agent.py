@@ -0,0 +1,276 @@
+"""
+Tests for the DatabaseStorageAgent.
+"""
+
+import pytest
+import json
+import uuid
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+
+from agents import database_storage_agent
+from agents.database_storage_agent import DatabaseStorageAgent
+from database.schemas import Base, Invoice, Item, Media
+from utils.base_agent import AgentInput, AgentContext
+
+EXTRACTION_RESULT = {
+    "vendor": {"name": "ACME Supplies"},
+    "transaction": {"invoice_number": "INV-42", "date": "2024-03-15"},
+    "items": [
+        {"description": "Milk 1L", "quantity": 2, "unit_price": 1.5, "total_price": 3.0},
+        {"description": "Bread", "quantity": "1", "unit_price": "2.25", "total_price": "2.25",
+         "item_category": "Bakery", "item_code": "BR-1"},
+    ],
+    "financial": {"total": 5.25, "currency": "USD"},
+    "additional_info": {"notes": "Paid in cash"},
+    "metadata": {
+        "s3_storage": {
+            "file_key": "1/invoices/invoice.png",
+            "url": "https://example.com/invoice.png",
+            "content_type": "image/png",
+            "original_filename": "invoice.png"
+        }
+    }
+}
+
+
+class FakeEmbeddingGenerator:
+    """Embedding generator returning a small fixed vector per text."""
+
+    def __init__(self):
+        self.calls = []
+
+    def generate_batch_embeddings(self, texts):
+        self.calls.append(list(texts))
+        return [[float(len(text))] * 3 for text in texts]
+
+
+@pytest.fixture
+def session_factory(monkeypatch):
+    """Point the agent at an in-memory SQLite database."""
+    engine = create_engine(
+        "sqlite://",
+        connect_args={"check_same_thread": False},
+        poolclass=StaticPool
+    )
+    Base.metadata.create_all(engine)
+    factory = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+    monkeypatch.setattr(database_storage_agent, "SessionLocal", factory)
+    yield factory
+    engine.dispose()
+
+
+@pytest.fixture
+def storage_agent(session_factory):
+    """Create a DatabaseStorageAgent with a fake embedding generator."""
+    agent = DatabaseStorageAgent()
+    agent.embedding_generator = FakeEmbeddingGenerator()
+    return agent
+
+
+def test_store_invoice_data(storage_agent, session_factory):
+    """Test storing an invoice with its items and media record."""
+    result = storage_agent.store_invoice_data(json.loads(json.dumps(EXTRACTION_RESULT)), "1")
+
+    assert result["status"] == "success"
+    assert result["invoice_number"] == "INV-42"
+    assert result["total_amount"] == 5.25
+    assert len(result["item_ids"]) == 2
+    assert result["media_id"] is not None
+
+    db = session_factory()
+    try:
+        invoice = db.query(Invoice).one()
+        assert str(invoice.id) == result["invoice_id"]
+        assert invoice.vendor == "ACME Supplies"
+        assert invoice.invoice_date.year == 2024
+        assert invoice.currency == "USD"
+        assert invoice.user_id == 1
+
+        items = db.query(Item).order_by(Item.id).all()
+        assert [str(item.id) for item in items] == result["item_ids"]
+        assert [item.description for item in items] == ["Milk 1L", "Bread"]
+        assert [item.quantity for item in items] == [2.0, 1.0]
+        assert [item.unit_price for item in items] == [1.5, 2.25]
+        assert items[1].item_category == "Bakery"
+        assert items[1].item_code == "BR-1"
+        assert all(item.invoice_id == invoice.id for item in items)
+        assert all(item.created_at is not None for item in items)
+
+        media = db.query(Media).one()
+        assert media.file_path == "1/invoices/invoice.png"
+        assert media.invoice_id == invoice.id
+    finally:
+        db.close()
+
+
+def test_store_invoice_data_skips_invalid_items(storage_agent, session_factory):
+    """Test that non-dictionary items are skipped without failing the invoice."""
+    extraction_result = {
+        "vendor": {"name": "ACME Supplies"},
+        "transaction": {"date": "not a date"},
+        "items": ["garbage", {"description": "Eggs", "unit_price": 3, "total_price": 3}],
+        "financial": {"total": 3}
+    }
+
+    result = storage_agent.store_invoice_data(extraction_result, "1")
+
+    assert result["status"] == "success"
+    assert len(result["item_ids"]) == 1
+    assert result["media_id"] is None
+
+    db = session_factory()
+    try:
+        assert db.query(Invoice).one().invoice_date is None
+        assert [item.description for item in db.query(Item).all()] == ["Eggs"]
+    finally:
+        db.close()
+
+
+@pytest.mark.asyncio
+async def test_process_parses_json_content(storage_agent):
+    """Test that JSON string content is parsed and stored."""
+    agent_input = AgentInput(content=json.dumps(EXTRACTION_RESULT))
+
+    result = await storage_agent.process(agent_input, AgentContext(user_id="1"))
+
+    assert result.status == "success"
+    assert len(result.content["item_ids"]) == 2
+
+
+@pytest.mark.asyncio
+async def test_process_rejects_invalid_json(storage_agent):
+    """Test that malformed JSON content is reported as an error."""
+    result = await storage_agent.process(AgentInput(content="{not json"), AgentContext(user_id="1"))
+
+    assert result.status == "error"
+    assert "Invalid JSON" in result.error
+
+
+def test_large_invoice_falls_back_to_insert_without_postgres(storage_agent):
+    """Test that large item batches are stored when COPY is not available."""
+    extraction_result = {
+        "vendor": {"name": "ACME Supplies"},
+        "items": [
+            {"description": f"Item {i}", "quantity": 1, "unit_price": i, "total_price": i}
+            for i in range(database_storage_agent.COPY_ITEMS_THRESHOLD + 5)
+        ],
+        "financial": {"total": 100}
+    }
+
+    result = storage_agent.store_invoice_data(extraction_result, "1")
+
+    assert result["status"] == "success"
+    assert len(result["item_ids"]) == database_storage_agent.COPY_ITEMS_THRESHOLD + 5
+
+
+def test_copy_value_formatting():
+    """Test formatting of values for the COPY text format."""
+    copy_value = database_storage_agent._copy_value
+
+    assert copy_value(None) == "\\N"
+    assert copy_value([0.5, 1]) == "[0.5,1.0]"
+    assert copy_value("Tab\there\nnew\\line") == "Tab\\there\\nnew\\\\line"
+    assert copy_value(2.5) == "2.5"
+
+
+def test_item_amounts_conversion():
+    """Test that item amounts convert per column and signal unconvertible values."""
+    item_amounts = database_storage_agent._item_amounts
+
+    assert item_amounts([{"quantity": "2", "unit_price": 1.5, "total_price": "3"}, {}]) == [
+        (2.0, 1.5, 3.0), (1.0, 0.0, 0.0)
+    ]
+    assert item_amounts([{"quantity": None}]) is None
+    assert item_amounts([{"unit_price": "n/a"}]) is None
+
+
+def test_store_invoice_data_skips_items_with_bad_amounts(storage_agent):
+    """Test that an item with a non-numeric amount is skipped and the rest are stored."""
+    extraction_result = {
+        "vendor": {"name": "ACME Supplies"},
+        "items": [
+            {"description": "Eggs", "quantity": 12, "unit_price": 0.25, "total_price": 3},
+            {"description": "Mystery", "quantity": "a few", "unit_price": 1, "total_price": 1},
+        ],
+        "financial": {"total": 4}
+    }
+
+    result = storage_agent.store_invoice_data(extraction_result, "1")
+
+    assert result["status"] == "success"
+    assert len(result["item_ids"]) == 1
+
+
+def test_parse_invoice_date():
+    """Test invoice date parsing for ISO and unpadded dates."""
+    parse_invoice_date = database_storage_agent._parse_invoice_date
+
+    assert parse_invoice_date("2024-03-15").day == 15
+    assert parse_invoice_date("2024-3-5").month == 3
+    with pytest.raises(ValueError):
+        parse_invoice_date("15/03/2024")
+
+
+def test_coerce_user_id():
+    """Test mapping user IDs onto integer keys."""
+    coerce_user_id = database_storage_agent._coerce_user_id
+
+    assert coerce_user_id("0") == 0
+    assert coerce_user_id(0) == 0
+    assert coerce_user_id("42") == 42
+    assert coerce_user_id(" 7 ") == 7
+    assert coerce_user_id(uuid.UUID("12345678-1234-5678-1234-567812345678")) == 1
+    assert coerce_user_id("not-a-number") == 1
+
+
+def test_coerce_user_id_warns_on_every_fallback(monkeypatch):
+    """Test that each fallback to the default user is logged, not only the first."""
+    warnings = []
+    monkeypatch.setattr(database_storage_agent.logger, "warning", warnings.append)
+
+    database_storage_agent._coerce_user_id("not-a-number")
+    database_storage_agent._coerce_user_id("not-a-number")
+
+    assert len(warnings) == 2
+
+
+def test_embeddings_generated_once_per_distinct_description(storage_agent, session_factory):
+    """Test that repeated and blank descriptions are not sent for embedding."""
+    extraction_result = {
+        "vendor": {"name": "ACME Supplies"},
+        "items": [
+            {"description": "Item", "unit_price": 1, "total_price": 1},
+            "garbage",
+            {"description": "Bread", "unit_price": 2, "total_price": 2},
+            {"description": "Item", "unit_price": 3, "total_price": 3},
+            {"description": "  ", "unit_price": 4, "total_price": 4},
+        ],
+        "financial": {"total": 10}
+    }
+
+    result = storage_agent.store_invoice_data(extraction_result, "1")
+
+    assert result["status"] == "success"
+    assert storage_agent.embedding_generator.calls == [["Item", "Bread"]]
+
+    db = session_factory()
+    try:
+        items = db.query(Item).order_by(Item.id).all()
+        assert [item.description_embedding is not None for item in items] == [True, True, True, False]
+        assert list(items[1].description_embedding) == [5.0] * 3
+    finally:
+        db.close()
+
+
+@pytest.mark.asyncio
+async def test_process_large_payload(storage_agent):
+    """Test that payloads over the streaming threshold are parsed and stored."""
+    payload = dict(EXTRACTION_RESULT, raw_text="x" * database_storage_agent.STREAM_PARSE_THRESHOLD)
+
+    result = await storage_agent.process(AgentInput(content=json.dumps(payload)), AgentContext(user_id="1"))
+
+    assert result.status == "success"
+    assert len(result.content["item_ids"]) == 2
+    assert result.content["media_id"] is not None
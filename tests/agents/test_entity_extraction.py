@@ -205,4 +205,77 @@ async def test_invalid_llm_response(entity_extraction_agent, monkeypatch):
     assert "Failed to parse" in result.metadata.get("explanation", "")
     
     # Log the result for verification
-    logger.info(f"Invalid response result: {result}") 
\ No newline at end of file
+    logger.info(f"Invalid response result: {result}") 
+@pytest.mark.asyncio
+async def test_concurrent_extractions_are_batched(entity_extraction_agent, monkeypatch):
+    """Test that concurrent entity extractions share a single batched LLM call."""
+    import asyncio
+    
+    batches = []
+    
+    async def mock_extract_batch(texts):
+        batches.append(texts)
+        return [json.dumps({"vendor": text, "total_amount": 10.0}) for text in texts]
+    
+    monkeypatch.setattr(entity_extraction_agent.llm_factory, "extract_invoice_entities_batch", mock_extract_batch)
+    
+    texts = [f"Vendor {i}" for i in range(3)]
+    results = await asyncio.gather(*(
+        entity_extraction_agent.process(AgentInput(content=text), AgentContext(user_id="42"))
+        for text in texts
+    ))
+    
+    assert len(batches) == 1
+    assert sorted(batches[0]) == texts
+    for text, result in zip(texts, results):
+        assert result.status == "success"
+        assert result.content["vendor"] == text
+
+
+@pytest.mark.asyncio
+async def test_extractions_of_different_users_are_not_batched(entity_extraction_agent, monkeypatch):
+    """Test that invoice texts of different users never share an LLM prompt."""
+    import asyncio
+    
+    batches = []
+    
+    async def mock_extract_batch(texts):
+        batches.append(texts)
+        return [json.dumps({"vendor": text, "total_amount": 10.0}) for text in texts]
+    
+    monkeypatch.setattr(entity_extraction_agent.llm_factory, "extract_invoice_entities_batch", mock_extract_batch)
+    
+    requests = [("Vendor a", "1"), ("Vendor b", "2"), ("Vendor c", None)]
+    results = await asyncio.gather(*(
+        entity_extraction_agent.process(
+            AgentInput(content=text), AgentContext(user_id=user_id) if user_id else None
+        )
+        for text, user_id in requests
+    ))
+    
+    assert sorted(batches) == [["Vendor a"], ["Vendor b"], ["Vendor c"]]
+    assert [result.content["vendor"] for result in results] == ["Vendor a", "Vendor b", "Vendor c"]
+
+
+@pytest.mark.parametrize("response, expected", [
+    ('```json\n{"vendor": "ACME"}\n```', '{"vendor": "ACME"}'),
+    ('Here you go:\n```\n{"vendor": "ACME"}```', '{"vendor": "ACME"}'),
+    ('```json{"vendor": "ACME"}```', '{"vendor": "ACME"}'),
+    ('{"vendor": "ACME"}', None),
+    ('```json\n{"vendor": "ACME"', None),
+])
+def test_strip_json_fence(response, expected):
+    """Test that fenced JSON is extracted without regex matching."""
+    from agents.invoice_entity_extraction_agent import _strip_json_fence
+    
+    assert _strip_json_fence(response) == expected
+
+def test_validate_extraction_scores_present_entities(entity_extraction_agent):
+    """Test that the confidence reflects the weighted entities present."""
+    entities = {"vendor": "ACME", "total_amount": 10.0, "items": [{"description": "Widget"}], "currency": ""}
+    
+    is_valid, confidence = entity_extraction_agent._validate_extraction(entities)
+    
+    assert is_valid
+    assert confidence == pytest.approx((0.3 + 0.3 + 0.4 + 0.1) / 1.5)
+    assert entity_extraction_agent._validate_extraction({"status": "paid"}) == (False, pytest.approx(0.1 / 1.5))
@@ -0,0 +1,166 @@
+"""
+Tests for the FileProcessor.
+
+The per-type handlers (_process_pdf, _process_csv, ...) are supplied by the
+tests, so these cover dispatch, statistics and confidence scoring only.
+"""
+
+import pytest
+
+from agents import file_processor
+from agents.file_processor import FileProcessor
+from utils.base_agent import AgentInput, AgentOutput
+
+@pytest.fixture
+def processor():
+    """Create a file processor with an empty confidence memo."""
+    file_processor._text_scores.clear()
+    yield FileProcessor()
+    file_processor._text_scores.clear()
+
+def add_handler(monkeypatch, processor, method_name, result, calls=None):
+    """Give the processor a handler method returning a fixed result."""
+    async def handler(file_content, metadata):
+        if calls is not None:
+            calls.append((method_name, file_content))
+        return result
+
+    monkeypatch.setattr(processor, method_name, handler, raising=False)
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("file_type, method_name", [
+    ("pdf", "_process_pdf"),
+    ("application/pdf", "_process_pdf"),
+    ("PNG", "_process_image"),
+    ("docx", "_process_document"),
+    ("xlsx", "_process_spreadsheet"),
+    ("text/csv", "_process_csv"),
+    ("txt", "_process_text"),
+])
+async def test_file_types_dispatch_to_their_handler(processor, monkeypatch, file_type, method_name):
+    """Test that every file type alias, in any case, reaches its handler."""
+    calls = []
+    add_handler(monkeypatch, processor, method_name, {"content": "Invoice total 10.00"}, calls)
+
+    result = await processor.process(AgentInput(content=b"data", metadata={"file_type": file_type}))
+
+    assert result.status == "success"
+    assert result.content == "Invoice total 10.00"
+    assert calls == [(method_name, b"data")]
+
+@pytest.mark.asyncio
+async def test_handler_stats_are_recorded(processor, monkeypatch):
+    """Test that the handler's count is copied into the processing stats."""
+    add_handler(monkeypatch, processor, "_process_csv", {"content": "a,b\n1.00,2.00", "row_count": 2})
+
+    result = await processor.process({"content": b"a,b\n1.00,2.00", "metadata": {"file_type": "csv"}})
+
+    stats = result.metadata["processing_stats"]
+    assert stats["row_count"] == 2
+    assert stats["file_size"] == 13
+    assert stats["file_type"] == "csv"
+
+@pytest.mark.asyncio
+async def test_image_dimensions_fall_back_to_metadata(processor, monkeypatch):
+    """Test that dimensions read earlier (e.g. by the validator) are used when the handler has none."""
+    add_handler(monkeypatch, processor, "_process_image", {"content": "Invoice"})
+
+    result = await processor.process(AgentInput(
+        content=b"\x89PNG", metadata={"file_type": "png", "dimensions": (800, 600)}
+    ))
+
+    assert result.metadata["processing_stats"]["image_dimensions"] == (800, 600)
+
+@pytest.mark.asyncio
+async def test_unsupported_file_type(processor):
+    """Test that an unknown file type is rejected without calling a handler."""
+    result = await processor.process(AgentInput(content=b"data", metadata={"file_type": "zip"}))
+
+    assert isinstance(result, AgentOutput)
+    assert result.status == "error"
+    assert result.error == "Unsupported file type: zip"
+
+@pytest.mark.asyncio
+async def test_content_loaded_from_file_path(processor, monkeypatch):
+    """Test that a file given only by path is loaded before dispatch."""
+    calls = []
+    add_handler(monkeypatch, processor, "_process_text", {"content": "loaded"}, calls)
+    monkeypatch.setattr(processor, "_load_file_content", lambda path: f"read {path}".encode(), raising=False)
+
+    result = await processor.process({"content": None, "metadata": {"file_type": "txt", "file_path": "a.txt"}})
+
+    assert result.status == "success"
+    assert calls == [("_process_text", b"read a.txt")]
+
+@pytest.mark.asyncio
+async def test_missing_content_and_path(processor):
+    """Test that an input with neither content nor path is an error."""
+    result = await processor.process({"content": None, "metadata": {"file_type": "txt"}})
+
+    assert result.status == "error"
+    assert result.error == "Missing file content"
+
+@pytest.mark.asyncio
+async def test_process_batch_keeps_input_order(processor, monkeypatch):
+    """Test that batch results come back in input order."""
+    async def handler(file_content, metadata):
+        return {"content": file_content.decode()}
+
+    monkeypatch.setattr(processor, "_process_text", handler, raising=False)
+    inputs = [AgentInput(content=f"file {i}".encode(), metadata={"file_type": "txt"}) for i in range(5)]
+
+    results = await processor.process_batch(inputs, max_concurrency=2)
+
+    assert [result.content for result in results] == [f"file {i}" for i in range(5)]
+
+def test_content_size():
+    """Test the size of content with and without a length."""
+    assert file_processor._content_size(b"abc") == 3
+    assert file_processor._content_size(None) == -1
+
+@pytest.mark.parametrize("content, file_type, expected", [
+    ("", "pdf", 0.1),
+    ("   ", "txt", 0.1),
+    ("short text", "txt", 0.5),
+    ("x" * 150, "txt", 0.6),
+    ("Invoice\n\nTotal amount due" + "x" * 1000, "pdf", 0.9),
+    ("item,price\nbread,2.50", "csv", 0.7),
+    ("y" * 6000 + "\n\ninvoice", "docx", 1.0),
+])
+def test_calculate_confidence(processor, content, file_type, expected):
+    """Test confidence scoring by length and by structure for the file type."""
+    assert processor._calculate_confidence(content, file_type) == pytest.approx(expected)
+
+def test_calculate_confidence_for_binary_content(processor):
+    """Test that non-text content is scored only by whether anything was extracted."""
+    assert processor._calculate_confidence(b"data", "png") == 0.5
+    assert processor._calculate_confidence(b"", "png") == 0.1
+
+def test_confidence_memoized_by_digest_and_file_type(processor, monkeypatch):
+    """Test that repeated content is scored once per file type and only its digest is kept."""
+    calls = []
+    score_text = FileProcessor._score_text
+
+    def counting_score_text(content, file_type):
+        calls.append(file_type)
+        return score_text(content, file_type)
+
+    monkeypatch.setattr(FileProcessor, "_score_text", staticmethod(counting_score_text))
+    content = "Invoice total 12.00\n\n" * 10
+
+    first = processor._calculate_confidence(content, "pdf")
+    second = processor._calculate_confidence(content, "pdf")
+    processor._calculate_confidence(content, "csv")
+
+    assert first == second
+    assert calls == ["pdf", "csv"]
+    assert all(len(digest) == 32 for digest, _ in file_processor._text_scores)
+
+def test_confidence_memo_is_bounded(processor, monkeypatch):
+    """Test that the oldest scores are evicted once the memo is full."""
+    monkeypatch.setattr(file_processor, "_TEXT_SCORE_CACHE_SIZE", 2)
+
+    for i in range(3):
+        processor._calculate_confidence(f"text {i}", "txt")
+
+    assert len(file_processor._text_scores) == 2
@@ -7,6 +7,7 @@ import os
 import json
 from pathlib import Path
 
+from agents import file_validator as file_validator_module
 from agents.file_validator import FileValidatorAgent
 from services.llm_factory import LLMFactory
 from utils.base_agent import AgentInput, AgentContext
@@ -24,6 +25,13 @@ def llm_factory():
     factory = LLMFactory()
     return factory
 
+@pytest.fixture(autouse=True)
+def clear_validation_cache():
+    """Start each test without cached validation results."""
+    file_validator_module.validation_results.clear()
+    yield
+    file_validator_module.validation_results.clear()
+
 @pytest.fixture
 def file_validator(llm_factory):
     """Create a FileValidatorAgent instance."""
@@ -185,4 +193,183 @@ async def test_invalid_llm_response(llm_factory, monkeypatch):
     assert result.status == "invalid_invoice"
     
     # Log the result for verification
-    print(f"Invalid response result: {result}") 
\ No newline at end of file
+    print(f"Invalid response result: {result}") 
+
+@pytest.mark.asyncio
+async def test_validation_result_is_cached(llm_factory, monkeypatch):
+    """Test that re-submitted content reuses the cached validation result."""
+    calls = []
+    
+    async def mock_validate(content):
+        calls.append(content)
+        return '```json\n{"is_valid_invoice": true, "confidence_score": 0.9}\n```'
+    
+    monkeypatch.setattr(llm_factory, "validate_invoice_file", mock_validate)
+    agent = FileValidatorAgent(llm_factory=llm_factory)
+    agent_input = AgentInput(content="Invoice #42 Total: 10.00", content_type="pdf")
+    
+    first = await agent.process(agent_input, AgentContext())
+    second = await agent.process(agent_input, AgentContext())
+    
+    assert first.status == second.status == "success"
+    assert second.confidence == 0.9
+    assert len(calls) == 1
+
+@pytest.mark.asyncio
+async def test_unparseable_validation_result_is_not_cached(llm_factory, monkeypatch):
+    """Test that fallback results from invalid responses are not reused."""
+    calls = []
+    
+    async def mock_invalid_response(content):
+        calls.append(content)
+        return "Not a valid JSON"
+    
+    monkeypatch.setattr(llm_factory, "validate_invoice_file", mock_invalid_response)
+    agent = FileValidatorAgent(llm_factory=llm_factory)
+    agent_input = AgentInput(content="Invoice #42 Total: 10.00", content_type="pdf")
+    
+    await agent.process(agent_input, AgentContext())
+    result = await agent.process(agent_input, AgentContext())
+    
+    assert result.status == "invalid_invoice"
+    assert len(calls) == 2
+
+@pytest.mark.asyncio
+async def test_image_format_detected_from_header(file_validator, monkeypatch):
+    """Test that image size and MIME type come from the header and results are cached."""
+    import io
+    from PIL import Image
+    
+    buffer = io.BytesIO()
+    Image.new("RGB", (12, 8)).save(buffer, format="PNG")
+    calls = []
+    
+    def mock_validate_image(file_content, mime_type):
+        calls.append(mime_type)
+        return {"is_valid_invoice": True, "confidence_score": 0.8}
+    
+    monkeypatch.setattr(file_validator, "_validate_image_with_llm", mock_validate_image)
+    agent_input = AgentInput(content=buffer.getvalue(), file_name="invoice.png", content_type="image")
+    
+    first = await file_validator.process(agent_input, AgentContext())
+    second = await file_validator.process(agent_input, AgentContext())
+    
+    assert first.status == second.status == "success"
+    assert first.metadata["dimensions"] == "12x8"
+    assert first.metadata["mime_type"] == "image/png"
+    assert calls == ["image/png"]
+
+@pytest.mark.asyncio
+async def test_process_batch_validates_inputs_concurrently(llm_factory, monkeypatch):
+    """Test that batched validations overlap and keep the input order."""
+    import asyncio
+    
+    in_flight = 0
+    max_in_flight = 0
+    
+    async def mock_validate(content):
+        nonlocal in_flight, max_in_flight
+        in_flight += 1
+        max_in_flight = max(max_in_flight, in_flight)
+        await asyncio.sleep(0.01)
+        in_flight -= 1
+        score = 0.9 if "valid" in content else 0.2
+        return json.dumps({"is_valid_invoice": score > 0.5, "confidence_score": score})
+    
+    monkeypatch.setattr(llm_factory, "validate_invoice_file", mock_validate)
+    agent = FileValidatorAgent(llm_factory=llm_factory)
+    inputs = [
+        AgentInput(content=f"{label} invoice {i}", content_type="pdf")
+        for i, label in enumerate(["valid", "other", "valid", "other"])
+    ]
+    
+    results = await agent.process_batch(inputs, AgentContext(), max_concurrency=2)
+    
+    assert [result.confidence for result in results] == [0.9, 0.2, 0.9, 0.2]
+    assert max_in_flight == 2
+
+def test_openai_client_is_reused(monkeypatch):
+    """Test that image validations share one OpenAI client."""
+    import openai
+    
+    created = []
+    
+    class FakeOpenAI:
+        def __init__(self):
+            created.append(self)
+    
+    monkeypatch.setattr(openai, "OpenAI", FakeOpenAI)
+    monkeypatch.setattr(file_validator_module, "_openai_client", None)
+    
+    first = file_validator_module._get_openai()
+    second = file_validator_module._get_openai()
+    
+    assert first is second
+    assert len(created) == 1
+
+@pytest.mark.asyncio
+async def test_plain_text_and_empty_files_skip_llm(llm_factory, monkeypatch):
+    """Test that plain text and empty files are rejected without an LLM call."""
+    calls = []
+    
+    async def mock_validate(content):
+        calls.append(content)
+        return '{"is_valid_invoice": true, "confidence_score": 0.9}'
+    
+    monkeypatch.setattr(llm_factory, "validate_invoice_file", mock_validate)
+    agent = FileValidatorAgent(llm_factory=llm_factory)
+    
+    text_result = await agent.process(AgentInput(content="Invoice total 10.00", content_type="text"))
+    empty_result = await agent.process(AgentInput(content="  \n", content_type="pdf"))
+    
+    assert text_result.status == empty_result.status == "invalid_invoice"
+    assert text_result.confidence == empty_result.confidence == 0.99
+    assert calls == []
+
+def test_image_prompt_loaded_once(llm_factory, monkeypatch):
+    """Test that the image validation prompt is loaded once and then reused."""
+    loads = []
+    
+    def mock_load_prompt_template(name):
+        loads.append(name)
+        return "Is this an invoice?"
+    
+    monkeypatch.setattr(llm_factory, "load_prompt_template", mock_load_prompt_template)
+    monkeypatch.setattr(FileValidatorAgent, "_image_prompt_cache", None)
+    
+    first_agent = FileValidatorAgent(llm_factory=llm_factory)
+    second_agent = FileValidatorAgent(llm_factory=llm_factory)
+    
+    assert first_agent._load_image_prompt() == "Is this an invoice?"
+    assert second_agent._load_image_prompt() == "Is this an invoice?"
+    assert loads == ["file_validator_image_prompt"]
+
+def test_identical_validation_responses_parsed_once():
+    """Test that repeated LLM responses reuse the parsed validation result."""
+    file_validator_module._parse_validation.cache_clear()
+    response = '```json\n{"is_valid_invoice": false, "confidence_score": 0.3}\n```'
+    
+    first = file_validator_module._parse_validation(response)
+    second = file_validator_module._parse_validation(response)
+    
+    assert first == {"is_valid_invoice": False, "confidence_score": 0.3}
+    assert second is first
+    assert file_validator_module._parse_validation.cache_info().hits == 1
+
+@pytest.mark.asyncio
+async def test_cached_validation_result_is_not_shared(llm_factory, monkeypatch):
+    """Test that changing a returned validation result does not change later results."""
+    async def mock_validate(content):
+        return '```json\n{"is_valid_invoice": true, "confidence_score": 0.9, "missing_elements": []}\n```'
+    
+    monkeypatch.setattr(llm_factory, "validate_invoice_file", mock_validate)
+    agent = FileValidatorAgent(llm_factory=llm_factory)
+    agent_input = AgentInput(content="Invoice #7 Total: 5.00", content_type="pdf")
+    
+    first = await agent.process(agent_input, AgentContext())
+    first.metadata["raw_validation_result"]["missing_elements"].append("vendor")
+    first.metadata["raw_validation_result"]["is_valid_invoice"] = False
+    second = await agent.process(agent_input, AgentContext())
+    
+    assert second.content is True
+    assert second.metadata["raw_validation_result"]["missing_elements"] == []
@@ -251,4 +251,171 @@ async def test_format_complex_data(response_formatter_agent):
     assert result.status == "success"
     assert result.confidence >= 0.8
     
-    logger.info(f"Complex data format result: {result.content}") 
\ No newline at end of file
+    logger.info(f"Complex data format result: {result.content}") 
+
+
+@pytest.mark.asyncio
+async def test_concurrent_responses_batched_by_format_type(response_formatter_agent, monkeypatch):
+    """Test that concurrent replies share one LLM call per format type."""
+    import asyncio
+    
+    batches = []
+    
+    async def mock_format_batch(contents, format_type="default"):
+        batches.append((format_type, contents))
+        return [f"{format_type}: {content}" for content in contents]
+    
+    monkeypatch.setattr(response_formatter_agent.llm_factory, "format_response_batch", mock_format_batch)
+    
+    inputs = [("greeting", "Hello"), ("greeting", "Hi"), ("error", "Oops")]
+    results = await asyncio.gather(*(
+        response_formatter_agent.process(
+            AgentInput(content=content, metadata={"format_type": format_type}),
+            AgentContext(user_id="42"),
+        )
+        for format_type, content in inputs
+    ))
+    
+    assert sorted((format_type, sorted(contents)) for format_type, contents in batches) == [
+        ("error", ["Oops"]),
+        ("greeting", ["Hello", "Hi"]),
+    ]
+    assert [result.content for result in results] == ["greeting: Hello", "greeting: Hi", "error: Oops"]
+
+
+@pytest.mark.asyncio
+async def test_responses_of_different_users_are_not_batched(response_formatter_agent, monkeypatch):
+    """Test that replies for different users never share an LLM prompt."""
+    import asyncio
+    
+    batches = []
+    
+    async def mock_format_batch(contents, format_type="default"):
+        batches.append(contents)
+        return [f"Formatted {content}" for content in contents]
+    
+    monkeypatch.setattr(response_formatter_agent.llm_factory, "format_response_batch", mock_format_batch)
+    
+    contexts = [AgentContext(user_id="1"), AgentContext(conversation_id="conv-2"), None]
+    results = await asyncio.gather(*(
+        response_formatter_agent.process(AgentInput(content=f"Reply {i}"), context)
+        for i, context in enumerate(contexts)
+    ))
+    
+    assert sorted(batches) == [["Reply 0"], ["Reply 1"], ["Reply 2"]]
+    assert [result.content for result in results] == ["Formatted Reply 0", "Formatted Reply 1", "Formatted Reply 2"]
+
+@pytest.mark.asyncio
+async def test_structured_content_serialized_for_llm(response_formatter_agent, monkeypatch):
+    """Test that datetime, Decimal and plain objects are converted when content is sent as JSON."""
+    from datetime import datetime
+    from decimal import Decimal
+    
+    class Vendor:
+        def __init__(self, name):
+            self.name = name
+    
+    sent = []
+    
+    async def mock_format_batch(contents, format_type="default"):
+        sent.extend(contents)
+        return ["Formatted"] * len(contents)
+    
+    monkeypatch.setattr(response_formatter_agent.llm_factory, "format_response_batch", mock_format_batch)
+    content = {
+        "invoice_date": datetime(2024, 1, 15, 10, 30),
+        "total": Decimal("99.50"),
+        "vendor": Vendor("Café Nord"),
+    }
+    
+    result = await response_formatter_agent.process({"content": content, "type": "invoice_data"})
+    
+    assert result.status == "success"
+    assert json.loads(sent[0]) == {
+        "invoice_date": "2024-01-15T10:30:00",
+        "total": 99.5,
+        "vendor": {"name": "Café Nord"},
+    }
+    assert "Café" in sent[0]
+
+@pytest.mark.parametrize("text, expected", [
+    ("Total: $10.00", "Total: $10.00"),
+    ("Café • 2 items ✓", "Café • 2 items ✓"),
+    ("Done 🎉!", "Done 🎉 !"),
+])
+def test_whatsapp_emoji_spacing(response_formatter_agent, text, expected):
+    """Test that only emojis outside the BMP get a trailing space."""
+    assert response_formatter_agent._apply_whatsapp_formatting(text) == expected
+
+@pytest.mark.parametrize("text, expected", [
+    ("Plain reply", (0, [])),
+    ("*Total*: use `code`", (0, ["bold", "inline_code"])),
+    ("```json``` and ~gone~ 🎉🎉 then 😀\n• item", (2, ["strikethrough", "code_block", "bullet_list"])),
+])
+def test_analyze_formatting(response_formatter_agent, text, expected):
+    """Test that emoji runs and formatting markers are detected in one call."""
+    assert response_formatter_agent._analyze_formatting(text) == expected
+
+def test_serialize_for_json_handles_subclasses(response_formatter_agent):
+    """Test that exact types and their subclasses are both converted."""
+    from collections import OrderedDict
+    from datetime import datetime
+    from decimal import Decimal
+    
+    class Row:
+        def __init__(self):
+            self.total = Decimal("5.25")
+    
+    data = {
+        "count": 2,
+        "results": [
+            {"date": datetime(2024, 1, 15), "amount": Decimal("10.50"), "paid": True, "note": None},
+            OrderedDict(date=datetime(2024, 2, 1), row=Row()),
+        ],
+    }
+    
+    assert response_formatter_agent._serialize_for_json(data) == {
+        "count": 2,
+        "results": [
+            {"date": "2024-01-15T00:00:00", "amount": 10.5, "paid": True, "note": None},
+            {"date": "2024-02-01T00:00:00", "row": {"total": 5.25}},
+        ],
+    }
+
+def test_serialize_for_json_handles_deep_and_shared_values(response_formatter_agent):
+    """Test that deep nesting doesn't recurse and shared values convert consistently."""
+    from decimal import Decimal
+    
+    deep = current = {}
+    for _ in range(5000):
+        current["child"] = {}
+        current = current["child"]
+    current["amount"] = Decimal("1.5")
+    shared = {"amount": Decimal("2")}
+    
+    result = response_formatter_agent._serialize_for_json({"deep": deep, "a": shared, "b": shared})
+    
+    node = result["deep"]
+    while "child" in node:
+        node = node["child"]
+    assert node == {"amount": 1.5}
+    assert result["a"] == result["b"] == {"amount": 2.0}
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("content, expected", [
+    ({"query": "invoices", "count": 0}, ResponseFormatterAgent._NO_RESULTS_FALLBACK),
+    ({"query": "invoices", "count": 3}, ResponseFormatterAgent._AMBIGUOUS_QUERY_FALLBACK),
+    ({"query": "invoices", "error": "timeout"}, ResponseFormatterAgent._QUERY_ERROR_FALLBACK),
+    ([{"id": 1}], ResponseFormatterAgent._NO_RESPONSE_FALLBACK),
+])
+async def test_query_result_fallbacks(response_formatter_agent, monkeypatch, content, expected):
+    """Test that failed query_result formatting picks a fallback from the result."""
+    async def mock_error(*args, **kwargs):
+        raise Exception("Test formatting error")
+    
+    monkeypatch.setattr(response_formatter_agent.llm_factory, "format_response", mock_error)
+    
+    result = await response_formatter_agent.process({"content": content, "type": "query_result"})
+    
+    assert result.status == "error"
+    assert result.content == expected
@@ -7,6 +7,7 @@ import os
 import json
 from pathlib import Path
 
+from agents import text_intent_classifier as text_intent_classifier_module
 from agents.text_intent_classifier import TextIntentClassifierAgent
 from services.llm_factory import LLMFactory
 from langchain_app.state import IntentType
@@ -25,6 +26,13 @@ def llm_factory():
     factory = LLMFactory()
     return factory
 
+@pytest.fixture(autouse=True)
+def clear_intent_cache():
+    """Start each test without cached intent classifications."""
+    text_intent_classifier_module.intent_results.clear()
+    yield
+    text_intent_classifier_module.intent_results.clear()
+
 @pytest.fixture
 def text_intent_classifier(llm_factory):
     """Create a TextIntentClassifierAgent instance."""
@@ -138,7 +146,7 @@ async def test_error_handling(llm_factory, monkeypatch):
     monkeypatch.setattr(llm_factory, "classify_text_intent", mock_error)
     
     # Should handle exceptions gracefully
-    agent_input = AgentInput(content="Hello")
+    agent_input = AgentInput(content="Where did I get it from?")
     context = AgentContext(conversation_history=[])
     result = await agent.process(agent_input, context)
     
@@ -160,11 +168,275 @@ async def test_invalid_llm_response(llm_factory, monkeypatch):
     monkeypatch.setattr(llm_factory, "classify_text_intent", mock_invalid_response)
     
     # Should handle invalid responses gracefully
-    agent_input = AgentInput(content="Hello")
+    agent_input = AgentInput(content="Where did I get it from?")
     context = AgentContext(conversation_history=[])
     result = await agent.process(agent_input, context)
     
     assert result is not None
     assert result.content == IntentType.UNKNOWN
     assert result.confidence <= 0.1
-    assert "Could not parse" in result.metadata.get("explanation", "") 
\ No newline at end of file
+    assert "Could not parse" in result.metadata.get("explanation", "") 
+
+@pytest.mark.asyncio
+async def test_repeated_utterance_uses_cached_intent(llm_factory, monkeypatch):
+    """Test that utterances differing only in case and punctuation are classified once."""
+    calls = []
+    
+    async def mock_classify(input_text):
+        calls.append(input_text)
+        return json.dumps({"intent": "general", "confidence": 0.95, "explanation": "Small talk"})
+    
+    monkeypatch.setattr(llm_factory, "classify_text_intent", mock_classify)
+    agent = TextIntentClassifierAgent(llm_factory=llm_factory)
+    
+    first = await agent.process(AgentInput(content="What's the weather like?"), AgentContext(conversation_history=[]))
+    second = await agent.process(AgentInput(content="  whats the WEATHER like "), AgentContext(conversation_history=[]))
+    
+    assert first.content == second.content == IntentType.GENERAL
+    assert second.confidence == 0.95
+    assert second.metadata["cache_hit"] is True
+    assert "cache_hit" not in first.metadata
+    assert len(calls) == 1
+
+@pytest.mark.asyncio
+async def test_cached_intent_depends_on_history(llm_factory, monkeypatch):
+    """Test that the same utterance in a different conversation is classified again."""
+    calls = []
+    
+    async def mock_classify(input_text):
+        calls.append(input_text)
+        return json.dumps({"intent": "invoice_query", "confidence": 0.9})
+    
+    monkeypatch.setattr(llm_factory, "classify_text_intent", mock_classify)
+    agent = TextIntentClassifierAgent(llm_factory=llm_factory)
+    
+    await agent.process(AgentInput(content="yes"), AgentContext(conversation_history=[]))
+    await agent.process(AgentInput(content="yes"), AgentContext(conversation_history=SAMPLE_CONVERSATION_HISTORY))
+    
+    assert len(calls) == 2
+
+@pytest.mark.asyncio
+async def test_concurrent_classifications_are_batched(text_intent_classifier, monkeypatch):
+    """Test that concurrent classifications share a single batched LLM call."""
+    import asyncio
+    
+    batches = []
+    
+    async def mock_classify_batch(input_texts):
+        batches.append(input_texts)
+        return [
+            json.dumps({"intent": "greeting" if "hello" in text else "general", "confidence": 0.9})
+            for text in input_texts
+        ]
+    
+    monkeypatch.setattr(text_intent_classifier.llm_factory, "classify_text_intent_batch", mock_classify_batch)
+    
+    texts = ["hello again", "what is the weather", "hello friend"]
+    results = await asyncio.gather(*(
+        text_intent_classifier.process(
+            AgentInput(content=text), AgentContext(user_id="42", conversation_history=[])
+        )
+        for text in texts
+    ))
+    
+    assert len(batches) == 1
+    assert len(batches[0]) == 3
+    assert [result.content for result in results] == [IntentType.GREETING, IntentType.GENERAL, IntentType.GREETING]
+
+@pytest.mark.asyncio
+async def test_classifications_of_different_users_are_not_batched(text_intent_classifier, monkeypatch):
+    """Test that messages of different users never share an LLM prompt."""
+    import asyncio
+    
+    batches = []
+    
+    async def mock_classify_batch(input_texts):
+        batches.append(input_texts)
+        return [json.dumps({"intent": "general", "confidence": 0.9}) for _ in input_texts]
+    
+    monkeypatch.setattr(text_intent_classifier.llm_factory, "classify_text_intent_batch", mock_classify_batch)
+    
+    texts = ["what is the weather", "what time is it", "how are you doing"]
+    contexts = [
+        AgentContext(user_id="1", conversation_history=[]),
+        AgentContext(user_id="2", conversation_history=[]),
+        AgentContext(conversation_history=[]),
+    ]
+    results = await asyncio.gather(*(
+        text_intent_classifier.process(AgentInput(content=text), context)
+        for text, context in zip(texts, contexts)
+    ))
+    
+    assert len(batches) == 3
+    assert all(len(batch) == 1 for batch in batches)
+    assert all(result.content == IntentType.GENERAL for result in results)
+
+@pytest.mark.asyncio
+async def test_classification_input_is_compact(llm_factory, monkeypatch):
+    """Test that only role and content of history messages are sent, without escaping."""
+    sent = []
+    
+    async def mock_classify(input_text):
+        sent.append(input_text)
+        return json.dumps({"intent": "invoice_query", "confidence": 0.9})
+    
+    monkeypatch.setattr(llm_factory, "classify_text_intent", mock_classify)
+    agent = TextIntentClassifierAgent(llm_factory=llm_factory)
+    
+    await agent.process(AgentInput(content="How much?"), AgentContext(conversation_history=SAMPLE_CONVERSATION_HISTORY))
+    
+    assert "timestamp" not in sent[0]
+    assert "👋" in sent[0]
+    assert json.loads(sent[0])["conversation_history"][0] == {"role": "user", "content": "Hi there"}
+
+@pytest.mark.asyncio
+async def test_classification_prompt_sent_as_system_prompt(llm_factory, monkeypatch):
+    """Test that the static classification prompt is kept apart from the per-message input."""
+    calls = []
+    
+    async def mock_generate_completion(prompt, **kwargs):
+        calls.append((prompt, kwargs))
+        return '{"intent": "greeting", "confidence": 0.9}'
+    
+    monkeypatch.setattr(llm_factory, "generate_completion", mock_generate_completion)
+    
+    await llm_factory.classify_text_intent(input_text='{"user_input":"hi"}')
+    await llm_factory.classify_text_intent(input_text='{"user_input":"show invoices"}')
+    
+    (first_prompt, first_kwargs), (_, second_kwargs) = calls
+    assert first_prompt == 'INPUT:\n{"user_input":"hi"}\n\nOUTPUT:'
+    assert "intent classifier" in first_kwargs["system_prompt"]
+    assert first_kwargs["system_prompt"] is second_kwargs["system_prompt"]
+
+@pytest.mark.asyncio
+async def test_batched_classification_prompt_sent_as_system_prompt(llm_factory, monkeypatch):
+    """Test that batched classification also keeps the static prompt out of the user prompt."""
+    calls = []
+    
+    async def mock_generate_completion(prompt, **kwargs):
+        calls.append((prompt, kwargs))
+        return json.dumps([{"intent": "greeting", "confidence": 0.9}] * 2)
+    
+    monkeypatch.setattr(llm_factory, "generate_completion", mock_generate_completion)
+    
+    results = await llm_factory.classify_text_intent_batch(['{"user_input":"hi"}', '{"user_input":"hey"}'])
+    
+    (prompt, kwargs), = calls
+    assert len(results) == 2
+    assert "intent classifier" in kwargs["system_prompt"]
+    assert "intent classifier" not in prompt
+    assert prompt.startswith("The input contains 2 separate documents.")
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("text, expected", [
+    ("Hi", IntentType.GREETING),
+    ("good morning!", IntentType.GREETING),
+    ("Create an invoice for $100 from Amazon on March 5", IntentType.INVOICE_CREATOR),
+    ("Show me all pending invoices", IntentType.INVOICE_QUERY),
+    ("How much did I spend on coffee?", IntentType.INVOICE_QUERY),
+])
+async def test_keyword_rules_skip_llm(llm_factory, monkeypatch, text, expected):
+    """Test that unambiguous messages are classified without an LLM call."""
+    async def mock_classify(*args, **kwargs):
+        raise AssertionError("LLM should not be called")
+    
+    monkeypatch.setattr(llm_factory, "classify_text_intent", mock_classify)
+    agent = TextIntentClassifierAgent(llm_factory=llm_factory)
+    
+    result = await agent.process(AgentInput(content=text), AgentContext(conversation_history=[]))
+    
+    assert result.content == expected
+    assert result.metadata["fast_path"] is True
+
+@pytest.mark.parametrize("text", [
+    "Hello, what did I spend at Amazon last month?",
+    "show me how invoices work",
+    "make sure my invoice is saved",
+    "How much?",
+])
+def test_keyword_rules_leave_ambiguous_messages_to_llm(text):
+    """Test that mixed or context-dependent messages don't match a keyword rule."""
+    assert text_intent_classifier_module._fast_classify(text) is None
+
+@pytest.mark.parametrize("response, expected", [
+    ("Invoice Query", (IntentType.INVOICE_QUERY, 0.9)),
+    ("invoice_query\n", (IntentType.INVOICE_QUERY, 0.9)),
+    ("GREETING", (IntentType.GREETING, 0.9)),
+    ("Intent: invoice-creator\nConfidence: 0.8", (IntentType.INVOICE_CREATOR, 0.8)),
+    ("Intent: weather\nConfidence: 0.8", (IntentType.UNKNOWN, 0.8)),
+])
+def test_parse_plain_text_intents(text_intent_classifier, response, expected):
+    """Test that plain text intent names match regardless of case and separators."""
+    parsed = text_intent_classifier._parse_classification_result(response)
+    
+    assert (parsed["intent"], parsed["confidence"]) == expected
+
+
+def test_plain_text_result_skips_json_parse(text_intent_classifier, monkeypatch):
+    """Test that responses not starting like JSON never reach the JSON parser."""
+    from utils import json_utils
+    
+    def fail_loads(data):
+        raise AssertionError("JSON parser should not be called")
+    
+    monkeypatch.setattr(json_utils, "loads", fail_loads)
+    
+    parsed = text_intent_classifier._parse_classification_result("  Greeting")
+    
+    assert parsed["intent"] == IntentType.GREETING
+
+@pytest.mark.asyncio
+async def test_classification_history_is_capped(llm_factory, monkeypatch):
+    """Test that only the most recent, shortened history messages are sent."""
+    from constants.intent_types import INTENT_HISTORY_MAX_MESSAGES, INTENT_HISTORY_MAX_CONTENT_CHARS
+    
+    sent = []
+    
+    async def mock_classify(input_text):
+        sent.append(input_text)
+        return json.dumps({"intent": "invoice_query", "confidence": 0.9})
+    
+    monkeypatch.setattr(llm_factory, "classify_text_intent", mock_classify)
+    agent = TextIntentClassifierAgent(llm_factory=llm_factory)
+    history = [{"role": "user", "content": f"message {i}"} for i in range(10)]
+    history.append({"role": "assistant", "content": "x" * 1000})
+    
+    await agent.process(AgentInput(content="How much?"), AgentContext(conversation_history=history))
+    
+    sent_history = json.loads(sent[0])["conversation_history"]
+    assert len(sent_history) == INTENT_HISTORY_MAX_MESSAGES
+    assert sent_history[0]["content"] == f"message {11 - INTENT_HISTORY_MAX_MESSAGES}"
+    assert sent_history[-1]["content"] == "x" * INTENT_HISTORY_MAX_CONTENT_CHARS + "..."
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("text, history, reason", [
+    ("", [], "empty_input"),
+    ("   \n", SAMPLE_CONVERSATION_HISTORY, "empty_input"),
+    ("?", [], "too_short"),
+])
+async def test_empty_or_trivial_input_skips_llm(llm_factory, monkeypatch, text, history, reason):
+    """Test that messages with nothing to classify return UNKNOWN without an LLM call."""
+    async def mock_classify(*args, **kwargs):
+        raise AssertionError("LLM should not be called")
+    
+    monkeypatch.setattr(llm_factory, "classify_text_intent", mock_classify)
+    agent = TextIntentClassifierAgent(llm_factory=llm_factory)
+    
+    result = await agent.process(AgentInput(content=text), AgentContext(conversation_history=history))
+    
+    assert result.content == IntentType.UNKNOWN
+    assert result.status == "success"
+    assert result.metadata["reason"] == reason
+
+@pytest.mark.asyncio
+async def test_single_character_follow_up_is_classified(llm_factory, monkeypatch):
+    """Test that a one-character reply is still classified when there is history."""
+    async def mock_classify(input_text):
+        return json.dumps({"intent": "invoice_query", "confidence": 0.8})
+    
+    monkeypatch.setattr(llm_factory, "classify_text_intent", mock_classify)
+    agent = TextIntentClassifierAgent(llm_factory=llm_factory)
+    
+    result = await agent.process(AgentInput(content="5"), AgentContext(conversation_history=SAMPLE_CONVERSATION_HISTORY))
+    
+    assert result.content == IntentType.INVOICE_QUERY
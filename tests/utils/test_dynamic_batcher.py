@@ -0,0 +1,79 @@
+"""
+Tests for the dynamic batcher.
+"""
+
+import asyncio
+
+import pytest
+
+from utils.dynamic_batcher import DynamicBatcher, dispatch_grouped
+
+
+@pytest.mark.asyncio
+async def test_concurrent_submissions_share_a_batch():
+    """Test that items submitted together are dispatched in one call."""
+    batches = []
+
+    async def batch_fn(items):
+        batches.append(items)
+        return [item * 2 for item in items]
+
+    batcher = DynamicBatcher(batch_fn, max_batch_size=5, max_wait_ms=10)
+    results = await asyncio.gather(*(batcher.submit(i) for i in range(3)))
+
+    assert results == [0, 2, 4]
+    assert batches == [[0, 1, 2]]
+
+
+@pytest.mark.asyncio
+async def test_worker_exits_when_idle_and_restarts():
+    """Test that the collector task stops without submissions and restarts on demand."""
+    async def batch_fn(items):
+        return items
+
+    batcher = DynamicBatcher(batch_fn, max_wait_ms=1, idle_ms=10)
+    assert await batcher.submit("a") == "a"
+    first_worker = batcher._worker
+
+    await asyncio.sleep(0.05)
+    assert first_worker.done()
+
+    assert await batcher.submit("b") == "b"
+    assert batcher._worker is not first_worker
+
+
+@pytest.mark.asyncio
+async def test_failing_group_does_not_fail_other_groups():
+    """Test that only the callers of a failed group see its exception."""
+    async def group_fn(group):
+        if group[0] == "bad":
+            raise RuntimeError("group failed")
+        return [item.upper() for item in group]
+
+    async def batch_fn(items):
+        return await dispatch_grouped(items, lambda item: item, group_fn)
+
+    batcher = DynamicBatcher(batch_fn, max_batch_size=5, max_wait_ms=10)
+    results = await asyncio.gather(
+        batcher.submit("ok"), batcher.submit("bad"), batcher.submit("ok"),
+        return_exceptions=True,
+    )
+
+    assert results[0] == "OK"
+    assert results[2] == "OK"
+    assert isinstance(results[1], RuntimeError)
+
+
+@pytest.mark.asyncio
+async def test_items_without_key_are_not_grouped():
+    """Test that items whose key is None are processed on their own."""
+    groups = []
+
+    async def group_fn(group):
+        groups.append(group)
+        return group
+
+    results = await dispatch_grouped(["a", "b", "c"], lambda item: None, group_fn)
+
+    assert results == ["a", "b", "c"]
+    assert sorted(groups) == [["a"], ["b"], ["c"]]
@@ -0,0 +1,60 @@
+"""
+Tests for the extraction result cache.
+"""
+
+import json
+
+from utils.extraction_cache import ExtractionCache, make_cache_key
+
+
+def test_cache_key_depends_on_every_component():
+    """Test that the key changes with the model, provider, prompt and content."""
+    base = make_cache_key("extraction", "v1", b"invoice", "openai", "gpt-4o-mini")
+
+    assert base == make_cache_key("extraction", "v1", b"invoice", "openai", "gpt-4o-mini")
+    assert base != make_cache_key("extraction", "v1", b"invoice", "openai", "gpt-4")
+    assert base != make_cache_key("extraction", "v1", b"invoice", "anthropic", "gpt-4o-mini")
+    assert base != make_cache_key("extraction", "v2", b"invoice", "openai", "gpt-4o-mini")
+    assert base != make_cache_key("extraction", "v1", b"invoice2", "openai", "gpt-4o-mini")
+    # Length prefixes keep adjacent components from running together
+    assert (make_cache_key("extraction", "v1", b"x", "ab", "c")
+            != make_cache_key("extraction", "v1", b"x", "a", "bc"))
+
+
+def test_put_and_get_round_trip(tmp_path):
+    """Test that stored results are returned and recorded as plain JSON."""
+    cache = ExtractionCache(cache_dir=tmp_path, enabled=True)
+    key = make_cache_key("extraction", "v1", b"invoice", "openai", "gpt-4o-mini")
+
+    cache.put(key, {"vendor": {"name": "ACME"}}, model="gpt-4o-mini")
+
+    assert cache.get(key) == {"vendor": {"name": "ACME"}}
+    entry = json.loads(next(tmp_path.glob("*.json")).read_text())
+    assert entry["model"] == "gpt-4o-mini"
+    assert entry["created_at"]
+
+
+def test_expired_entries_are_evicted(tmp_path):
+    """Test that entries past their TTL are dropped."""
+    cache = ExtractionCache(cache_dir=tmp_path, ttl_seconds=-1, enabled=True)
+    cache.put("key", {"vendor": {"name": "ACME"}})
+
+    assert cache.get("key") is None
+    assert not list(tmp_path.glob("*.json"))
+
+
+def test_env_var_sets_cache_dir(tmp_path, monkeypatch):
+    """Test that EXTRACTION_CACHE_DIR opts in and picks the directory."""
+    monkeypatch.setenv("EXTRACTION_CACHE_DIR", str(tmp_path))
+    cache = ExtractionCache()
+
+    assert cache.enabled
+    assert cache.cache_dir == tmp_path
+
+
+def test_cache_disabled_without_env_var(monkeypatch):
+    """Test that the cache stays off unless EXTRACTION_CACHE_DIR is set."""
+    monkeypatch.delenv("EXTRACTION_CACHE_DIR", raising=False)
+    cache = ExtractionCache()
+
+    assert not cache.enabled
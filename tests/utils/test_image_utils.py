@@ -0,0 +1,52 @@
+"""
+Tests for the image header utilities.
+"""
+
+import io
+
+import pytest
+from PIL import Image
+
+from utils.image_utils import detect_image_format, peek_image_info
+from tests.fixtures.test_data import VALID_INVOICE_PATH
+
+
+def _encode(image_format: str, size=(123, 457), **kwargs) -> bytes:
+    """Encode a blank image in the given format."""
+    buffer = io.BytesIO()
+    Image.new("RGB", size).save(buffer, image_format, **kwargs)
+    return buffer.getvalue()
+
+
+@pytest.mark.parametrize("image_format, kwargs", [
+    ("PNG", {}),
+    ("JPEG", {}),
+    ("JPEG", {"exif": b"Exif\x00\x00" + b"\x00" * 512}),
+    ("GIF", {}),
+    ("WEBP", {}),
+    ("WEBP", {"lossless": True}),
+])
+def test_peek_image_info_matches_pil(image_format, kwargs):
+    """Test that header parsing agrees with PIL for supported formats."""
+    data = _encode(image_format, **kwargs)
+    
+    assert peek_image_info(data) == (123, 457, image_format.lower())
+
+
+def test_peek_image_info_on_invoice_fixture():
+    """Test header parsing on the sample invoice image."""
+    with open(VALID_INVOICE_PATH, 'rb') as f:
+        data = f.read()
+    
+    width, height, image_format = peek_image_info(data)
+    
+    assert (width, height) == Image.open(VALID_INVOICE_PATH).size
+    assert image_format == "png"
+
+
+def test_unknown_or_truncated_data():
+    """Test that unrecognised or truncated headers return None."""
+    assert detect_image_format(b"%PDF-1.7") is None
+    assert peek_image_info(b"%PDF-1.7") is None
+    assert peek_image_info(b"\x89PNG\r\n\x1a\n") is None
+    assert peek_image_info(b"\xff\xd8\xff") is None
@@ -0,0 +1,73 @@
+"""
+Tests for the JSON helpers.
+"""
+
+import pytest
+
+from utils import json_utils
+
+DOCUMENT = '{"vendor": {"name": "ACME"}, "raw_text": "x", "items": [{"total_price": 2.5}], "file_size": 10}'
+
+
+@pytest.fixture(params=["full", "streaming"])
+def parser_mode(request, monkeypatch):
+    """Run a test against both the full and the streaming parser."""
+    if request.param == "streaming":
+        pytest.importorskip("ijson")
+    else:
+        monkeypatch.setattr(json_utils, "IJSON_AVAILABLE", False)
+    return request.param
+
+
+def test_loads_keys_keeps_only_requested_keys(parser_mode):
+    """Test that only the requested top-level keys are returned."""
+    result = json_utils.loads_keys(DOCUMENT, {"vendor", "items", "file_size", "missing"})
+
+    assert result == {"vendor": {"name": "ACME"}, "items": [{"total_price": 2.5}], "file_size": 10}
+
+
+def test_loads_keys_returns_non_objects_whole(parser_mode):
+    """Test that a top-level array is returned unchanged."""
+    assert json_utils.loads_keys("[1, 2]", {"vendor"}) == [1, 2]
+
+
+def test_loads_keys_rejects_invalid_json(parser_mode):
+    """Test that malformed input raises JSONDecodeError."""
+    with pytest.raises(json_utils.JSONDecodeError):
+        json_utils.loads_keys('{"vendor": ', {"vendor"})
+
+
+@pytest.mark.parametrize("use_orjson", [False, True])
+def test_dumps_matches_standard_library(use_orjson, monkeypatch):
+    """Test that both serializers produce the same indented, non-ASCII-preserving output."""
+    from datetime import datetime
+    from decimal import Decimal
+
+    if use_orjson:
+        pytest.importorskip("orjson")
+    else:
+        monkeypatch.setattr(json_utils, "ORJSON_AVAILABLE", False)
+
+    def default(obj):
+        if isinstance(obj, datetime):
+            return obj.isoformat()
+        if isinstance(obj, Decimal):
+            return float(obj)
+        raise TypeError
+
+    data = {"vendor": "Café", "date": datetime(2024, 1, 15, 10, 30), "total": Decimal("9.5"), "items": [1]}
+
+    assert json_utils.dumps(data, indent=True, default=default) == (
+        '{\n  "vendor": "Café",\n  "date": "2024-01-15T10:30:00",\n  "total": 9.5,\n  "items": [\n    1\n  ]\n}'
+    )
+
+
+@pytest.mark.parametrize("use_orjson", [False, True])
+def test_dumps_is_compact_without_indent(use_orjson, monkeypatch):
+    """Test that unindented output has no whitespace between tokens."""
+    if use_orjson:
+        pytest.importorskip("orjson")
+    else:
+        monkeypatch.setattr(json_utils, "ORJSON_AVAILABLE", False)
+    
+    assert json_utils.dumps({"text": "👋 hi", "items": [1, 2]}) == '{"text":"👋 hi","items":[1,2]}'
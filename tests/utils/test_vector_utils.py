@@ -0,0 +1,59 @@
+"""
+Tests for the embedding cache in the vector utilities.
+"""
+
+from types import SimpleNamespace
+
+import pytest
+
+from utils import vector_utils
+from utils.vector_utils import EmbeddingGenerator
+
+
+class FakeEmbeddingsAPI:
+    """Stand-in for the OpenAI embeddings endpoint that records its inputs."""
+
+    def __init__(self):
+        self.inputs = []
+
+    def create(self, input, model):
+        self.inputs.append(list(input))
+        return SimpleNamespace(data=[SimpleNamespace(embedding=[float(len(text))]) for text in input])
+
+
+@pytest.fixture
+def embeddings_api(monkeypatch):
+    """Use an empty cache and a fake OpenAI client."""
+    monkeypatch.setattr(vector_utils, "_embedding_cache", {})
+    return FakeEmbeddingsAPI()
+
+
+@pytest.fixture
+def generator(embeddings_api):
+    """Create an embedding generator backed by the fake API."""
+    generator = EmbeddingGenerator()
+    generator.use_openai = True
+    generator.openai_client = SimpleNamespace(embeddings=embeddings_api)
+    return generator
+
+
+def test_batch_embeddings_reuse_cache_and_dedupe(generator, embeddings_api):
+    """Test that repeated and previously seen texts are not embedded again."""
+    first = generator.generate_batch_embeddings(["Milk 1L", "Bread", "Milk 1L", ""])
+    second = generator.generate_batch_embeddings(["Bread", "Eggs"])
+
+    assert first == [[7.0], [5.0], [7.0], None]
+    assert second == [[5.0], [4.0]]
+    assert embeddings_api.inputs == [["Milk 1L", "Bread"], ["Eggs"]]
+
+
+def test_cache_evicts_least_recently_used(generator, embeddings_api, monkeypatch):
+    """Test that a full cache evicts the least recently used embedding."""
+    monkeypatch.setattr(vector_utils, "_cache_size_limit", 2)
+
+    generator.generate_batch_embeddings(["a", "bb"])
+    generator.generate_batch_embeddings(["a"])  # "a" is now more recent than "bb"
+    generator.generate_batch_embeddings(["ccc"])
+    generator.generate_batch_embeddings(["a", "bb"])
+
+    assert embeddings_api.inputs == [["a", "bb"], ["ccc"], ["bb"]]
@@ -0,0 +1,196 @@
+"""
+Dynamic batching for concurrent async requests.
+
+This module provides a small batcher that accumulates concurrent requests
+for a short window and dispatches them together, so that fixed per-request
+overhead (network round-trips, auth, prompt tokens) is paid once per batch.
+"""
+import asyncio
+import logging
+from typing import Any, Awaitable, Callable, Dict, Hashable, List, Optional, Set, Tuple
+
+from constants.llm_configs import BatchSettings
+
+logger = logging.getLogger(__name__)
+
+
+class DynamicBatcher:
+    """
+    Coalesce concurrent submissions into batched calls.
+
+    Items submitted while a batch is open are collected until either
+    `max_batch_size` items are waiting or `max_wait_ms` has elapsed, then
+    `batch_fn` is called once with all of them. `batch_fn` must return one
+    result per item, in the same order; a result that is an exception is
+    raised to the caller of that item only.
+
+    The collector task stops after `idle_ms` without submissions and is
+    started again by the next one, so an unused batcher holds no task.
+    """
+
+    def __init__(self,
+                 batch_fn: Callable[[List[Any]], Awaitable[List[Any]]],
+                 max_batch_size: int = BatchSettings.MAX_BATCH_SIZE,
+                 max_wait_ms: int = BatchSettings.MAX_WAIT_MS,
+                 idle_ms: int = BatchSettings.WORKER_IDLE_MS):
+        """
+        Initialize the batcher.
+
+        Args:
+            batch_fn: Async function processing a list of items
+            max_batch_size: Maximum number of items per batch
+            max_wait_ms: Maximum time to wait for a batch to fill up
+            idle_ms: Time without submissions after which the collector task exits
+        """
+        self.batch_fn = batch_fn
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000.0
+        self.idle_timeout = idle_ms / 1000.0
+        self._queue: Optional[asyncio.Queue] = None
+        self._worker: Optional[asyncio.Task] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._pending: Set[asyncio.Task] = set()
+
+    async def submit(self, item: Any) -> Any:
+        """
+        Submit an item and wait for its result.
+
+        Args:
+            item: The item to process
+
+        Returns:
+            The result produced for this item by the batch function
+        """
+        loop = asyncio.get_running_loop()
+        self._ensure_worker(loop)
+        future = loop.create_future()
+        await self._queue.put((item, future))
+        return await future
+
+    def _ensure_worker(self, loop: asyncio.AbstractEventLoop) -> None:
+        """Start the collector task for the current event loop if needed."""
+        if self._loop is loop and self._worker is not None and not self._worker.done():
+            return
+        if self._loop is not loop:
+            self._loop = loop
+            self._queue = asyncio.Queue()
+        self._worker = loop.create_task(self._collect())
+
+    async def _collect(self) -> None:
+        """Collect queued items into batches and dispatch them until the queue stays idle."""
+        loop = asyncio.get_running_loop()
+        while True:
+            try:
+                batch = [await asyncio.wait_for(self._queue.get(), self.idle_timeout)]
+            except asyncio.TimeoutError:
+                # An item may have been queued while the timeout was being delivered
+                if self._queue.empty():
+                    return
+                continue
+            deadline = loop.time() + self.max_wait
+
+            while len(batch) < self.max_batch_size:
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self._queue.get(), remaining))
+                except asyncio.TimeoutError:
+                    break
+
+            # Dispatch in the background so the next batch can start filling up
+            task = loop.create_task(self._dispatch(batch))
+            self._pending.add(task)
+            task.add_done_callback(self._pending.discard)
+
+    async def _dispatch(self, batch: List[Tuple[Any, asyncio.Future]]) -> None:
+        """Run the batch function and hand each result back to its caller."""
+        items = [item for item, _ in batch]
+        logger.debug("Dispatching batch of %d items", len(items))
+        try:
+            results = await self.batch_fn(items)
+            if len(results) != len(items):
+                raise ValueError(f"Batch function returned {len(results)} results for {len(items)} items")
+        except Exception as e:
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+
+        for (_, future), result in zip(batch, results):
+            if future.done():
+                continue
+            if isinstance(result, Exception):
+                future.set_exception(result)
+            else:
+                future.set_result(result)
+
+
+async def dispatch_grouped(items: List[Any],
+                           key_fn: Callable[[Any], Hashable],
+                           group_fn: Callable[[List[Any]], Awaitable[List[Any]]]) -> List[Any]:
+    """
+    Split a batch into groups that can share one call and run the groups concurrently.
+
+    A group that fails does not affect the others: each of its items gets the
+    exception as its result, which DynamicBatcher raises to that item's caller.
+
+    Args:
+        items: The batch, e.g. as handed to a DynamicBatcher batch function
+        key_fn: Returns the group of an item; items with equal keys are processed
+            together, and an item whose key is None is processed on its own
+        group_fn: Async function processing the items of one group, one result per item
+
+    Returns:
+        Results in the same order as the items, with exceptions for failed groups
+    """
+    groups: Dict[Hashable, List[int]] = {}
+    for index, item in enumerate(items):
+        key = key_fn(item)
+        # Items without a key are never combined with others
+        groups.setdefault(("ungrouped", index) if key is None else key, []).append(index)
+
+    group_results = await asyncio.gather(
+        *(group_fn([items[i] for i in indices]) for indices in groups.values()),
+        return_exceptions=True,
+    )
+
+    results: List[Any] = [None] * len(items)
+    for indices, group_result in zip(groups.values(), group_results):
+        if not isinstance(group_result, BaseException) and len(group_result) != len(indices):
+            group_result = ValueError(
+                f"Group function returned {len(group_result)} results for {len(indices)} items"
+            )
+        if isinstance(group_result, BaseException):
+            if not isinstance(group_result, Exception):
+                raise group_result
+            logger.warning("Batch group of %d items failed: %s", len(indices), group_result)
+            group_result = [group_result] * len(indices)
+        for index, result in zip(indices, group_result):
+            results[index] = result
+    return results
+
+
+def batch_scope(context: Any) -> Optional[Hashable]:
+    """
+    Group key component that keeps requests of different users apart.
+    
+    Combined prompts are split back into results by position only, so requests
+    of different users must never share one.
+    
+    Args:
+        context: The AgentContext of a request, or None
+        
+    Returns:
+        A key for the request's user or, failing that, its conversation; None if
+        neither is known, meaning the request must be processed on its own
+    """
+    if context is None:
+        return None
+    user_id = getattr(context, "user_id", None)
+    if user_id:
+        return ("user", user_id)
+    conversation_id = getattr(context, "conversation_id", None)
+    if conversation_id:
+        return ("conversation", conversation_id)
+    return None
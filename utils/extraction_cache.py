@@ -0,0 +1,220 @@
+"""
+Content-addressable cache for invoice extraction results.
+
+This module stores parsed LLM extraction results keyed by the provider, the
+model, the agent type, the prompt version and the file bytes, so that the
+same invoice uploaded twice (or replayed while debugging) does not trigger a
+second LLM call. Entries are plain JSON files and can be inspected by hand.
+"""
+import hashlib
+import json
+import logging
+import os
+import time
+from collections import OrderedDict
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Dict, Hashable, Optional, Union
+
+from utils.config import config
+
+logger = logging.getLogger(__name__)
+
+# Default cache settings (overridable via the `extraction_cache` config section)
+DEFAULT_CACHE_DIR = "cache/extraction"
+DEFAULT_TTL_SECONDS = 7 * 24 * 60 * 60  # 7 days
+DEFAULT_RECENT_RESULTS_SIZE = 256
+
+
+def _length_prefixed(value: bytes) -> bytes:
+    """Prefix a key component with its 8-byte length so components cannot run together."""
+    return len(value).to_bytes(8, "big") + value
+
+
+def make_cache_key(agent_type: str,
+                   prompt_version: str,
+                   content: Union[str, bytes],
+                   provider: str = "",
+                   model: str = "") -> str:
+    """
+    Build a deterministic cache key for a piece of file content.
+
+    Every component is length-prefixed before hashing, so a result is only
+    reused for the same provider, model, prompt and file bytes.
+
+    Args:
+        agent_type: The agent type used for extraction (text or image prompt)
+        prompt_version: Version of the extraction prompt
+        content: Raw file bytes or text content
+        provider: LLM provider that produced the result
+        model: Model name that produced the result
+
+    Returns:
+        Cache key string
+    """
+    if isinstance(content, str):
+        content = content.encode("utf-8")
+    digest = hashlib.sha256()
+    for component in (provider, model, str(agent_type), prompt_version):
+        digest.update(_length_prefixed(component.encode("utf-8")))
+    digest.update(_length_prefixed(content))
+    return f"{agent_type}:{prompt_version}:{digest.hexdigest()}"
+
+
+class ExtractionCache:
+    """File-backed cache of extraction results with a time-to-live."""
+
+    def __init__(self,
+                 cache_dir: Optional[Union[str, Path]] = None,
+                 ttl_seconds: Optional[int] = None,
+                 enabled: Optional[bool] = None):
+        """
+        Initialize the extraction cache.
+
+        Args:
+            cache_dir: Directory holding the cached JSON entries
+            ttl_seconds: Time-to-live for cached entries in seconds
+            enabled: Whether the cache is active
+        """
+        cache_config = config.get("extraction_cache", default={}) or {}
+        env_cache_dir = os.environ.get("EXTRACTION_CACHE_DIR")
+
+        self.cache_dir = Path(cache_dir or env_cache_dir or cache_config.get("directory", DEFAULT_CACHE_DIR))
+        self.ttl_seconds = int(ttl_seconds if ttl_seconds is not None
+                               else cache_config.get("ttl_seconds", DEFAULT_TTL_SECONDS))
+        if enabled is None:
+            # Off by default: setting EXTRACTION_CACHE_DIR (or the config flag) opts in
+            enabled = bool(env_cache_dir) or (
+                str(cache_config.get("enabled", False)).lower() in ("true", "1", "yes")
+            )
+        self.enabled = enabled
+
+    def _path_for(self, key: str) -> Path:
+        """Map a cache key to its file path."""
+        file_name = hashlib.sha256(key.encode("utf-8")).hexdigest()
+        return self.cache_dir / f"{file_name}.json"
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        """
+        Look up a cached extraction result.
+
+        Args:
+            key: Cache key built with make_cache_key
+
+        Returns:
+            The cached result, or None if missing or expired
+        """
+        if not self.enabled:
+            return None
+
+        path = self._path_for(key)
+        try:
+            with open(path, "r") as f:
+                entry = json.load(f)
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError) as e:
+            logger.warning(f"Discarding unreadable extraction cache entry {path}: {str(e)}")
+            self.delete(key)
+            return None
+
+        if entry.get("key") != key or entry.get("expires_at", 0) < time.time():
+            self.delete(key)
+            return None
+
+        return entry.get("value")
+
+    def put(self, key: str, value: Dict[str, Any], model: Optional[str] = None) -> None:
+        """
+        Store an extraction result.
+
+        Args:
+            key: Cache key built with make_cache_key
+            value: Parsed extraction result to cache
+            model: Model that produced the result, recorded for debugging
+        """
+        if not self.enabled:
+            return
+
+        path = self._path_for(key)
+        entry = {
+            "key": key,
+            "expires_at": time.time() + self.ttl_seconds,
+            "created_at": datetime.utcnow().isoformat(),
+            "model": model,
+            "value": value
+        }
+        try:
+            self.cache_dir.mkdir(parents=True, exist_ok=True)
+            # Write to a temporary file first so readers never see a partial entry
+            tmp_path = path.with_suffix(f".{os.getpid()}.tmp")
+            with open(tmp_path, "w") as f:
+                json.dump(entry, f)
+            os.replace(tmp_path, path)
+        except (OSError, TypeError, ValueError) as e:
+            logger.warning(f"Failed to write extraction cache entry: {str(e)}")
+
+    def delete(self, key: str) -> None:
+        """
+        Remove a cached extraction result.
+
+        Args:
+            key: Cache key built with make_cache_key
+        """
+        try:
+            self._path_for(key).unlink()
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            logger.warning(f"Failed to delete extraction cache entry: {str(e)}")
+
+
+class RecentResultCache:
+    """In-process LRU cache of recent results, e.g. for repeated uploads of one file."""
+
+    def __init__(self, maxsize: int = DEFAULT_RECENT_RESULTS_SIZE):
+        """
+        Initialize the cache.
+
+        Args:
+            maxsize: Maximum number of results to keep
+        """
+        self.maxsize = maxsize
+        self._entries: "OrderedDict[Hashable, Any]" = OrderedDict()
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        """
+        Look up a recent result and mark it as most recently used.
+
+        Args:
+            key: Cache key
+
+        Returns:
+            The cached result, or None if not present
+        """
+        value = self._entries.get(key)
+        if value is not None:
+            self._entries.move_to_end(key)
+        return value
+
+    def put(self, key: Hashable, value: Any) -> None:
+        """
+        Store a result, evicting the least recently used one if full.
+
+        Args:
+            key: Cache key
+            value: Result to store
+        """
+        self._entries[key] = value
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+
+    def clear(self) -> None:
+        """Remove all cached results."""
+        self._entries.clear()
+
+
+# Create singleton instances
+extraction_cache = ExtractionCache()
+recent_extraction_results = RecentResultCache()
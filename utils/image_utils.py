@@ -0,0 +1,123 @@
+"""
+Lightweight image header inspection.
+
+This module reads image dimensions and formats straight from the file
+header for the common invoice formats (JPEG, PNG, GIF, WebP), so callers
+do not need to decode the image with PIL just to describe it.
+"""
+import logging
+import struct
+from typing import Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# MIME types for the formats recognised by peek_image_info
+IMAGE_MIME_TYPES = {
+    "jpeg": "image/jpeg",
+    "png": "image/png",
+    "gif": "image/gif",
+    "webp": "image/webp",
+}
+
+# JPEG start-of-frame markers that carry the image size
+# (C4 = DHT, C8 = JPG extension and CC = DAC are not frames)
+_JPEG_SOF_MARKERS = frozenset(range(0xC0, 0xD0)) - {0xC4, 0xC8, 0xCC}
+
+
+def _peek_jpeg(data: bytes) -> Optional[Tuple[int, int]]:
+    """Walk the JPEG marker segments until a start-of-frame header is found."""
+    offset = 2
+    size = len(data)
+    while offset + 4 <= size:
+        if data[offset] != 0xFF:
+            return None
+        marker = data[offset + 1]
+        if marker == 0xFF:
+            # Fill byte before a marker
+            offset += 1
+            continue
+        if marker in (0xD8, 0x01) or 0xD0 <= marker <= 0xD7:
+            # Markers without a length field
+            offset += 2
+            continue
+        segment_length = struct.unpack_from(">H", data, offset + 2)[0]
+        if marker in _JPEG_SOF_MARKERS:
+            if offset + 9 > size:
+                return None
+            height, width = struct.unpack_from(">HH", data, offset + 5)
+            return width, height
+        offset += 2 + segment_length
+    return None
+
+
+def _peek_webp(data: bytes) -> Optional[Tuple[int, int]]:
+    """Read the canvas size from the first WebP chunk."""
+    chunk = data[12:16]
+    if chunk == b"VP8 " and len(data) >= 30:
+        width, height = struct.unpack_from("<HH", data, 26)
+        return width & 0x3FFF, height & 0x3FFF
+    if chunk == b"VP8L" and len(data) >= 25:
+        b0, b1, b2, b3 = data[21], data[22], data[23], data[24]
+        width = 1 + (((b1 & 0x3F) << 8) | b0)
+        height = 1 + (((b3 & 0x0F) << 10) | (b2 << 2) | ((b1 & 0xC0) >> 6))
+        return width, height
+    if chunk == b"VP8X" and len(data) >= 30:
+        width = 1 + int.from_bytes(data[24:27], "little")
+        height = 1 + int.from_bytes(data[27:30], "little")
+        return width, height
+    return None
+
+
+def detect_image_format(data: bytes) -> Optional[str]:
+    """
+    Detect the image format from its magic bytes.
+
+    Args:
+        data: Raw file bytes (only the first few bytes are inspected)
+
+    Returns:
+        The format name ("jpeg", "png", "gif" or "webp"), or None if unknown
+    """
+    if data.startswith(b"\xff\xd8\xff"):
+        return "jpeg"
+    if data.startswith(b"\x89PNG\r\n\x1a\n"):
+        return "png"
+    if data.startswith((b"GIF87a", b"GIF89a")):
+        return "gif"
+    if data.startswith(b"RIFF") and data[8:12] == b"WEBP":
+        return "webp"
+    return None
+
+
+def peek_image_info(data: bytes) -> Optional[Tuple[int, int, str]]:
+    """
+    Get image dimensions and format by parsing the file header.
+
+    Args:
+        data: Raw image bytes
+
+    Returns:
+        Tuple of (width, height, format), or None if the format is not
+        recognised or the header is truncated
+    """
+    image_format = detect_image_format(data)
+    dimensions = None
+
+    try:
+        if image_format == "png" and data[12:16] == b"IHDR":
+            dimensions = struct.unpack_from(">II", data, 16)
+        elif image_format == "gif":
+            dimensions = struct.unpack_from("<HH", data, 6)
+        elif image_format == "webp":
+            dimensions = _peek_webp(data)
+        elif image_format == "jpeg":
+            dimensions = _peek_jpeg(data)
+    except struct.error:
+        logger.debug("Truncated image header")
+        return None
+
+    if not dimensions:
+        return None
+
+    width, height = dimensions
+    return width, height, image_format
@@ -0,0 +1,137 @@
+"""
+JSON helpers with an optional fast path.
+
+Parsing and serialization go through orjson when it is installed and fall
+back to the standard library json module otherwise, so callers get the same
+results either way. Large documents can be stream-parsed with ijson when it is
+installed, keeping only the parts the caller needs.
+"""
+import io
+import json
+import logging
+from typing import Any, Callable, Collection, Dict, Optional, Union
+
+logger = logging.getLogger(__name__)
+
+# Try to import orjson, use the standard library if not available
+try:
+    import orjson
+    ORJSON_AVAILABLE = True
+except ImportError:
+    ORJSON_AVAILABLE = False
+    logger.debug("orjson not installed, using the standard json module")
+
+# Try to import ijson for streaming large documents
+try:
+    import ijson
+    from ijson.common import ObjectBuilder
+    IJSON_AVAILABLE = True
+except ImportError:
+    IJSON_AVAILABLE = False
+    logger.debug("ijson not installed, large documents will be parsed in full")
+
+# orjson.JSONDecodeError subclasses json.JSONDecodeError, so one except
+# clause covers both implementations
+JSONDecodeError = json.JSONDecodeError
+
+
+def loads(data: Union[str, bytes, bytearray, memoryview]) -> Any:
+    """
+    Parse a JSON document.
+    
+    Args:
+        data: JSON text as str or UTF-8 encoded bytes
+        
+    Returns:
+        The parsed Python object
+        
+    Raises:
+        JSONDecodeError: If the input is not valid JSON
+    """
+    if ORJSON_AVAILABLE:
+        return orjson.loads(data)
+    if isinstance(data, memoryview):
+        data = data.tobytes()
+    return json.loads(data)
+
+
+def dumps(obj: Any,
+          indent: bool = False,
+          default: Optional[Callable[[Any], Any]] = None) -> str:
+    """
+    Serialize an object to a JSON string, keeping non-ASCII characters as is.
+    
+    Without indentation the output has no whitespace between tokens.
+    
+    Args:
+        obj: The object to serialize
+        indent: Whether to indent nested values by two spaces
+        default: Called for values neither implementation serializes natively,
+            e.g. Decimal; must return a serializable value or raise TypeError.
+            With the standard library it also receives datetime values, so it
+            should convert those to ISO 8601 strings as orjson does.
+        
+    Returns:
+        The JSON text
+        
+    Raises:
+        TypeError: If a value cannot be serialized
+    """
+    if ORJSON_AVAILABLE:
+        option = orjson.OPT_NON_STR_KEYS | (orjson.OPT_INDENT_2 if indent else 0)
+        return orjson.dumps(obj, default=default, option=option).decode("utf-8")
+    if indent:
+        return json.dumps(obj, ensure_ascii=False, indent=2, default=default)
+    return json.dumps(obj, ensure_ascii=False, separators=(",", ":"), default=default)
+
+
+def _select_keys(obj: Any, keys: Collection[str]) -> Any:
+    """Keep only the given keys of a parsed object; other values pass through."""
+    if isinstance(obj, dict):
+        return {key: value for key, value in obj.items() if key in keys}
+    return obj
+
+
+def loads_keys(data: Union[str, bytes], keys: Collection[str]) -> Any:
+    """
+    Parse a JSON object, keeping only the given top-level keys.
+    
+    With ijson installed the document is streamed and values under other keys
+    are never built, which keeps peak memory down for large payloads.
+    Documents that are not objects are returned whole.
+    
+    Args:
+        data: JSON text as str or UTF-8 encoded bytes
+        keys: Top-level keys to keep
+        
+    Returns:
+        The parsed object restricted to the given keys
+        
+    Raises:
+        JSONDecodeError: If the input is not valid JSON
+    """
+    if not IJSON_AVAILABLE:
+        return _select_keys(loads(data), keys)
+    
+    if isinstance(data, str):
+        data = data.encode("utf-8")
+    
+    builders: Dict[str, ObjectBuilder] = {}
+    builder = None
+    try:
+        for prefix, event, value in ijson.parse(io.BytesIO(data), use_float=True):
+            if prefix == "":
+                if event == "map_key":
+                    # Only build values for the wanted keys; a repeated key replaces the earlier value
+                    builder = ObjectBuilder() if value in keys else None
+                    if builder is not None:
+                        builders[value] = builder
+                elif event not in ("start_map", "end_map"):
+                    # Not an object at the top level
+                    return loads(data)
+            elif builder is not None:
+                builder.event(event, value)
+    except ijson.JSONError as e:
+        raise JSONDecodeError(str(e), "", 0) from e
+    
+    return {key: builder.value for key, builder in builders.items()}
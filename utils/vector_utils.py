@@ -10,6 +10,7 @@ import numpy as np
 import random
 import hashlib
 import functools
+import threading
 
 from utils.config import config
 
@@ -28,14 +29,31 @@ except ImportError:
 logger = logging.getLogger(__name__)
 
 # Embedding cache
-_embedding_cache = {}  # Simple in-memory cache
+_embedding_cache = {}  # In-memory LRU cache, ordered from least to most recently used
 _cache_size_limit = 1000  # Limit cache size to avoid memory issues
+_cache_lock = threading.Lock()  # Storage runs in worker threads, so guard the reorder/evict steps
 
 # Function to generate a deterministic cache key
 def _cache_key(text: str) -> str:
     """Generate a unique, deterministic cache key for text."""
     return hashlib.md5(text.encode('utf-8')).hexdigest()
 
+def _get_cached_embedding(cache_key: str) -> Optional[List[float]]:
+    """Look up a cached embedding and mark it as most recently used."""
+    with _cache_lock:
+        embedding = _embedding_cache.pop(cache_key, None)
+        if embedding is not None:
+            _embedding_cache[cache_key] = embedding
+    return embedding
+
+def _cache_embedding(cache_key: str, embedding: List[float]) -> None:
+    """Cache an embedding, evicting the least recently used ones when the cache is full."""
+    with _cache_lock:
+        _embedding_cache.pop(cache_key, None)
+        _embedding_cache[cache_key] = embedding
+        while len(_embedding_cache) > _cache_size_limit:
+            del _embedding_cache[next(iter(_embedding_cache))]
+
 try:
     import openai
     from openai import OpenAI
@@ -107,9 +125,10 @@ class EmbeddingGenerator:
             
         # Check cache first
         cache_key = _cache_key(text)
-        if cache_key in _embedding_cache:
+        cached_embedding = _get_cached_embedding(cache_key)
+        if cached_embedding is not None:
             logger.debug(f"Using cached embedding for text: {text[:50]}...")
-            return _embedding_cache[cache_key]
+            return cached_embedding
             
         # OpenAI approach
         if self.use_openai and self.openai_client:
@@ -123,9 +142,8 @@ class EmbeddingGenerator:
                 embedding = response.data[0].embedding
                 
                 # Cache the embedding
-                if len(_embedding_cache) < _cache_size_limit:
-                    _embedding_cache[cache_key] = embedding
-                    logger.debug(f"Added OpenAI embedding to cache. Cache size: {len(_embedding_cache)}")
+                _cache_embedding(cache_key, embedding)
+                logger.debug(f"Added OpenAI embedding to cache. Cache size: {len(_embedding_cache)}")
                 
                 return embedding
             except Exception as e:
@@ -139,9 +157,8 @@ class EmbeddingGenerator:
                 embedding = self.model.encode(text).tolist()
                 
                 # Cache the embedding
-                if len(_embedding_cache) < _cache_size_limit:
-                    _embedding_cache[cache_key] = embedding
-                    logger.debug(f"Added embedding to cache. Cache size: {len(_embedding_cache)}")
+                _cache_embedding(cache_key, embedding)
+                logger.debug(f"Added embedding to cache. Cache size: {len(_embedding_cache)}")
                 
                 return embedding
             except Exception as e:
@@ -160,9 +177,8 @@ class EmbeddingGenerator:
         embedding = [(random.random() * 2 - 1) * 0.1 for _ in range(self.embedding_dim)]
         
         # Cache the fallback embedding
-        if len(_embedding_cache) < _cache_size_limit:
-            _embedding_cache[cache_key] = embedding
-            logger.debug(f"Added fallback embedding to cache. Cache size: {len(_embedding_cache)}")
+        _cache_embedding(cache_key, embedding)
+        logger.debug(f"Added fallback embedding to cache. Cache size: {len(_embedding_cache)}")
         
         return embedding
 
@@ -188,19 +204,21 @@ class EmbeddingGenerator:
                 if not valid_texts:
                     return [None] * len(texts)
                 
-                # Check cache for all texts
+                # Check cache for all texts. Repeated texts (e.g. the same item
+                # on several lines) are only sent to the API once.
                 embeddings = []
-                uncached_indices = []
+                uncached_indices = {}  # cache key -> indices of texts waiting for it
                 uncached_texts = []
                 
                 for i, text in enumerate(valid_texts):
                     cache_key = _cache_key(text)
-                    if cache_key in _embedding_cache:
-                        embeddings.append(_embedding_cache[cache_key])
-                    else:
-                        embeddings.append(None)  # Placeholder
-                        uncached_indices.append(i)
-                        uncached_texts.append(text)
+                    cached_embedding = _get_cached_embedding(cache_key)
+                    embeddings.append(cached_embedding)  # None is a placeholder
+                    if cached_embedding is None:
+                        if cache_key not in uncached_indices:
+                            uncached_indices[cache_key] = []
+                            uncached_texts.append(text)
+                        uncached_indices[cache_key].append(i)
                 
                 # If there are uncached texts, get their embeddings
                 if uncached_texts:
@@ -211,15 +229,14 @@ class EmbeddingGenerator:
                     )
                     
                     # Update embeddings list and cache
-                    for i, embedding_data in enumerate(response.data):
-                        original_idx = uncached_indices[i]
+                    for text, embedding_data in zip(uncached_texts, response.data):
                         embedding = embedding_data.embedding
-                        embeddings[original_idx] = embedding
+                        cache_key = _cache_key(text)
+                        for original_idx in uncached_indices[cache_key]:
+                            embeddings[original_idx] = embedding
                         
                         # Cache the embedding
-                        cache_key = _cache_key(uncached_texts[i])
-                        if len(_embedding_cache) < _cache_size_limit:
-                            _embedding_cache[cache_key] = embedding
+                        _cache_embedding(cache_key, embedding)
                 
                 # Map back to original texts order (including empty texts)
                 result = []
@@ -267,17 +284,18 @@ def generate_embedding_for_text(text: str) -> Optional[List[float]]:
         
     # Check cache first
     cache_key = _cache_key(text)
-    if cache_key in _embedding_cache:
+    cached_embedding = _get_cached_embedding(cache_key)
+    if cached_embedding is not None:
         logger.debug(f"Cache hit for embedding: {text[:50]}...")
-        return _embedding_cache[cache_key]
+        return cached_embedding
     
     # Generate embedding
     generator = get_embedding_generator()
     embedding = generator.generate_embedding(text)
     
     # Cache if valid
-    if embedding and len(_embedding_cache) < _cache_size_limit:
-        _embedding_cache[cache_key] = embedding
+    if embedding:
+        _cache_embedding(cache_key, embedding)
         logger.debug(f"Added embedding to cache. Cache size: {len(_embedding_cache)}")
     
     return embedding